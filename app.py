@@ -15,19 +15,37 @@ Architektur:
 """
 
 import os
+import csv
+import io
 import json
+import importlib
+import asyncio
+import contextlib
+import hashlib
+import hmac
 import logging
 import time
+import heapq
+import itertools
+from bisect import bisect_left
+from collections import OrderedDict
+import secrets
+import socket
+import sqlite3
 import threading
+import uuid
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime, timezone
 from typing import Optional
+from urllib.parse import urlsplit
 
-import gspread
-import stripe
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from dotenv import load_dotenv
-from fastapi import FastAPI, Request, HTTPException, BackgroundTasks
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, Request, HTTPException, Query
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 
 # ─── Konfiguration ───────────────────────────────────────────────────────────
 load_dotenv()
@@ -42,7 +60,8 @@ logger = logging.getLogger("lead-verteilung")
 # META API (Lina's Business Account - nur zum SENDEN!)
 META_TOKEN = os.getenv("META_TOKEN", "EAARgaZCn3eoYBO0Tr9nSqfmJYOcx3gx3NAzSdwekRpZB5rfmWH2poZAvKSXXVBdR0HDqiXAEbfESzfejzSYLTCkhZAxs0bVZCMufcy51ZBN16zkDlpy8bcaUL5Omu6FTLW37O30I9uO51HSgfZBZBYz6qPEQ49RVEMWNrJmnrvvmrwCgAlJaJB7eHk2GvDdU8pKYkwZDZD")
 META_PHONE_ID = os.getenv("META_PHONE_ID", "623007617563961")
-META_URL = f"https://graph.facebook.com/v22.0/{META_PHONE_ID}/messages"
+META_API_BASE = os.getenv("META_API_BASE", "https://graph.facebook.com/v22.0")
+META_URL = f"{META_API_BASE}/{META_PHONE_ID}/messages"
 
 # MATZE'S NUMMER (empfängt ALLE Admin-Benachrichtigungen!)
 MATZE_PHONE = "491715060008"  # ← Hardcoded, keine Env-Variable!
@@ -51,6 +70,8 @@ MATZE_PHONE = "491715060008"  # ← Hardcoded, keine Env-Variable!
 GOOGLE_SHEET_ID = os.getenv("GOOGLE_SHEET_ID", "1wVevVuP1sm_2g7eg37rCYSVSoF_T6rjNj89Qkoh9DIY")
 FB_VERIFY_TOKEN = os.getenv("FB_VERIFY_TOKEN", "mein_geheimer_token_2024")
 LEAD_PREIS = float(os.getenv("LEAD_PREIS", "5"))
+# Höchstens so viele Leads pro Partner und Poll-Zyklus (0 = unbegrenzt)
+MAX_LEADS_PER_CYCLE = int(os.getenv("MAX_LEADS_PER_CYCLE", "0"))
 
 # Google Credentials
 GOOGLE_CREDENTIALS_JSON = os.getenv("GOOGLE_CREDENTIALS_JSON", "")
@@ -59,11 +80,130 @@ GOOGLE_CREDENTIALS_FILE = os.getenv("GOOGLE_CREDENTIALS_FILE", "credentials.json
 # Facebook & Stripe
 FB_ACCESS_TOKEN = os.getenv("FB_ACCESS_TOKEN", "")
 STRIPE_WEBHOOK_SECRET = os.getenv("STRIPE_WEBHOOK_SECRET", "")
-stripe.api_key = os.getenv("STRIPE_SECRET_KEY", "")
+STRIPE_SECRET_KEY = os.getenv("STRIPE_SECRET_KEY", "")
+STRIPE_API_BASE = os.getenv("STRIPE_API_BASE", "")  # leer = api.stripe.com; sonst z. B. ein lokaler Fake
+
+# Stripe-Abgleich: ganz frische Sessions auslassen (Webhook evtl. noch unterwegs),
+# Korrekturen in Blöcken schreiben
+RECONCILE_GRACE_SECONDS = int(os.getenv("RECONCILE_GRACE_SECONDS", "900"))
+RECONCILE_BATCH = int(os.getenv("RECONCILE_BATCH", "200"))
+RECONCILE_REPORT_LIMIT = 500
+
+POLL_INTERVAL = int(os.getenv("POLL_INTERVAL", "60"))         # Start-Intervall
+POLL_MIN_INTERVAL = float(os.getenv("POLL_MIN_INTERVAL", "5"))
+POLL_MAX_INTERVAL = float(os.getenv("POLL_MAX_INTERVAL", "300"))
+
+# WhatsApp-Versand: Worker + Token-Bucket pro Absender-Nummer und pro Empfänger
+WA_WORKERS = int(os.getenv("WA_WORKERS", "4"))
+WA_SENDER_RATE = float(os.getenv("WA_SENDER_RATE", "20"))       # Nachrichten/s
+WA_SENDER_BURST = int(os.getenv("WA_SENDER_BURST", "40"))
+WA_RECIPIENT_RATE = float(os.getenv("WA_RECIPIENT_RATE", "1"))  # Nachrichten/s
+WA_RECIPIENT_BURST = int(os.getenv("WA_RECIPIENT_BURST", "5"))
+
+# Admin-Digest: Meldungen an Matze gesammelt pro Zeitfenster bzw. Anzahl
+# (ADMIN_DIGEST_SECONDS=0 → jede Meldung sofort wie früher)
+ADMIN_DIGEST_SECONDS = int(os.getenv("ADMIN_DIGEST_SECONDS", "300"))
+ADMIN_DIGEST_MAX_EVENTS = int(os.getenv("ADMIN_DIGEST_MAX_EVENTS", "50"))
+
+# Meta HTTP-Client (Keep-Alive-Pool, getrennte Timeouts, Retries bei 429/5xx)
+META_CONNECT_TIMEOUT = float(os.getenv("META_CONNECT_TIMEOUT", "5"))
+META_READ_TIMEOUT = float(os.getenv("META_READ_TIMEOUT", "20"))
+META_MAX_RETRIES = int(os.getenv("META_MAX_RETRIES", "3"))
+
+# Facebook Lead Ads: leadgen_ids sammeln und gebündelt über die Graph-API holen
+FB_BATCH_WINDOW = float(os.getenv("FB_BATCH_WINDOW", "2"))
+FB_BATCH_MAX = 50  # Limit der Graph-API für ?ids=
+
+# Idempotenz: wie lange verarbeitete Event-IDs gemerkt werden
+EVENT_RETENTION_DAYS = int(os.getenv("EVENT_RETENTION_DAYS", "30"))
+
+# Webhook-Pipeline: Queue-Größe (Backpressure) und Anzahl Consumer.
+# LEAD_QUEUE_SIZE zählt nur Webhook-Jobs – Sheet-Zeilen des Pollers nicht.
+LEAD_QUEUE_SIZE = int(os.getenv("LEAD_QUEUE_SIZE", "500"))
+WEBHOOK_JOB_KINDS = ("lead", "stripe")
+LEAD_WORKERS = int(os.getenv("LEAD_WORKERS", "4"))
+
+# Durable Job-Queue: Wiederholungen mit exponentiellem Backoff, danach Dead-Letter
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+JOB_BACKOFF_BASE = float(os.getenv("JOB_BACKOFF_BASE", "5"))
+JOB_BACKOFF_MAX = float(os.getenv("JOB_BACKOFF_MAX", "600"))
+JOB_SWEEP_SECONDS = 60
+JOB_IDLE_WAIT = 1.0
+# Status-Updates (VERTEILT/FEHLER) werden gesammelt und alle N Leads geschrieben
+STATUS_FLUSH_EVERY = int(os.getenv("STATUS_FLUSH_EVERY", "20"))
+
+# Lokaler Zustand (Polling-Stand usw.)
+STATE_DIR = os.getenv("STATE_DIR", "data")
+POLL_STATE_FILE = os.path.join(STATE_DIR, "poll_state.json")
+# Nach so vielen inkrementellen Polls einmal das ganze Blatt prüfen
+POLL_FULL_SCAN_EVERY = int(os.getenv("POLL_FULL_SCAN_EVERY", "60"))
+
+# Leads_Log wird gepuffert und gesammelt geschrieben
+LOG_FLUSH_SIZE = int(os.getenv("LOG_FLUSH_SIZE", "25"))
+LOG_FLUSH_SECONDS = float(os.getenv("LOG_FLUSH_SECONDS", "15"))
+LOG_SPOOL_FILE = os.path.join(STATE_DIR, "leads_log_spool.jsonl")
+# Export (/leads/export): Leads_Log in Blöcken lesen, Tagesdateien als Cache
+LEADS_EXPORT_CHUNK = int(os.getenv("LEADS_EXPORT_CHUNK", "2000"))
+LEADS_EXPORT_DIR = os.path.join(STATE_DIR, "leads_log_cache")
+
+# Lead-Claims über Prozess-/Instanzgrenzen: local | file | sqlite
+LEASE_BACKEND = os.getenv("LEASE_BACKEND", "local")
+STATE_DB = os.path.join(STATE_DIR, "state.db")
+CLAIM_TTL = int(os.getenv("CLAIM_TTL", "900"))
+
+# Partner-Ledger: SQLite als führender Speicher, Sheet als Spiegel
+LEDGER_ENABLED = os.getenv("LEDGER_ENABLED", "0") == "1"
+LEDGER_SYNC_SECONDS = float(os.getenv("LEDGER_SYNC_SECONDS", "5"))
+LEDGER_REFRESH_SECONDS = int(os.getenv("LEDGER_REFRESH_SECONDS", "300"))
+
+# ─── Lazy Imports ────────────────────────────
+class LazyModule:
+    """
+    Schwere SDKs (gspread/google-auth, stripe) erst beim ersten Zugriff
+    importieren. Das spart beim Kaltstart gut eine Sekunde; /health
+    antwortet, bevor Google oder Stripe überhaupt geladen sind.
+    """
+
+    def __init__(self, name, on_import=None):
+        self._name = name
+        self._on_import = on_import
+        self._module = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    start = time.perf_counter()
+                    module = importlib.import_module(self._name)
+                    if self._on_import:
+                        self._on_import(module)
+                    self._module = module
+                    logger.info(f"📦 {self._name} geladen ({(time.perf_counter() - start) * 1000:.0f} ms)")
+        return self._module
+
+    @property
+    def loaded(self):
+        return self._module is not None
+
+    def __getattr__(self, attr):
+        return getattr(self._module or self.load(), attr)
+
+
+def _configure_stripe(module):
+    module.api_key = STRIPE_SECRET_KEY
+    if STRIPE_API_BASE:
+        module.api_base = STRIPE_API_BASE
+
+
+gspread = LazyModule("gspread")
+google_auth_exceptions = LazyModule("google.auth.exceptions")
+stripe = LazyModule("stripe", on_import=_configure_stripe)
 
-POLL_INTERVAL = int(os.getenv("POLL_INTERVAL", "60"))
 
 # ─── Threading Lock ──────────────────────────
+# Verhindert überlappende Polls in DIESEM Prozess; über Instanzen hinweg
+# sorgen die Lead-Claims (LEASE_BACKEND) für Exklusivität.
 poll_lock = threading.Lock()
 
 # ─── FastAPI App ─────────────────────────────
@@ -75,50 +215,478 @@ app = FastAPI(
 logger.info(f"✅ System gestartet | Admin-Benachrichtigungen → {MATZE_PHONE}")
 
 
+# ─── Metriken (Prometheus) ───────────────────
+# Bewusst ohne prometheus_client: eine Messung ist ein Dict-Update unter
+# einem Lock, billig genug, um in Produktion immer an zu bleiben.
+METRIC_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+metrics_registry = []
+
+
+def _label_str(pairs):
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.values = {}
+        self.lock = threading.Lock()
+        metrics_registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(label, "")) for label in self.labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            items = list(self.values.items())
+        for key, value in items:
+            yield self.name, list(zip(self.labels, key)), value
+
+
+class Gauge:
+    """Wird beim Scrapen aus fn() gelesen – Zahl oder {Label-Tupel: Wert}."""
+    kind = "gauge"
+
+    def __init__(self, name, help_text, fn, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.fn = fn
+        metrics_registry.append(self)
+
+    def samples(self):
+        value = self.fn()
+        if not isinstance(value, dict):
+            value = {(): value}
+        for key, v in value.items():
+            if v is not None:
+                yield self.name, list(zip(self.labels, key)), v
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=METRIC_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self.values = {}  # Label-Tupel → [Zähler je Bucket (+Inf), Summe]
+        self.lock = threading.Lock()
+        metrics_registry.append(self)
+
+    def observe(self, seconds, **labels):
+        key = tuple(str(labels.get(label, "")) for label in self.labels)
+        i = bisect_left(self.buckets, seconds)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][i] += 1
+            entry[1] += seconds
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self.lock:
+            items = [(key, list(counts), total) for key, (counts, total) in self.values.items()]
+        for key, counts, total in items:
+            pairs = list(zip(self.labels, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                yield f"{self.name}_bucket", pairs + [("le", bound)], cumulative
+            yield f"{self.name}_sum", pairs, round(total, 6)
+            yield f"{self.name}_count", pairs, cumulative
+
+
+def render_metrics():
+    lines = []
+    for metric in metrics_registry:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        try:
+            for name, pairs, value in metric.samples():
+                lines.append(f"{name}{_label_str(pairs)} {value}")
+        except Exception as e:
+            logger.error(f"Metrik {metric.name} nicht lesbar: {e}")
+    return "\n".join(lines) + "\n"
+
+
+lead_stage_seconds = Histogram(
+    "lead_stage_seconds", "Dauer je Schritt der Lead-Verteilung", ("stage",))
+lead_delivery_seconds = Histogram(
+    "lead_delivery_seconds", "Webhook bzw. Poll bis Lead zugestellt", ("source",))
+api_requests_total = Counter(
+    "api_requests_total", "HTTP-Requests an Google/Meta", ("api", "endpoint", "code"))
+api_errors_total = Counter(
+    "api_errors_total", "Fehlgeschlagene Requests an Google/Meta", ("api", "endpoint", "reason"))
+api_request_seconds = Histogram(
+    "api_request_seconds", "Dauer der Requests an Google/Meta", ("api", "endpoint"))
+
+
+def count_api_status(api, endpoint, code):
+    api_requests_total.inc(api=api, endpoint=endpoint, code=code)
+    if code == 429:
+        api_errors_total.inc(api=api, endpoint=endpoint, reason="rate_limited")
+    elif code >= 400:
+        api_errors_total.inc(api=api, endpoint=endpoint, reason=f"http_{code // 100}xx")
+
+
+def observe_api_response(api, endpoint, response):
+    code = response.status_code
+    count_api_status(api, endpoint, code)
+    api_request_seconds.observe(response.elapsed.total_seconds(), api=api, endpoint=endpoint)
+    record_dependency(api, code < 400, f"HTTP {code} ({endpoint})")
+
+
+# Letzter Erfolg/Fehler je externer API – Grundlage für /ready, das selbst
+# nie Google oder Meta anfragt
+dependency_health = {api: {"last_ok_at": None, "last_error_at": None, "last_error": None}
+                     for api in ("google", "meta")}
+
+
+def record_dependency(api, ok, error=None):
+    health = dependency_health.setdefault(api, {"last_ok_at": None, "last_error_at": None, "last_error": None})
+    if ok:
+        health["last_ok_at"] = time.time()
+    else:
+        health["last_error_at"] = time.time()
+        health["last_error"] = error
+
+
+def google_endpoint(request):
+    """Niedrige Kardinalität: Sheets-Methode statt voller URL."""
+    path = urlsplit(request.url).path
+    if "/values:" in path:
+        return path.rsplit("/", 1)[-1]            # values:batchGet, values:batchUpdate
+    if "/values/" in path:
+        if path.endswith((":append", ":clear")):
+            return "values:" + path.rsplit(":", 1)[-1]
+        return f"values.{request.method.lower()}"
+    if path.endswith(":batchUpdate"):
+        return "spreadsheets:batchUpdate"
+    if "/spreadsheets" in path:
+        return "spreadsheets.get"
+    return "other"
+
+
 # ─── Google Sheets ───────────────────────────
+# Client, Spreadsheet und Worksheets werden prozessweit gecacht. Das Token
+# erneuert die AuthorizedSession selbst; neu aufgebaut wird nur nach Ablauf
+# von SHEETS_CACHE_TTL oder nach einem Auth-Fehler.
+SHEETS_CACHE_TTL = int(os.getenv("SHEETS_CACHE_TTL", "1800"))
+
+_sheets_lock = threading.Lock()
+_sheets_cache = {"client": None, "spreadsheet": None, "worksheets": {}, "created": 0.0}
+
+# Zähler für Google-API-Roundtrips (jeder HTTP-Request an Sheets/Drive)
+google_api_stats = {"calls": 0, "token_refreshes": 0, "client_builds": 0}
+
+
+def _count_google_call(response, *args, **kwargs):
+    google_api_stats["calls"] += 1
+    observe_api_response("google", google_endpoint(response.request), response)
+    return response
+
+
 def get_google_client():
     if GOOGLE_CREDENTIALS_JSON:
         creds_dict = json.loads(GOOGLE_CREDENTIALS_JSON)
-        return gspread.service_account_from_dict(creds_dict)
-    return gspread.service_account(filename=GOOGLE_CREDENTIALS_FILE)
+        client = gspread.service_account_from_dict(creds_dict)
+    else:
+        client = gspread.service_account(filename=GOOGLE_CREDENTIALS_FILE)
+
+    http = client.http_client
+    http.session.hooks["response"].append(_count_google_call)
+
+    creds = http.auth
+    original_refresh = creds.refresh
+
+    def counting_refresh(request):
+        google_api_stats["token_refreshes"] += 1
+        return original_refresh(request)
+
+    creds.refresh = counting_refresh
+    google_api_stats["client_builds"] += 1
+    return client
+
+
+def invalidate_google_cache(reason=""):
+    with _sheets_lock:
+        _sheets_cache["client"] = None
+        _sheets_cache["spreadsheet"] = None
+        _sheets_cache["worksheets"] = {}
+        _sheets_cache["created"] = 0.0
+    logger.warning(f"🔄 Google-Cache verworfen {reason}".rstrip())
+
+
+def is_google_auth_error(e):
+    if isinstance(e, google_auth_exceptions.RefreshError):
+        return True
+    if isinstance(e, gspread.exceptions.APIError):
+        return getattr(e.response, "status_code", None) in (401, 403)
+    return False
+
+
+def check_google_error(e):
+    """Verwirft den Client-Cache, falls der Fehler ein Auth-Problem ist."""
+    record_dependency("google", False, f"{type(e).__name__}: {e}")
+    if is_google_auth_error(e):
+        api_errors_total.inc(api="google", endpoint="auth", reason="auth")
+        invalidate_google_cache(f"(Auth-Fehler: {e})")
+    elif not isinstance(e, gspread.exceptions.APIError):
+        # APIErrors hat der Response-Hook schon gezählt
+        api_errors_total.inc(api="google", endpoint="client", reason=type(e).__name__)
 
 
 def get_spreadsheet():
-    return get_google_client().open_by_key(GOOGLE_SHEET_ID)
+    with _sheets_lock:
+        expired = time.time() - _sheets_cache["created"] > SHEETS_CACHE_TTL
+        if _sheets_cache["spreadsheet"] is None or expired:
+            client = get_google_client()
+            _sheets_cache["client"] = client
+            _sheets_cache["spreadsheet"] = client.open_by_key(GOOGLE_SHEET_ID)
+            _sheets_cache["worksheets"] = {}
+            _sheets_cache["created"] = time.time()
+        return _sheets_cache["spreadsheet"]
+
+
+def get_worksheet(title):
+    spreadsheet = get_spreadsheet()
+    ws = _sheets_cache["worksheets"].get(title)
+    if ws is None:
+        try:
+            ws = spreadsheet.worksheet(title)
+        except Exception as e:
+            check_google_error(e)
+            raise
+        _sheets_cache["worksheets"][title] = ws
+    return ws
 
 
 def get_partner_sheet():
-    return get_spreadsheet().worksheet("Partner_Konto")
+    return get_worksheet("Partner_Konto")
 
 
 def get_leads_sheet():
-    return get_spreadsheet().worksheet("Tabellenblatt1")
+    return get_worksheet("Tabellenblatt1")
+
+
+LEADS_LOG_HEADER = ["Zeitstempel", "Lead_Name", "Lead_Telefon", "Lead_Email",
+                    "Partner_Name", "Partner_Telefon", "Guthaben_Nachher",
+                    "WhatsApp_Partner", "Status"]
 
 
 def get_leads_log_sheet():
     try:
-        return get_spreadsheet().worksheet("Leads_Log")
-    except:
+        return get_worksheet("Leads_Log")
+    except gspread.exceptions.WorksheetNotFound:
         ws = get_spreadsheet().add_worksheet(title="Leads_Log", rows=1000, cols=10)
-        ws.append_row(["Zeitstempel", "Lead_Name", "Lead_Telefon", "Lead_Email",
-                       "Partner_Name", "Partner_Telefon", "Guthaben_Nachher",
-                       "WhatsApp_Partner", "Status"], value_input_option="USER_ENTERED")
+        ws.append_row(LEADS_LOG_HEADER, value_input_option="USER_ENTERED")
+        _sheets_cache["worksheets"]["Leads_Log"] = ws
         return ws
 
 
+class LeadLogBuffer:
+    """
+    Write-Behind für Leads_Log: Zeilen landen erst im Speicher und in einer
+    Spool-Datei (übersteht einen Neustart) und werden dann gesammelt mit
+    einem append_rows() geschrieben – ab LOG_FLUSH_SIZE Zeilen, spätestens
+    nach LOG_FLUSH_SECONDS und beim Shutdown.
+    """
+
+    def __init__(self, spool_file):
+        self.spool_file = spool_file
+        self.rows = None
+        self.sheet = None
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.timer = None
+        self.retry_at = 0.0
+
+    def _load_spool(self):
+        # Nur unter self.lock aufrufen
+        if self.rows is not None:
+            return
+        self.rows = []
+        try:
+            with open(self.spool_file, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        self.rows.append(json.loads(line))
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.error(f"Log-Spool nicht lesbar: {e}")
+        if self.rows:
+            logger.info(f"📥 {len(self.rows)} Log-Zeilen aus Spool übernommen")
+
+    def _write_spool(self, rows, mode):
+        try:
+            os.makedirs(os.path.dirname(self.spool_file) or ".", exist_ok=True)
+            target = self.spool_file if mode == "a" else self.spool_file + ".tmp"
+            with open(target, mode, encoding="utf-8") as f:
+                for row in rows:
+                    f.write(json.dumps(row, ensure_ascii=False) + "\n")
+            if mode != "a":
+                os.replace(target, self.spool_file)
+        except OSError as e:
+            logger.error(f"Log-Spool nicht geschrieben: {e}")
+
+    def append(self, row):
+        with self.lock:
+            self._load_spool()
+            self.rows.append(row)
+            self._write_spool([row], "a")
+            pending = len(self.rows)
+            if self.timer is None:
+                self.timer = threading.Thread(target=self._timer_loop, daemon=True)
+                self.timer.start()
+        if pending >= LOG_FLUSH_SIZE and time.time() >= self.retry_at:
+            self.flush()
+
+    def pending(self):
+        with self.lock:
+            return len(self.rows or [])
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                self._load_spool()
+                batch = list(self.rows)
+            if not batch:
+                return 0
+            try:
+                if self.sheet is None:
+                    self.sheet = get_leads_log_sheet()
+                self.sheet.append_rows(batch, value_input_option="USER_ENTERED")
+            except Exception as e:
+                check_google_error(e)
+                if is_google_auth_error(e):
+                    self.sheet = None
+                self.retry_at = time.time() + LOG_FLUSH_SECONDS
+                logger.error(f"Log error ({len(batch)} Zeilen bleiben im Spool): {e}")
+                return 0
+            with self.lock:
+                del self.rows[:len(batch)]
+                self._write_spool(self.rows, "w")
+            return len(batch)
+
+    def _timer_loop(self):
+        while True:
+            time.sleep(LOG_FLUSH_SECONDS)
+            if self.pending():
+                self.flush()
+
+
+lead_log = LeadLogBuffer(LOG_SPOOL_FILE)
+
+
 def log_lead(lead_name, lead_phone, lead_email, partner_name, partner_phone, 
              guthaben_nachher, wa_partner_ok, status):
-    try:
-        log_sheet = get_leads_log_sheet()
-        now = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
-        row = [now, lead_name, lead_phone, lead_email, partner_name, 
-               partner_phone, guthaben_nachher, "OK" if wa_partner_ok else "FEHLER", status]
-        log_sheet.append_row(row, value_input_option="USER_ENTERED")
-    except Exception as e:
-        logger.error(f"Log error: {e}")
+    now = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+    row = [now, lead_name, lead_phone, lead_email, partner_name, 
+           partner_phone, guthaben_nachher, "OK" if wa_partner_ok else "FEHLER", status]
+    with lead_stage_seconds.time(stage="log_append"):
+        lead_log.append(row)
 
 
 # ─── Meta WhatsApp (OFFICIAL CLOUD API) ───────
+_meta_session = None
+_meta_session_lock = threading.Lock()
+
+# Latenz pro Request (inkl. Retries) – die letzten 1000 für p50/p99
+meta_api_stats = {"requests": 0, "errors": 0, "latency_ms": deque(maxlen=1000)}
+
+
+class CountingRetry(Retry):
+    """
+    Retry, der jede von urllib3 intern wiederholte Antwort (429/5xx) zählt –
+    der Response-Hook der Session sieht nur die letzte. Sind die Versuche
+    aufgebraucht, wirft super().increment() und nur der Hook zählt.
+    """
+
+    def increment(self, method=None, url=None, response=None, *args, **kwargs):
+        new_retry = super().increment(method, url, response, *args, **kwargs)
+        if response is not None and response.status:
+            count_api_status("meta", meta_endpoint(url or ""), response.status)
+        return new_retry
+
+
+def get_meta_session():
+    """
+    Eine Session für alle Meta-Requests: Verbindungen (TCP + TLS) werden
+    wiederverwendet, die Header nur einmal gesetzt. urllib3 wiederholt 429
+    und 5xx mit Backoff und beachtet Retry-After (CountingRetry zählt mit).
+    """
+    global _meta_session
+    with _meta_session_lock:
+        if _meta_session is None:
+            # Nur Statuscodes wiederholen: nach einem Lese-Timeout oder
+            # Verbindungsabbruch kann Meta die Nachricht schon zugestellt
+            # haben – ein zweiter POST schickte sie doppelt. Connect-Fehler
+            # (Request nie angekommen) dürfen weiter wiederholt werden.
+            retry = CountingRetry(
+                total=META_MAX_RETRIES,
+                read=0,
+                other=0,
+                backoff_factor=0.5,
+                status_forcelist=(429, 500, 502, 503, 504),
+                allowed_methods=frozenset({"POST", "GET"}),
+                respect_retry_after_header=True,
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(pool_connections=2, pool_maxsize=max(WA_WORKERS, 4),
+                                  max_retries=retry)
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.headers.update({
+                "Authorization": f"Bearer {META_TOKEN}",
+                "Content-Type": "application/json",
+            })
+            session.hooks["response"].append(_count_meta_call)
+            _meta_session = session
+        return _meta_session
+
+
+def meta_endpoint(url):
+    return "messages" if urlsplit(url).path.endswith("/messages") else "leads"
+
+
+def _count_meta_call(response, *args, **kwargs):
+    observe_api_response("meta", meta_endpoint(response.request.url), response)
+    return response
+
+
+def latency_summary(samples):
+    values = sorted(samples)
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "p50": round(values[len(values) // 2], 1),
+        "p99": round(values[min(len(values) - 1, int(len(values) * 0.99))], 1),
+        "max": round(values[-1], 1),
+    }
+
+
 def send_whatsapp(phone, message):
     """
     Sendet WhatsApp über Meta Cloud API (Lina's Business Account)
@@ -134,11 +702,6 @@ def send_whatsapp(phone, message):
     # Nummer normalisieren (ohne +, ohne Leerzeichen)
     to = phone.replace("+", "").replace(" ", "").replace("@s.whatsapp.net", "")
     
-    headers = {
-        "Authorization": f"Bearer {META_TOKEN}",
-        "Content-Type": "application/json",
-    }
-    
     payload = {
         "messaging_product": "whatsapp",
         "recipient_type": "individual",
@@ -147,12 +710,19 @@ def send_whatsapp(phone, message):
         "text": {"preview_url": False, "body": message}
     }
     
+    start = time.perf_counter()
     try:
-        res = requests.post(META_URL, json=payload, headers=headers, timeout=30)
+        res = get_meta_session().post(META_URL, json=payload,
+                                      timeout=(META_CONNECT_TIMEOUT, META_READ_TIMEOUT))
+        elapsed = time.perf_counter() - start
+        meta_api_stats["requests"] += 1
+        meta_api_stats["latency_ms"].append(elapsed * 1000)
+        lead_stage_seconds.observe(elapsed, stage="whatsapp_send")
         
         logger.info(f"[META_RESPONSE] Status={res.status_code} | Phone={to}")
         
         if res.status_code >= 400:
+            meta_api_stats["errors"] += 1
             logger.error(f"Meta API Error: {res.text}")
             return {"error": res.text}
         
@@ -160,10 +730,206 @@ def send_whatsapp(phone, message):
         return {"success": True}
         
     except Exception as e:
+        meta_api_stats["errors"] += 1
+        api_errors_total.inc(api="meta", endpoint="messages", reason=type(e).__name__)
         logger.error(f"WhatsApp Exception: {e}")
         return {"error": str(e)}
 
 
+# ─── WhatsApp Versand-Queue ──────────────────
+class TokenBucket:
+    """
+    Token-Bucket mit Reservierung: reserve() nimmt sofort ein Token und sagt,
+    wie lange der Aufrufer warten muss, bis es gedeckt ist. So bleibt die
+    Reihenfolge fair und niemand muss pollen.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+
+class WhatsAppDispatcher:
+    """
+    Verschickt Nachrichten über einen Worker-Pool. Jede Nachricht reserviert
+    beim Einreihen ein Token beim Absender (META_PHONE_ID) und beim Empfänger;
+    muss sie warten, parkt sie in einem Zeit-Heap statt einen Worker zu
+    blockieren. submit() gibt ein Future mit dem Ergebnis von send_whatsapp().
+    """
+
+    def __init__(self, workers=WA_WORKERS):
+        self.workers = workers
+        self.executor = None
+        self.buckets = {}
+        self.delayed = []
+        self.seq = itertools.count()
+        self.cond = threading.Condition()
+
+    def _start(self):
+        with self.cond:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                   thread_name_prefix="whatsapp")
+                threading.Thread(target=self._schedule_loop, daemon=True).start()
+
+    def _bucket(self, key, rate, burst):
+        with self.cond:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = TokenBucket(rate, burst)
+            return bucket
+
+    def submit(self, phone, message):
+        self._start()
+        to = str(phone or "").replace("+", "").replace(" ", "").replace("@s.whatsapp.net", "")
+        wait = max(
+            self._bucket(("sender", META_PHONE_ID), WA_SENDER_RATE, WA_SENDER_BURST).reserve(),
+            self._bucket(("recipient", to), WA_RECIPIENT_RATE, WA_RECIPIENT_BURST).reserve(),
+        )
+        future = Future()
+        if wait <= 0:
+            self._dispatch(future, phone, message)
+        else:
+            with self.cond:
+                heapq.heappush(self.delayed,
+                               (time.monotonic() + wait, next(self.seq), future, phone, message))
+                self.cond.notify()
+        return future
+
+    def pending(self):
+        with self.cond:
+            return len(self.delayed)
+
+    def _dispatch(self, future, phone, message):
+        def run():
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                future.set_result(send_whatsapp(phone, message))
+            except Exception as e:
+                future.set_exception(e)
+        self.executor.submit(run)
+
+    def _schedule_loop(self):
+        while True:
+            with self.cond:
+                while not self.delayed:
+                    self.cond.wait()
+                ready_at = self.delayed[0][0]
+                now = time.monotonic()
+                if ready_at > now:
+                    self.cond.wait(ready_at - now)
+                    continue
+                _, _, future, phone, message = heapq.heappop(self.delayed)
+            self._dispatch(future, phone, message)
+
+
+wa_dispatcher = WhatsAppDispatcher()
+
+
+def queue_whatsapp(phone, message):
+    return wa_dispatcher.submit(phone, message)
+
+
+class AdminNotifier:
+    """
+    Sammelt Admin-Meldungen und schickt sie als EINE Zusammenfassung, sobald
+    das Zeitfenster (ADMIN_DIGEST_SECONDS) abläuft oder ADMIN_DIGEST_MAX_EVENTS
+    Ereignisse zusammengekommen sind. Dringende Meldungen (urgent=True, z. B.
+    Lead ohne Partner) gehen sofort raus.
+    """
+
+    LABELS = {"lead": "✅ Leads verteilt", "stripe": "💰 Zahlungen", "pause": "⚠️ Partner pausiert"}
+    MAX_CHARS = 4000  # WhatsApp erlaubt 4096 Zeichen pro Text
+
+    def __init__(self, phone, window, max_events):
+        self.phone = phone
+        self.window = window
+        self.max_events = max_events
+        self.events = []
+        self.lock = threading.Lock()
+        self.timer = None
+        self.stats = {"events": 0, "digests": 0, "urgent": 0}
+
+    def notify(self, kind, message, summary="", urgent=False):
+        """
+        message: die ausführliche Einzelnachricht (dringend bzw. Digest aus);
+        summary: eine Zeile für die Zusammenfassung. Gibt ein Future zurück,
+        falls sofort gesendet wurde, sonst None.
+        """
+        if urgent or self.window <= 0:
+            self.stats["urgent"] += 1
+            return queue_whatsapp(self.phone, message)
+
+        with self.lock:
+            self.stats["events"] += 1
+            self.events.append((kind, datetime.now().strftime("%H:%M"), summary))
+            if len(self.events) >= self.max_events:
+                events = self._take()
+            else:
+                events = None
+                if self.timer is None:
+                    self.timer = threading.Timer(self.window, self.flush)
+                    self.timer.daemon = True
+                    self.timer.start()
+        return self._send(events) if events else None
+
+    def _take(self):
+        # Nur unter self.lock aufrufen
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        events, self.events = self.events, []
+        return events
+
+    def flush(self):
+        with self.lock:
+            events = self._take()
+        return self._send(events) if events else None
+
+    def pending(self):
+        with self.lock:
+            return len(self.events)
+
+    def _send(self, events):
+        self.stats["digests"] += 1
+        return queue_whatsapp(self.phone, self.format(events))
+
+    def format(self, events):
+        counts = {}
+        for kind, _, _ in events:
+            counts[kind] = counts.get(kind, 0) + 1
+        lines = [f"📋 *Zusammenfassung* ({events[0][1]}–{events[-1][1]})", ""]
+        lines += [f"{self.LABELS.get(kind, kind)}: {n}" for kind, n in counts.items()]
+        lines.append("")
+
+        size = sum(len(line) + 1 for line in lines)
+        for i, (kind, at, summary) in enumerate(events):
+            line = f"{at} {summary}"
+            if size + len(line) + 1 > self.MAX_CHARS - 40:
+                lines.append(f"… und {len(events) - i} weitere")
+                break
+            lines.append(line)
+            size += len(line) + 1
+        return "\n".join(lines)
+
+
+admin_notifier = AdminNotifier(MATZE_PHONE, ADMIN_DIGEST_SECONDS, ADMIN_DIGEST_MAX_EVENTS)
+
+
 def normalize_phone(phone):
     if not phone:
         return ""
@@ -174,74 +940,626 @@ def normalize_phone(phone):
     return phone
 
 
+def looks_like_phone(value):
+    """Nur Ziffern und übliche Trennzeichen, mindestens 6 Ziffern ("Partner 007" nicht)."""
+    value = str(value or "").strip().removeprefix("p:")
+    return (sum(c.isdigit() for c in value) >= 6
+            and all(c.isdigit() or c in "+ ()/-." for c in value))
+
+
+# ─── Batch-Schreiben ─────────────────────────
+class CellBatch:
+    """
+    Sammelt Zellen-Updates (auch über mehrere Zeilen) und schreibt sie mit
+    EINEM values:batchUpdate-Request. Google wendet den Request ganz oder gar
+    nicht an – eine halb geschriebene Zeile gibt es damit nicht mehr.
+    """
+
+    def __init__(self, sheet):
+        self.sheet = sheet
+        self.cells = {}
+
+    def set(self, row, col, value):
+        self.cells[(row, col)] = value
+        return self
+
+    def __len__(self):
+        return len(self.cells)
+
+    def flush(self):
+        if not self.cells:
+            return
+        data = [{"range": gspread.utils.rowcol_to_a1(row, col), "values": [[value]]}
+                for (row, col), value in sorted(self.cells.items())]
+        self.sheet.batch_update(data, value_input_option="USER_ENTERED")
+        self.cells = {}
+
+
+# ─── Lokale State-DB (SQLite) ────────────────
+_state_local = threading.local()
+
+
+def open_state_db():
+    """Verbindung zur lokalen State-DB, eine pro Thread (WAL, Autocommit)."""
+    conn = getattr(_state_local, "conn", None)
+    if conn is None or _state_local.path != STATE_DB:
+        os.makedirs(os.path.dirname(STATE_DB) or ".", exist_ok=True)
+        conn = sqlite3.connect(STATE_DB, timeout=10, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        _state_local.conn = conn
+        _state_local.path = STATE_DB
+    return conn
+
+
+@contextlib.contextmanager
+def state_transaction():
+    """Schreibtransaktion (BEGIN IMMEDIATE) – Commit oder Rollback."""
+    conn = open_state_db()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+# ─── Idempotenz (verarbeitete Events) ────────
+class RecentIds:
+    """Begrenzte LRU-Menge bereits gesehener IDs (O(1) Prüfen und Eintragen)."""
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self.ids = OrderedDict()
+        self.lock = threading.Lock()
+
+    def add(self, key):
+        """True, wenn die ID neu war."""
+        with self.lock:
+            if key in self.ids:
+                self.ids.move_to_end(key)
+                return False
+            self.ids[key] = True
+            if len(self.ids) > self.maxsize:
+                self.ids.popitem(last=False)
+            return True
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.ids
+
+    def discard(self, key):
+        with self.lock:
+            self.ids.pop(key, None)
+
+
+class ProcessedEventStore:
+    """
+    Bereits angenommene Events (Stripe event.id / Session-ID, leadgen_id)
+    in der State-DB, davor eine LRU im Speicher. claim() entscheidet in O(1),
+    ob ein Event neu ist – Duplikate werden vor jeder Sheets-/WhatsApp-Arbeit
+    verworfen. Einträge älter als EVENT_RETENTION_DAYS werden gelöscht.
+    """
+
+    def __init__(self, cache_size=10000):
+        self.recent = RecentIds(cache_size)
+        self.ready_path = None
+        self.claims = 0
+        self.stats = {"accepted": 0, "duplicates_dropped": 0, "cache_hits": 0}
+
+    def _db(self):
+        conn = open_state_db()
+        if self.ready_path != STATE_DB:
+            conn.execute("""CREATE TABLE IF NOT EXISTS processed_events (
+                key TEXT PRIMARY KEY,
+                created_at REAL NOT NULL)""")
+            conn.execute("CREATE INDEX IF NOT EXISTS processed_events_created ON processed_events(created_at)")
+            self.ready_path = STATE_DB
+        return conn
+
+    def claim(self, *keys):
+        """True, wenn keiner der Schlüssel schon verarbeitet wurde (dann sind alle vermerkt)."""
+        if any(key in self.recent for key in keys):
+            self.stats["cache_hits"] += 1
+            self.stats["duplicates_dropped"] += 1
+            return False
+
+        self._db()
+        now = time.time()
+        with state_transaction() as conn:
+            inserted = 0
+            for key in keys:
+                inserted += conn.execute(
+                    "INSERT OR IGNORE INTO processed_events (key, created_at) VALUES (?, ?)",
+                    (key, now)).rowcount
+            self.claims += 1
+            if self.claims % 1000 == 0:
+                conn.execute("DELETE FROM processed_events WHERE created_at < ?",
+                             (now - EVENT_RETENTION_DAYS * 86400,))
+        for key in keys:
+            self.recent.add(key)
+
+        if inserted < len(keys):
+            self.stats["duplicates_dropped"] += 1
+            return False
+        self.stats["accepted"] += 1
+        return True
+
+    def release(self, *keys):
+        """Claim zurücknehmen (z. B. Queue voll) – die nächste Zustellung zählt wieder."""
+        self._db()
+        with state_transaction() as conn:
+            conn.executemany("DELETE FROM processed_events WHERE key = ?", [(k,) for k in keys])
+        for key in keys:
+            self.recent.discard(key)
+
+    def mark(self, *keys):
+        """Schlüssel ohne Duplikatprüfung vermerken (z. B. "zugestellt")."""
+        self._db()
+        now = time.time()
+        with state_transaction() as conn:
+            conn.executemany("INSERT OR IGNORE INTO processed_events (key, created_at) VALUES (?, ?)",
+                             [(key, now) for key in keys])
+        for key in keys:
+            self.recent.add(key)
+
+    def claimed_at(self, key):
+        """Zeitpunkt, zu dem der Schlüssel vermerkt wurde, sonst None."""
+        row = self._db().execute("SELECT created_at FROM processed_events WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+
+processed_events = ProcessedEventStore()
+
+
+# ─── Durable Job-Queue (SQLite) ──────────────
+class JobQueue:
+    """
+    Persistente Job-Queue in der State-DB. Webhook-Jobs und die Leads eines
+    Poll-Durchlaufs überleben so einen Neustart (at-least-once). Ein Job ist
+    CREATED (wartet, ggf. mit run_at in der Zukunft) oder PROCESSING (von
+    einer Instanz bis claimed_until beansprucht). Fehlgeschlagene Jobs werden
+    mit exponentiellem Backoff wiederholt und nach JOB_MAX_ATTEMPTS Versuchen
+    nach dead_jobs verschoben.
+    """
+
+    def __init__(self):
+        self.ready_path = None
+
+    def _db(self):
+        conn = open_state_db()
+        if self.ready_path != STATE_DB:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'CREATED',
+                    result TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    run_at REAL NOT NULL,
+                    claimed_by TEXT,
+                    claimed_until REAL,
+                    last_error TEXT,
+                    created_at REAL NOT NULL);
+                CREATE INDEX IF NOT EXISTS jobs_ready ON jobs(status, run_at);
+                CREATE TABLE IF NOT EXISTS dead_jobs (
+                    id INTEGER PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    attempts INTEGER NOT NULL,
+                    last_error TEXT,
+                    created_at REAL NOT NULL,
+                    failed_at REAL NOT NULL);
+            """)
+            self.ready_path = STATE_DB
+        return conn
+
+    def put(self, kind, payload, limit=None, limit_kinds=WEBHOOK_JOB_KINDS):
+        """
+        Job anlegen. None, wenn schon `limit` Jobs der Arten `limit_kinds`
+        offen sind (Backpressure).
+        """
+        self._db()
+        now = time.time()
+        with state_transaction() as conn:
+            if limit is not None and self._count(conn, limit_kinds) >= limit:
+                return None
+            return conn.execute(
+                "INSERT INTO jobs (kind, payload, run_at, created_at) VALUES (?, ?, ?, ?)",
+                (kind, json.dumps(payload), now, now)).lastrowid
+
+    def put_claimed(self, kind, payloads, ttl):
+        """Mehrere Jobs direkt als PROCESSING dieser Instanz anlegen (Poller arbeitet sie selbst ab)."""
+        self._db()
+        now = time.time()
+        with state_transaction() as conn:
+            return [conn.execute(
+                "INSERT INTO jobs (kind, payload, status, attempts, run_at, claimed_by, claimed_until, created_at) "
+                "VALUES (?, ?, 'PROCESSING', 1, ?, ?, ?, ?)",
+                (kind, json.dumps(payload), now, INSTANCE_ID, now + ttl, now)).lastrowid
+                for payload in payloads]
+
+    def claim(self, ttl):
+        """Den nächsten fälligen Job beanspruchen, sonst None."""
+        self._db()
+        now = time.time()
+        with state_transaction() as conn:
+            row = conn.execute(
+                "SELECT id, kind, payload, result, attempts FROM jobs "
+                "WHERE status = 'CREATED' AND run_at <= ? ORDER BY run_at, id LIMIT 1", (now,)).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'PROCESSING', attempts = attempts + 1, claimed_by = ?, "
+                "claimed_until = ? WHERE id = ?", (INSTANCE_ID, now + ttl, row[0]))
+        return {"id": row[0], "kind": row[1], "payload": json.loads(row[2]),
+                "result": row[3], "attempts": row[4] + 1}
+
+    def set_result(self, job_id, result):
+        """Zwischenergebnis merken – eine Wiederholung setzt dort fort, statt neu zu verarbeiten."""
+        self._db()
+        with state_transaction() as conn:
+            conn.execute("UPDATE jobs SET result = ? WHERE id = ?", (result, job_id))
+
+    def complete(self, *job_ids):
+        if not job_ids:
+            return
+        self._db()
+        with state_transaction() as conn:
+            conn.executemany("DELETE FROM jobs WHERE id = ?", [(job_id,) for job_id in job_ids])
+
+    def fail(self, job, error):
+        """Mit Backoff erneut einplanen (True) oder in dead_jobs verschieben (False)."""
+        self._db()
+        now = time.time()
+        with state_transaction() as conn:
+            if job["attempts"] >= JOB_MAX_ATTEMPTS:
+                conn.execute(
+                    "INSERT OR REPLACE INTO dead_jobs (id, kind, payload, attempts, last_error, created_at, failed_at) "
+                    "SELECT id, kind, payload, attempts, ?, created_at, ? FROM jobs WHERE id = ?",
+                    (error, now, job["id"]))
+                conn.execute("DELETE FROM jobs WHERE id = ?", (job["id"],))
+                return False
+            delay = min(JOB_BACKOFF_BASE * 2 ** (job["attempts"] - 1), JOB_BACKOFF_MAX)
+            conn.execute(
+                "UPDATE jobs SET status = 'CREATED', run_at = ?, claimed_by = NULL, claimed_until = NULL, "
+                "last_error = ? WHERE id = ?", (now + delay, error, job["id"]))
+        return True
+
+    def sweep(self, reclaim_foreign=False):
+        """
+        PROCESSING-Jobs mit abgelaufenem Claim wieder auf CREATED setzen.
+        reclaim_foreign: auch noch gültige Claims anderer Instanz-IDs – beim
+        Start ohne geteiltes Lease-Backend gehören die einem toten Prozess.
+        """
+        self._db()
+        with state_transaction() as conn:
+            if reclaim_foreign:
+                cur = conn.execute(
+                    "UPDATE jobs SET status = 'CREATED', claimed_by = NULL, claimed_until = NULL "
+                    "WHERE status = 'PROCESSING' AND claimed_by != ?", (INSTANCE_ID,))
+            else:
+                cur = conn.execute(
+                    "UPDATE jobs SET status = 'CREATED', claimed_by = NULL, claimed_until = NULL "
+                    "WHERE status = 'PROCESSING' AND claimed_until < ?", (time.time(),))
+            return cur.rowcount
+
+    def active_rows(self):
+        """Sheet-Zeilen, für die noch ein Job offen ist."""
+        rows = self._db().execute("SELECT payload FROM jobs WHERE kind = 'sheet_lead'").fetchall()
+        return {json.loads(payload)["row"] for (payload,) in rows}
+
+    def counts(self):
+        conn = self._db()
+        counts = dict(conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        return {"queued": counts.get("CREATED", 0), "processing": counts.get("PROCESSING", 0),
+                "dead": conn.execute("SELECT COUNT(*) FROM dead_jobs").fetchone()[0]}
+
+    def depth(self, kinds=None):
+        return self._count(self._db(), kinds)
+
+    @staticmethod
+    def _count(conn, kinds):
+        if kinds is None:
+            return conn.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+        return conn.execute(f"SELECT COUNT(*) FROM jobs WHERE kind IN ({','.join('?' * len(kinds))})",
+                            kinds).fetchone()[0]
+
+
+job_queue = JobQueue()
+
+
 # ─── Partner Logik ───────────────────────────
-def get_all_partner_records(sheet):
+# Spalten in Partner_Konto
+COL_GUTHABEN = 3
+COL_LEADS_GELIEFERT = 4
+COL_LETZTER_LEAD = 5
+COL_STATUS = 6
+
+PARTNER_INDEX_TTL = int(os.getenv("PARTNER_INDEX_TTL", "300"))
+# Lese-API (/partner/…/balance, /partners): Snapshot-Alter, ab dem im
+# Hintergrund neu geladen wird
+PARTNER_SNAPSHOT_TTL = int(os.getenv("PARTNER_SNAPSHOT_TTL", "120"))
+# Jeder Partner bekommt einen eigenen Token für sein Guthaben, abgeleitet
+# aus diesem Schlüssel (python app.py partner-token <telefon>); ohne ist
+# /partner/…/balance gesperrt
+PARTNER_TOKEN_SECRET = os.getenv("PARTNER_TOKEN_SECRET", "")
+# Admin-API (/partners, /reconcile/stripe, /leads/export): eigener Token,
+# nie an Partner herausgeben
+ADMIN_API_TOKEN = os.getenv("ADMIN_API_TOKEN", "")
+
+
+PARTNER_FIELDS = ("Name", "Telefon", "Guthaben_Euro", "Leads_Geliefert", "Letzter_Lead_Am", "Status")
+
+
+def _partner_record(i, row):
+    guthaben = float(str(row.get("Guthaben_Euro", 0)).replace(",", "."))
+    return {
+        "row": i,
+        "name": row.get("Name", ""),
+        "telefon": normalize_phone(str(row.get("Telefon", ""))),
+        "guthaben": guthaben,
+        "leads_geliefert": int(row.get("Leads_Geliefert", 0)),
+        "letzter_lead": str(row.get("Letzter_Lead_Am", "")),
+        "status": str(row.get("Status", "")).strip(),
+    }
+
+
+def _read_partner_records(sheet):
     records = []
+    for i, row in enumerate(sheet.get_all_records(), 2):
+        try:
+            records.append(_partner_record(i, row))
+        except:
+            continue
+    return records
+
+
+def get_all_partner_records(sheet):
     try:
-        for i, row in enumerate(sheet.get_all_records(), 2):
-            try:
-                guthaben = float(str(row.get("Guthaben_Euro", 0)).replace(",", "."))
-                records.append({
-                    "row": i,
-                    "name": row.get("Name", ""),
-                    "telefon": normalize_phone(str(row.get("Telefon", ""))),
-                    "guthaben": guthaben,
-                    "leads_geliefert": int(row.get("Leads_Geliefert", 0)),
-                    "letzter_lead": str(row.get("Letzter_Lead_Am", "")),
-                    "status": str(row.get("Status", "")).strip(),
-                })
-            except:
-                continue
+        return _read_partner_records(sheet)
     except Exception as e:
+        check_google_error(e)
         logger.error(f"Fehler beim Lesen: {e}")
-    return records
+        return []
+
+
+def partner_sort_key(p):
+    # Wer am längsten keinen Lead hatte, ist dran – danach wer weniger hat.
+    # Die Zeile entscheidet Gleichstände (wie die stabile Sortierung vorher).
+    datum = p["letzter_lead"] or "0000-00-00 00:00:00"
+    return (datum, p["leads_geliefert"], p["row"])
+
+
+def is_partner_eligible(p):
+    return p["status"] == "Aktiv" and p["guthaben"] >= LEAD_PREIS
+
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class PartnerIndex:
+    """
+    Partner_Konto im Speicher: einmal laden, danach von unseren eigenen
+    Schreibvorgängen aktuell gehalten. Manuelle Änderungen im Sheet werden
+    spätestens nach PARTNER_INDEX_TTL Sekunden übernommen.
+
+    - by_phone:  normalisierte Nummer → Partner (O(1))
+    - trigrams:  Trigramm → Zeilen, für die Namenssuche
+    - heap:      (Sortierschlüssel, Zeile) aller berechtigten Partner;
+                 veraltete Einträge werden beim Lesen verworfen (lazy deletion)
+    """
+
+    def __init__(self, ttl=PARTNER_INDEX_TTL):
+        self.ttl = ttl
+        self.lock = threading.RLock()
+        self.loaded_at = None
+        self.by_row = {}
+        self.by_phone = {}
+        self.trigrams = {}
+        self.short_names = set()
+        self.heap = []
+
+    def is_stale(self):
+        return self.loaded_at is None or time.time() - self.loaded_at > self.ttl
+
+    def invalidate(self):
+        with self.lock:
+            self.loaded_at = None
+
+    def load(self, records):
+        with self.lock:
+            self.by_row = {}
+            self.by_phone = {}
+            self.trigrams = {}
+            self.short_names = set()
+            for record in records:
+                record = dict(record)
+                self.by_row[record["row"]] = record
+                if record["telefon"]:
+                    self.by_phone.setdefault(record["telefon"], record["row"])
+                name = str(record["name"]).lower().strip()
+                if len(name) < 3:
+                    if name:
+                        self.short_names.add(record["row"])
+                    continue
+                for tri in _trigrams(name):
+                    self.trigrams.setdefault(tri, set()).add(record["row"])
+            self.heap = [(partner_sort_key(r), r["row"])
+                         for r in self.by_row.values() if is_partner_eligible(r)]
+            heapq.heapify(self.heap)
+            self.loaded_at = time.time()
+
+    def ensure(self, sheet):
+        if not self.is_stale():
+            return
+        try:
+            records = _read_partner_records(sheet)
+        except Exception as e:
+            check_google_error(e)
+            if self.loaded_at is None and not self.by_row:
+                raise
+            # Lieber mit dem alten Stand weiterarbeiten als gar nicht
+            logger.error(f"Partner-Index nicht aktualisiert: {e}")
+            return
+        self.load(records)
+
+    def confirm(self, sheet, rows):
+        """
+        Vor dem Schreiben: stehen in diesen Zeilen noch dieselben Partner mit
+        demselben Stand wie im Index? Ein batch_get für alle Zeilen. Wurden
+        im Sheet Zeilen gelöscht, einsortiert oder von Hand aufgeladen, wird
+        der Index neu geladen und False zurückgegeben – der Aufrufer wählt
+        den Partner dann neu, statt in eine fremde Zeile zu schreiben.
+        """
+        rows = sorted(set(rows))
+        if not rows:
+            return True
+        values = sheet.batch_get([f"A{row}:F{row}" for row in rows])
+        # Letzter_Lead_Am nicht: Google formatiert das Datum beim Schreiben um
+        fields = ("name", "telefon", "guthaben", "leads_geliefert", "status")
+        with self.lock:
+            for row, value in zip(rows, values):
+                cached = self.by_row.get(row)
+                try:
+                    record = _partner_record(row, dict(zip(PARTNER_FIELDS, value[0] if value else [])))
+                except (TypeError, ValueError):
+                    record = None
+                if not record or not cached or any(record[f] != cached[f] for f in fields):
+                    break
+            else:
+                return True
+        logger.warning(f"⚠️ Partner_Konto Zeile {row} weicht vom Index ab – lade neu")
+        self.invalidate()
+        partner_snapshot.expire()
+        self.ensure(sheet)
+        return False
+
+    def update(self, partner):
+        """Übernimmt einen Partner nach einem eigenen Schreibvorgang."""
+        with self.lock:
+            record = dict(partner)
+            self.by_row[record["row"]] = record
+            if is_partner_eligible(record):
+                heapq.heappush(self.heap, (partner_sort_key(record), record["row"]))
+
+    def best(self):
+        with self.lock:
+            while self.heap:
+                key, row = self.heap[0]
+                record = self.by_row.get(row)
+                if record and is_partner_eligible(record) and partner_sort_key(record) == key:
+                    return dict(record)
+                heapq.heappop(self.heap)
+            return None
+
+    def snapshot(self):
+        with self.lock:
+            return [dict(record) for record in self.by_row.values()]
+
+    def get(self, row):
+        with self.lock:
+            record = self.by_row.get(row)
+            return dict(record) if record else None
+
+    def by_phone_number(self, phone):
+        with self.lock:
+            row = self.by_phone.get(phone)
+            return dict(self.by_row[row]) if row else None
+
+    def by_name(self, name):
+        name_lower = name.lower().strip()
+        with self.lock:
+            if len(name_lower) < 3:
+                candidates = self.by_row.keys()
+            else:
+                candidates = set(self.short_names)
+                for tri in _trigrams(name_lower):
+                    candidates |= self.trigrams.get(tri, set())
+            best_row = None
+            for row in candidates:
+                if best_row is not None and row > best_row:
+                    continue
+                record_name = str(self.by_row[row]["name"]).lower().strip()
+                if record_name and (record_name in name_lower or name_lower in record_name):
+                    best_row = row
+            return dict(self.by_row[best_row]) if best_row else None
+
+
+partner_index = PartnerIndex()
+
+
+def _partner_source(sheet):
+    """Ledger (falls aktiv) oder PartnerIndex – beide vorher geladen."""
+    ledger = get_partner_ledger()
+    if ledger:
+        ledger.ensure_loaded(sheet)
+        return ledger
+    partner_index.ensure(sheet)
+    return partner_index
+
+
+def confirm_partner_rows(sheet, rows):
+    """PartnerIndex.confirm(); mit Ledger ist SQLite maßgeblich, nicht das Sheet."""
+    if get_partner_ledger():
+        return True
+    return partner_index.confirm(sheet, rows)
 
 
 def find_best_partner(sheet):
     try:
-        all_records = get_all_partner_records(sheet)
+        with lead_stage_seconds.time(stage="partner_read"):
+            source = _partner_source(sheet)
+        with lead_stage_seconds.time(stage="partner_select"):
+            return source.best()
     except Exception as e:
         logger.error(f"Fehler beim Lesen: {e}")
         return None
 
-    aktive_partner = []
-    for record in all_records:
-        status = str(record.get("status", "")).strip()
-        guthaben = record.get("guthaben", 0)
-        
-        if status == "Aktiv" and guthaben >= LEAD_PREIS:
-            aktive_partner.append(record)
-
-    if not aktive_partner:
-        return None
-
-    def sort_key(p):
-        datum = p["letzter_lead"]
-        if not datum:
-            return ("0000-00-00 00:00:00", p["leads_geliefert"])
-        return (datum, p["leads_geliefert"])
 
-    aktive_partner.sort(key=sort_key)
-    return aktive_partner[0]
+def notify_partner_paused(partner, guthaben):
+    admin_notifier.notify("pause", f"⚠️ Partner {partner['name']} pausiert (Guthaben: {guthaben}€)",
+                          f"⚠️ {partner['name']} pausiert ({guthaben}€)")
 
 
-def update_partner(sheet, partner):
+def update_partner(sheet, partner, lead_data=None):
     row = partner["row"]
     now = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
     try:
+        ledger = get_partner_ledger()
+        if ledger:
+            record = ledger.debit(row, LEAD_PREIS, now, lead_data)
+            partner_snapshot.update(record)
+            if record["status"] == "Pausiert" and partner["status"] != "Pausiert":
+                notify_partner_paused(partner, record["guthaben"])
+            return record["guthaben"]
+
         neues_guthaben = round(partner["guthaben"] - LEAD_PREIS, 2)
-        sheet.update_cell(row, 3, neues_guthaben)
-        sheet.update_cell(row, 4, partner["leads_geliefert"] + 1)
-        sheet.update_cell(row, 5, now)
-        
-        if neues_guthaben < LEAD_PREIS:
-            sheet.update_cell(row, 6, "Pausiert")
-            # Matze benachrichtigen
-            send_whatsapp(MATZE_PHONE, 
-                f"⚠️ Partner {partner['name']} pausiert (Guthaben: {neues_guthaben}€)")
+        batch = CellBatch(sheet)
+        batch.set(row, COL_GUTHABEN, neues_guthaben)
+        batch.set(row, COL_LEADS_GELIEFERT, partner["leads_geliefert"] + 1)
+        batch.set(row, COL_LETZTER_LEAD, now)
+        pausiert = neues_guthaben < LEAD_PREIS
+        if pausiert:
+            batch.set(row, COL_STATUS, "Pausiert")
+        batch.flush()
+
+        record = {**partner, "guthaben": neues_guthaben,
+                  "leads_geliefert": partner["leads_geliefert"] + 1,
+                  "letzter_lead": now,
+                  "status": "Pausiert" if pausiert else partner["status"]}
+        partner_index.update(record)
+        partner_snapshot.update(record)
+
+        if pausiert:
+            notify_partner_paused(partner, neues_guthaben)
         
         return neues_guthaben
     except Exception as e:
+        check_google_error(e)
         logger.error(f"Fehler beim Update: {e}")
         return partner["guthaben"]
 
@@ -250,84 +1568,500 @@ def find_partner_by_phone(sheet, phone):
     normalized = normalize_phone(phone)
     if not normalized:
         return None
-    records = get_all_partner_records(sheet)
-    for record in records:
-        partner_phone = normalize_phone(str(record.get("telefon", "")))
-        if partner_phone == normalized:
-            return record
-    return None
+    try:
+        return _partner_source(sheet).by_phone_number(normalized)
+    except Exception as e:
+        logger.error(f"Fehler beim Lesen: {e}")
+        return None
 
 
 def find_partner_by_name(sheet, name):
     if not name:
         return None
-    records = get_all_partner_records(sheet)
-    name_lower = name.lower().strip()
-    for record in records:
-        record_name = str(record.get("name", "")).lower().strip()
-        if record_name and (record_name in name_lower or name_lower in record_name):
-            return record
-    return None
+    try:
+        return _partner_source(sheet).by_name(name)
+    except Exception as e:
+        logger.error(f"Fehler beim Lesen: {e}")
+        return None
 
 
 def add_new_partner(sheet, name, phone, guthaben):
     try:
         normalized_phone = normalize_phone(phone)
-        sheet.append_row([name, normalized_phone, guthaben, 0, "", "Aktiv"], 
-                        value_input_option="USER_ENTERED")
+        response = sheet.append_row([name, normalized_phone, guthaben, 0, "", "Aktiv"], 
+                                    value_input_option="USER_ENTERED")
+        # Neue Zeile → beim nächsten Zugriff frisch laden
+        partner_index.invalidate()
+        partner_snapshot.expire()
+        ledger = get_partner_ledger()
+        if ledger:
+            updated_range = (response or {}).get("updates", {}).get("updatedRange", "")
+            first_cell = updated_range.split("!")[-1].split(":")[0]
+            ledger.insert(gspread.utils.a1_to_rowcol(first_cell)[0], name, normalized_phone, guthaben)
         logger.info(f"Neuer Partner: {name}, {guthaben}€")
         return True
     except Exception as e:
+        check_google_error(e)
         logger.error(f"Fehler: {e}")
         return False
 
 
 def update_partner_guthaben(sheet, partner, betrag):
+    """
+    Aufladung. Ohne Ledger unter allocation_lock aufrufen: das neue Guthaben
+    wird aus dem aktuellen PartnerIndex-Stand berechnet, nicht aus der
+    übergebenen Kopie – sonst überschreibt es eine parallele Abbuchung.
+    """
     row = partner["row"]
     try:
-        neues_guthaben = round(partner["guthaben"] + betrag, 2)
-        sheet.update_cell(row, 3, neues_guthaben)
-        sheet.update_cell(row, 6, "Aktiv")
+        ledger = get_partner_ledger()
+        if ledger:
+            record = ledger.credit(row, betrag)
+            partner_snapshot.update(record)
+            return record["guthaben"]
+
+        current = partner_index.get(row) or partner
+        neues_guthaben = round(current["guthaben"] + betrag, 2)
+        CellBatch(sheet).set(row, COL_GUTHABEN, neues_guthaben).set(row, COL_STATUS, "Aktiv").flush()
+        record = {**current, "guthaben": neues_guthaben, "status": "Aktiv"}
+        partner_index.update(record)
+        partner_snapshot.update(record)
         return neues_guthaben
     except Exception as e:
+        check_google_error(e)
         logger.error(f"Fehler: {e}")
-        return partner["guthaben"]
+        return None
+
+
+# ─── Partner-Ledger (SQLite) ─────────────────
+class PartnerLedger:
+    """
+    Lokales, transaktionales Hauptbuch für Partner_Konto. Abbuchungen und
+    Aufladungen sind relative UPDATEs in einer Transaktion – eine Stripe-
+    Aufladung parallel zu einer Lead-Abbuchung geht nicht mehr verloren.
+    Geänderte Zeilen werden als dirty markiert und vom LedgerSyncer
+    gesammelt ins Sheet gespiegelt; der Lead-Pfad wartet nie auf Google.
+    """
+
+    COLUMNS = ("row", "name", "telefon", "guthaben", "leads_geliefert", "letzter_lead", "status")
+    PICK_ORDER = ("(CASE WHEN letzter_lead = '' THEN '0000-00-00 00:00:00' ELSE letzter_lead END), "
+                  "leads_geliefert, row")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.loaded = False
+        open_state_db().executescript(f"""
+            CREATE TABLE IF NOT EXISTS partners (
+                row INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                name_lower TEXT NOT NULL,
+                telefon TEXT NOT NULL,
+                guthaben REAL NOT NULL,
+                leads_geliefert INTEGER NOT NULL,
+                letzter_lead TEXT NOT NULL,
+                status TEXT NOT NULL,
+                dirty INTEGER NOT NULL DEFAULT 0,
+                seq INTEGER NOT NULL DEFAULT 0,
+                synced_at REAL NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS partners_telefon ON partners (telefon);
+            CREATE INDEX IF NOT EXISTS partners_pick ON partners (status, {self.PICK_ORDER});
+            CREATE INDEX IF NOT EXISTS partners_dirty ON partners (dirty);
+            CREATE TABLE IF NOT EXISTS assignments (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                created TEXT NOT NULL,
+                partner_row INTEGER NOT NULL,
+                lead_name TEXT,
+                lead_phone TEXT,
+                lead_email TEXT,
+                betrag REAL NOT NULL
+            );
+        """)
+
+    def _select(self, conn, where, params=()):
+        cols = ", ".join(self.COLUMNS)
+        row = conn.execute(f"SELECT {cols} FROM partners {where}", params).fetchone()
+        return dict(zip(self.COLUMNS, row)) if row else None
+
+    def count(self):
+        return open_state_db().execute("SELECT COUNT(*) FROM partners").fetchone()[0]
+
+    def ensure_loaded(self, sheet):
+        """Beim ersten Zugriff: leeres Ledger einmal aus dem Sheet befüllen."""
+        if self.loaded:
+            return
+        with self.lock:
+            if self.loaded:
+                return
+            if self.count() == 0:
+                self.load_from_sheet(sheet)
+            self.loaded = True
+
+    def load_from_sheet(self, sheet):
+        """
+        Übernimmt den Stand aus dem Sheet (manuelle Änderungen). Zeilen mit
+        noch nicht gespiegelten Änderungen bleiben unberührt – außer die
+        Zeile gehört inzwischen einem anderen Partner (Zeilen verschoben).
+        """
+        started = time.time()
+        records = _read_partner_records(sheet)
+        with state_transaction() as conn:
+            for r in records:
+                current = conn.execute("SELECT name, telefon, dirty, synced_at FROM partners WHERE row = ?",
+                                       (r["row"],)).fetchone()
+                values = (r["name"], str(r["name"]).lower().strip(), r["telefon"], r["guthaben"],
+                          r["leads_geliefert"], r["letzter_lead"], r["status"], r["row"])
+                if current is None:
+                    conn.execute("INSERT INTO partners (name, name_lower, telefon, guthaben, leads_geliefert, "
+                                 "letzter_lead, status, row) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", values)
+                    continue
+                moved = (current[0], current[1]) != (r["name"], r["telefon"])
+                if moved:
+                    logger.warning(f"⚠️ Ledger: Zeile {r['row']} gehört jetzt {r['name']} – übernommen")
+                if moved or (not current[2] and current[3] < started):
+                    conn.execute("UPDATE partners SET name = ?, name_lower = ?, telefon = ?, guthaben = ?, "
+                                 "leads_geliefert = ?, letzter_lead = ?, status = ?, dirty = 0 "
+                                 "WHERE row = ?", values)
+            rows = [r["row"] for r in records]
+            conn.execute(f"DELETE FROM partners WHERE dirty = 0 AND row NOT IN ({','.join('?' * len(rows))})",
+                         rows)
+        logger.info(f"📒 Ledger: {len(records)} Partner aus Sheet übernommen")
+
+    def best(self):
+        return self._select(open_state_db(),
+                            f"WHERE status = 'Aktiv' AND guthaben >= ? ORDER BY {self.PICK_ORDER} LIMIT 1",
+                            (LEAD_PREIS,))
+
+    def by_phone_number(self, phone):
+        return self._select(open_state_db(), "WHERE telefon = ? ORDER BY row LIMIT 1", (phone,))
+
+    def by_name(self, name):
+        name_lower = name.lower().strip()
+        return self._select(
+            open_state_db(),
+            "WHERE name_lower != '' AND (instr(?, name_lower) > 0 OR instr(name_lower, ?) > 0) "
+            "ORDER BY row LIMIT 1",
+            (name_lower, name_lower))
+
+    def debit(self, row, betrag, now, lead_data=None):
+        """Atomare Abbuchung eines Leads; pausiert den Partner unter LEAD_PREIS."""
+        lead_data = lead_data or {}
+        with state_transaction() as conn:
+            conn.execute(
+                "UPDATE partners SET guthaben = ROUND(guthaben - ?, 2), "
+                "leads_geliefert = leads_geliefert + 1, letzter_lead = ?, "
+                "status = CASE WHEN ROUND(guthaben - ?, 2) < ? THEN 'Pausiert' ELSE status END, "
+                "dirty = 1, seq = seq + 1 WHERE row = ?",
+                (betrag, now, betrag, LEAD_PREIS, row))
+            conn.execute(
+                "INSERT INTO assignments (created, partner_row, lead_name, lead_phone, lead_email, betrag) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (now, row, lead_data.get("name"), lead_data.get("phone"), lead_data.get("email"), betrag))
+            return self._select(conn, "WHERE row = ?", (row,))
+
+    def credit(self, row, betrag):
+        """Atomare Aufladung; der Partner wird wieder aktiv."""
+        with state_transaction() as conn:
+            conn.execute("UPDATE partners SET guthaben = ROUND(guthaben + ?, 2), status = 'Aktiv', "
+                         "dirty = 1, seq = seq + 1 WHERE row = ?", (betrag, row))
+            return self._select(conn, "WHERE row = ?", (row,))
+
+    def adjust(self, conn, row, betrag):
+        """Korrekturbuchung (±) innerhalb einer laufenden Transaktion, z. B. aus dem Stripe-Abgleich."""
+        conn.execute("UPDATE partners SET guthaben = ROUND(guthaben + ?, 2), "
+                     "status = CASE WHEN ? > 0 THEN 'Aktiv' "
+                     "WHEN ROUND(guthaben + ?, 2) < ? THEN 'Pausiert' ELSE status END, "
+                     "dirty = 1, seq = seq + 1 WHERE row = ?", (betrag, betrag, betrag, LEAD_PREIS, row))
+        return self._select(conn, "WHERE row = ?", (row,))
+
+    def insert(self, row, name, phone, guthaben):
+        """Partner, der gerade per append_row im Sheet angelegt wurde (also nicht dirty)."""
+        open_state_db().execute(
+            "INSERT OR REPLACE INTO partners (row, name, name_lower, telefon, guthaben, leads_geliefert, "
+            "letzter_lead, status, synced_at) VALUES (?, ?, ?, ?, ?, 0, '', 'Aktiv', ?)",
+            (row, name, str(name).lower().strip(), phone, guthaben, time.time()))
+
+    def records(self):
+        cols = ", ".join(self.COLUMNS)
+        rows = open_state_db().execute(f"SELECT {cols} FROM partners ORDER BY row").fetchall()
+        return [dict(zip(self.COLUMNS, r)) for r in rows]
+
+    def dirty_rows(self):
+        cols = ", ".join(self.COLUMNS)
+        rows = open_state_db().execute(
+            f"SELECT {cols}, seq FROM partners WHERE dirty = 1 ORDER BY row").fetchall()
+        return [(dict(zip(self.COLUMNS, r[:-1])), r[-1]) for r in rows]
+
+    def mark_synced(self, rows_with_seq):
+        now = time.time()
+        with state_transaction() as conn:
+            conn.executemany("UPDATE partners SET dirty = 0, synced_at = ? WHERE row = ? AND seq = ?",
+                             [(now, row, seq) for row, seq in rows_with_seq])
+
+
+class LedgerSyncer:
+    """Spiegelt geänderte Ledger-Zeilen gesammelt ins Sheet und holt regelmäßig manuelle Änderungen."""
+
+    def __init__(self, ledger):
+        self.ledger = ledger
+        self.thread = None
+        # 0 → gleich nach dem Start einmal manuelle Sheet-Änderungen holen
+        self.last_refresh = 0.0
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._loop, daemon=True)
+            self.thread.start()
+
+    def sync(self):
+        dirty = self.ledger.dirty_rows()
+        if not dirty:
+            return 0
+        batch = CellBatch(get_partner_sheet())
+        for record, _ in dirty:
+            batch.set(record["row"], COL_GUTHABEN, record["guthaben"])
+            batch.set(record["row"], COL_LEADS_GELIEFERT, record["leads_geliefert"])
+            batch.set(record["row"], COL_LETZTER_LEAD, record["letzter_lead"])
+            batch.set(record["row"], COL_STATUS, record["status"])
+        batch.flush()
+        self.ledger.mark_synced([(record["row"], seq) for record, seq in dirty])
+        return len(dirty)
+
+    def _loop(self):
+        while True:
+            time.sleep(LEDGER_SYNC_SECONDS)
+            try:
+                synced = self.sync()
+                if synced:
+                    logger.info(f"📒 Ledger: {synced} Partner ins Sheet gespiegelt")
+                if time.time() - self.last_refresh > LEDGER_REFRESH_SECONDS:
+                    self.ledger.load_from_sheet(get_partner_sheet())
+                    self.last_refresh = time.time()
+            except Exception as e:
+                check_google_error(e)
+                logger.error(f"Ledger-Sync-Fehler: {e}")
+
+
+_ledger = None
+_ledger_lock = threading.Lock()
+
+
+def get_partner_ledger():
+    """Das Ledger, falls LEDGER_ENABLED – sonst None (dann direkt gegen das Sheet)."""
+    global _ledger
+    if not LEDGER_ENABLED:
+        return None
+    with _ledger_lock:
+        if _ledger is None:
+            _ledger = PartnerLedger()
+            LedgerSyncer(_ledger).start()
+        return _ledger
+
+
+# ─── Partner-Snapshot (Lese-API) ─────────────
+class PartnerSnapshot:
+    """
+    Partner_Konto für die Lese-API: stale-while-revalidate. Ist der Stand
+    älter als ttl, wird sofort der alte ausgeliefert und im Hintergrund
+    genau ein Refresh gestartet. Eigene Abbuchungen/Aufladungen kommen per
+    update() sofort an. ETags hängen an Versionszählern, damit ein 304
+    ohne Serialisieren beantwortet werden kann.
+    """
+
+    def __init__(self, ttl=PARTNER_SNAPSHOT_TTL):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.refresh_lock = threading.Lock()
+        self.epoch = uuid.uuid4().hex[:8]   # ETags überleben keinen Neustart
+        self.records = {}
+        self.by_phone = {}
+        self.rows = []
+        self.row_versions = {}
+        self.pushed_at = {}
+        self.version = 0
+        self.loaded_at = None
+        self.refreshing = False
+        self.stats = {"refreshes": 0, "refresh_errors": 0, "stale_served": 0, "updates": 0}
+
+    def _source_records(self):
+        ledger = get_partner_ledger()
+        if ledger:
+            ledger.ensure_loaded(get_partner_sheet())
+            return ledger.records()
+        return _read_partner_records(get_partner_sheet())
+
+    def refresh(self):
+        with self.refresh_lock:
+            started = time.time()
+            try:
+                records = self._source_records()
+            except Exception as e:
+                check_google_error(e)
+                self.stats["refresh_errors"] += 1
+                raise
+            self.load(records, started)
+            self.stats["refreshes"] += 1
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            logger.error(f"Partner-Snapshot nicht aktualisiert: {e}")
+        finally:
+            self.refreshing = False
+
+    def revalidate(self):
+        """Bei abgelaufenem TTL einen Hintergrund-Refresh anstoßen (höchstens einen)."""
+        if self.loaded_at is not None and time.time() - self.loaded_at <= self.ttl:
+            return
+        self.stats["stale_served"] += 1
+        with self.lock:
+            if self.refreshing:
+                return
+            self.refreshing = True
+        threading.Thread(target=self._refresh_in_background, daemon=True).start()
+
+    def expire(self):
+        with self.lock:
+            if self.loaded_at is not None:
+                self.loaded_at = 0.0
+
+    def load(self, records, started):
+        with self.lock:
+            fresh = {}
+            for record in records:
+                row = record["row"]
+                # Während des Lesens selbst geschrieben → unser Stand ist neuer
+                if self.pushed_at.get(row, 0) >= started and row in self.records:
+                    fresh[row] = self.records[row]
+                else:
+                    fresh[row] = dict(record)
+            changed = fresh.keys() != self.records.keys()
+            for row, record in fresh.items():
+                if self.records.get(row) != record:
+                    self.row_versions[row] = self.row_versions.get(row, 0) + 1
+                    changed = True
+            self.records = fresh
+            self.rows = sorted(fresh)
+            self.by_phone = {}
+            for row in self.rows:
+                if fresh[row]["telefon"]:
+                    self.by_phone.setdefault(fresh[row]["telefon"], row)
+            self.pushed_at = {row: t for row, t in self.pushed_at.items() if t >= started}
+            if changed:
+                self.version += 1
+            self.loaded_at = time.time()
+
+    def update(self, partner):
+        with self.lock:
+            record = {key: partner[key] for key in PartnerLedger.COLUMNS}
+            row = record["row"]
+            self.pushed_at[row] = time.time()
+            if self.records.get(row) == record:
+                return
+            if row not in self.records:
+                self.rows = sorted([*self.rows, row])
+            self.records[row] = record
+            if record["telefon"]:
+                self.by_phone.setdefault(record["telefon"], row)
+            self.row_versions[row] = self.row_versions.get(row, 0) + 1
+            self.version += 1
+            self.stats["updates"] += 1
+
+    def partner_etag(self, row):
+        return f'"{self.epoch}-{row}-{self.row_versions.get(row, 0)}"'
+
+    def list_etag(self, *params):
+        return f'W/"{self.epoch}-{self.version}-{"-".join(map(str, params))}"'
+
+    def by_phone_number(self, phone):
+        with self.lock:
+            row = self.by_phone.get(phone)
+            return (dict(self.records[row]), self.partner_etag(row)) if row else (None, None)
+
+    def page(self, offset, limit, status=None):
+        with self.lock:
+            rows = self.rows
+            if status:
+                rows = [row for row in rows if self.records[row]["status"] == status]
+            return len(rows), [dict(self.records[row]) for row in rows[offset:offset + limit]]
+
+    def status(self):
+        return {
+            **self.stats,
+            "partners": len(self.records),
+            "version": self.version,
+            "age_s": round(time.time() - self.loaded_at, 1) if self.loaded_at else None,
+            "ttl_s": self.ttl,
+        }
+
+
+partner_snapshot = PartnerSnapshot()
 
 
 # ─── Lead-Verteilung ─────────────────────────
-def process_lead(lead_data):
-    lead_name = lead_data.get("name", "Unbekannt")
-    lead_phone = normalize_phone(lead_data.get("phone", ""))
-    lead_email = lead_data.get("email", "")
+def _lead_fields(lead_data):
+    return (lead_data.get("name", "Unbekannt"),
+            normalize_phone(lead_data.get("phone", "")),
+            lead_data.get("email", ""))
+
+
+allocation_lock = threading.Lock()
+
+
+def assign_lead(lead_data):
+    """Partner auswählen und abbuchen (nur Sheets, keine WhatsApp)."""
+    lead_name, lead_phone, lead_email = _lead_fields(lead_data)
 
     logger.info(f"=== Lead: {lead_name} | {lead_phone} ===")
 
     try:
-        sheet = get_partner_sheet()
+        with lead_stage_seconds.time(stage="sheet_open"):
+            sheet = get_partner_sheet()
     except Exception as e:
+        check_google_error(e)
         logger.error(f"Sheet-Fehler: {e}")
-        return {"error": str(e)}
+        return {"error": str(e), "retry": True}
 
-    partner = find_best_partner(sheet)
-    if not partner:
-        # Matze benachrichtigen - kein Partner
-        send_whatsapp(MATZE_PHONE,
-            f"⚠️ *Lead ohne Partner!*\n\n"
-            f"👤 {lead_name}\n📞 {lead_phone}\n📧 {lead_email}")
-        log_lead(lead_name, lead_phone, lead_email, "KEIN PARTNER", "", 0, False, "KEIN_PARTNER")
-        return {"error": "Kein Partner"}
+    # Auswahl und Abbuchung gemeinsam, sonst buchen zwei Worker vom selben Stand ab
+    with allocation_lock:
+        partner = find_best_partner(sheet)
+        try:
+            if partner and not confirm_partner_rows(sheet, [partner["row"]]):
+                partner = find_best_partner(sheet)
+        except Exception as e:
+            check_google_error(e)
+            logger.error(f"Fehler beim Prüfen der Partner-Zeile: {e}")
+            return {"error": str(e), "retry": True}
+        if not partner:
+            return lead_without_partner(lead_data)
+
+        with lead_stage_seconds.time(stage="partner_write"):
+            neues_guthaben = update_partner(sheet, partner, lead_data)
+    return {"partner": partner, "guthaben": neues_guthaben}
+
+
+def lead_without_partner(lead_data):
+    lead_name, lead_phone, lead_email = _lead_fields(lead_data)
+    # Matze benachrichtigen - kein Partner (dringend, nicht im Digest)
+    admin_notifier.notify("kein_partner",
+        f"⚠️ *Lead ohne Partner!*\n\n"
+        f"👤 {lead_name}\n📞 {lead_phone}\n📧 {lead_email}", urgent=True)
+    log_lead(lead_name, lead_phone, lead_email, "KEIN PARTNER", "", 0, False, "KEIN_PARTNER")
+    return {"error": "Kein Partner"}
+
+
+def notify_lead(lead_data, partner, neues_guthaben):
+    """Reiht Partner- und Admin-Nachricht ein; gibt das Future der Partner-Nachricht zurück."""
+    lead_name, lead_phone, lead_email = _lead_fields(lead_data)
 
-    neues_guthaben = update_partner(sheet, partner)
-    
     # 1. Partner benachrichtigen
     partner_msg = (f"🔔 *Neuer Lead!*\n\n"
                    f"👤 {lead_name}\n"
                    f"📞 {lead_phone}\n"
                    f"📧 {lead_email}\n\n"
                    f"💰 Rest: {neues_guthaben}€")
-    wa_result = send_whatsapp(partner["telefon"], partner_msg)
-
-    time.sleep(2)  # Rate-Limit-Schutz
+    partner_future = queue_whatsapp(partner["telefon"], partner_msg)
 
     # 2. MATZE benachrichtigen (ALLE Infos!)
     matze_msg = (f"✅ *Lead verteilt*\n\n"
@@ -336,44 +2070,246 @@ def process_lead(lead_data):
                  f"📧 {lead_email}\n\n"
                  f"➡️ {partner['name']}\n"
                  f"💰 Rest: {neues_guthaben}€")
-    send_whatsapp(MATZE_PHONE, matze_msg)
+    admin_notifier.notify("lead", matze_msg,
+                          f"{lead_name} → {partner['name']} (Rest {neues_guthaben}€)")
+
+    return partner_future
+
+
+def finish_lead(lead_data, assignment, wa_result):
+    lead_name, lead_phone, lead_email = _lead_fields(lead_data)
+    partner = assignment["partner"]
+    neues_guthaben = assignment["guthaben"]
 
     log_lead(lead_name, lead_phone, lead_email, partner["name"], 
              partner["telefon"], neues_guthaben, "error" not in wa_result, "VERTEILT")
+    if lead_data.get("received_at"):
+        lead_delivery_seconds.observe(time.time() - lead_data["received_at"],
+                                      source=lead_data.get("source", ""))
 
     return {"success": True, "partner": partner["name"], "guthaben": neues_guthaben}
 
 
-# ─── Stripe Zahlung verarbeiten ──────────────
-def process_stripe_payment(customer_name, customer_phone, customer_email, amount):
-    logger.info(f"=== Stripe: {customer_name} | {amount}€ ===")
-    
-    # DEBUG: Prüfe MATZE_PHONE
-    logger.info(f"🔍 DEBUG: MATZE_PHONE = '{MATZE_PHONE}' | Länge={len(MATZE_PHONE)}")
-    
+def process_lead(lead_data):
+    assignment = assign_lead(lead_data)
+    if "error" in assignment:
+        return assignment
+
+    wa_result = notify_lead(lead_data, assignment["partner"], assignment["guthaben"]).result()
+    return finish_lead(lead_data, assignment, wa_result)
+
+
+async def process_lead_async(lead_data):
+    """
+    Wie process_lead(), aber ohne den Event-Loop zu blockieren: Sheets-Arbeit
+    läuft in einem Thread, auf die WhatsApp-Nachricht wird nur gewartet.
+    """
+    assignment = await asyncio.to_thread(assign_lead, lead_data)
+    if "error" in assignment:
+        return assignment
+
+    partner_future = notify_lead(lead_data, assignment["partner"], assignment["guthaben"])
+    wa_result = await asyncio.wrap_future(partner_future)
+    return await asyncio.to_thread(finish_lead, lead_data, assignment, wa_result)
+
+
+# ─── Batch-Zuteilung (Poll-Zyklus) ───────────
+# Kein Fehler im eigentlichen Sinn: der Lead bleibt CREATED und kommt im
+# nächsten Zyklus dran, ohne "Lead ohne Partner"-Alarm
+DEFERRED_BY_CAP = {"error": "MAX_LEADS_PER_CYCLE erreicht", "deferred": True}
+
+
+def allocate_leads(leads, partners, now, max_per_partner=MAX_LEADS_PER_CYCLE):
+    """
+    Teilt einen ganzen Batch in einem Durchlauf zu – in derselben Reihenfolge
+    wie find_best_partner() Lead für Lead (partner_sort_key). Das Guthaben
+    sinkt innerhalb des Batches mit; wer unter LEAD_PREIS fällt, wird
+    pausiert. max_per_partner begrenzt die Leads pro Partner (0 = unbegrenzt).
+
+    Gibt pro Lead {"partner", "guthaben"} wie assign_lead() bzw. None (kein
+    Partner) zurück – oder DEFERRED_BY_CAP, wenn nur die Obergrenze Partner
+    zurückhält. Dazu {Zeile: Partner nach allen Abbuchungen}.
+    """
+    state = {p["row"]: dict(p) for p in partners}
+    heap = [(partner_sort_key(p), row) for row, p in state.items() if is_partner_eligible(p)]
+    heapq.heapify(heap)
+    counts = {}
+    capped = False
+    assignments = []
+    for _ in leads:
+        if not heap:
+            assignments.append(DEFERRED_BY_CAP if capped else None)
+            continue
+        _, row = heapq.heappop(heap)
+        partner = state[row]
+        before = dict(partner)
+        partner["guthaben"] = round(partner["guthaben"] - LEAD_PREIS, 2)
+        partner["leads_geliefert"] += 1
+        partner["letzter_lead"] = now
+        if partner["guthaben"] < LEAD_PREIS:
+            partner["status"] = "Pausiert"
+        counts[row] = counts.get(row, 0) + 1
+        assignments.append({"partner": before, "guthaben": partner["guthaben"]})
+        if not is_partner_eligible(partner):
+            continue
+        if max_per_partner and counts[row] >= max_per_partner:
+            capped = True
+        else:
+            heapq.heappush(heap, (partner_sort_key(partner), row))
+    return assignments, {row: state[row] for row in counts}
+
+
+def commit_allocations(sheet, changed, previous):
+    """
+    Alle Abbuchungen eines Zyklus mit EINEM batchUpdate schreiben. False,
+    wenn nichts geschrieben wurde (der Batch ist atomar).
+    """
+    batch = CellBatch(sheet)
+    for row, partner in changed.items():
+        batch.set(row, COL_GUTHABEN, partner["guthaben"])
+        batch.set(row, COL_LEADS_GELIEFERT, partner["leads_geliefert"])
+        batch.set(row, COL_LETZTER_LEAD, partner["letzter_lead"])
+        if partner["status"] != previous[row]["status"]:
+            batch.set(row, COL_STATUS, partner["status"])
     try:
-        sheet = get_partner_sheet()
+        batch.flush()
     except Exception as e:
+        check_google_error(e)
+        logger.error(f"Fehler beim Update ({len(changed)} Partner): {e}")
+        partner_index.invalidate()
+        partner_snapshot.expire()
+        return False
+
+    for row, partner in changed.items():
+        partner_index.update(partner)
+        partner_snapshot.update(partner)
+        if partner["status"] == "Pausiert" and previous[row]["status"] != "Pausiert":
+            notify_partner_paused(partner, partner["guthaben"])
+    return True
+
+
+def assign_leads(leads):
+    """
+    Zuteilung für einen ganzen Poll-Zyklus: ein Partner-Snapshot, eine
+    Zuteilung, ein Schreibvorgang. Mit Ledger bucht jeder Lead lokal in
+    SQLite ab – dort gibt es keinen Sheet-Zugriff pro Lead zu sparen.
+    """
+    if get_partner_ledger():
+        return [assign_lead(lead) for lead in leads]
+
+    try:
+        with lead_stage_seconds.time(stage="sheet_open"):
+            sheet = get_partner_sheet()
+    except Exception as e:
+        check_google_error(e)
         logger.error(f"Sheet-Fehler: {e}")
-        return
+        return [{"error": str(e), "retry": True} for _ in leads]
+
+    now = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+    with allocation_lock:
+        try:
+            with lead_stage_seconds.time(stage="partner_read"):
+                partner_index.ensure(sheet)
+                snapshot = partner_index.snapshot()
+        except Exception as e:
+            check_google_error(e)
+            logger.error(f"Fehler beim Lesen: {e}")
+            return [{"error": str(e), "retry": True} for _ in leads]
+        with lead_stage_seconds.time(stage="partner_select"):
+            assignments, changed = allocate_leads(leads, snapshot, now, MAX_LEADS_PER_CYCLE)
+        try:
+            if changed and not partner_index.confirm(sheet, changed):
+                # Sheet wurde umgebaut/aufgeladen → mit frischem Stand neu zuteilen
+                snapshot = partner_index.snapshot()
+                assignments, changed = allocate_leads(leads, snapshot, now, MAX_LEADS_PER_CYCLE)
+        except Exception as e:
+            check_google_error(e)
+            logger.error(f"Fehler beim Prüfen der Partner-Zeilen: {e}")
+            return [{"error": str(e), "retry": True} for _ in leads]
+        if changed:
+            with lead_stage_seconds.time(stage="partner_write"):
+                committed = commit_allocations(sheet, changed, {p["row"]: p for p in snapshot})
+            if not committed:
+                # Niemand wurde belastet → nichts zustellen, nächster Zyklus
+                return [{"error": "Partner-Abbuchung fehlgeschlagen", "retry": True} for _ in leads]
+
+    deferred = sum(1 for a in assignments if a is DEFERRED_BY_CAP)
+    logger.info(f"🧮 {len(leads)} Leads auf {len(changed)} Partner verteilt"
+                + (f", {deferred} für den nächsten Zyklus zurückgestellt" if deferred else ""))
+    return [assignment or lead_without_partner(lead)
+            for lead, assignment in zip(leads, assignments)]
+
+
+def process_leads(leads):
+    """
+    Wie process_lead() für einen ganzen Batch: erst alle zuteilen, dann alle
+    Nachrichten parallel einreihen. Liefert (lead, Ergebnis) in Reihenfolge.
+    """
+    assignments = assign_leads(leads)
+    futures = [notify_lead(lead, a["partner"], a["guthaben"]) if "error" not in a else None
+               for lead, a in zip(leads, assignments)]
+    for lead, assignment, future in zip(leads, assignments, futures):
+        if future is None:
+            yield lead, assignment
+            continue
+        try:
+            yield lead, finish_lead(lead, assignment, future.result())
+        except Exception as e:
+            logger.error(f"Fehler bei Lead {lead['name']}: {e}")
+            yield lead, {"error": str(e)}
+
 
+# ─── Stripe Zahlung verarbeiten ──────────────
+def find_stripe_partner(sheet, customer_phone, customer_name):
     # Partner suchen (Telefon ODER Name)
     partner = None
     if customer_phone:
         partner = find_partner_by_phone(sheet, customer_phone)
     if not partner and customer_name:
         partner = find_partner_by_name(sheet, customer_name)
+    return partner
 
-    if partner:
-        neues_guthaben = update_partner_guthaben(sheet, partner, amount)
-        action = "GUTHABEN ERHÖHT"
-        partner_name = partner["name"]
-    else:
-        # Neuer Partner
-        add_new_partner(sheet, customer_name, customer_phone, amount)
-        neues_guthaben = amount
-        action = "NEUER PARTNER"
-        partner_name = customer_name
+
+def process_stripe_payment(customer_name, customer_phone, customer_email, amount, session_id=None):
+    logger.info(f"=== Stripe: {customer_name} | {amount}€ ===")
+
+    try:
+        sheet = get_partner_sheet()
+    except Exception as e:
+        check_google_error(e)
+        logger.error(f"Sheet-Fehler: {e}")
+        raise  # Job-Queue wiederholt die Gutschrift später
+
+    # Suche und Gutschrift unter allocation_lock wie die Lead-Abbuchung –
+    # sonst schreibt eine von beiden einen veralteten Stand zurück
+    with allocation_lock:
+        partner = find_stripe_partner(sheet, customer_phone, customer_name)
+        if partner and not confirm_partner_rows(sheet, [partner["row"]]):
+            partner = find_stripe_partner(sheet, customer_phone, customer_name)
+
+        if partner:
+            neues_guthaben = update_partner_guthaben(sheet, partner, amount)
+            credited = neues_guthaben is not None
+            action = "GUTHABEN ERHÖHT"
+            partner_name = partner["name"]
+        else:
+            # Neuer Partner
+            credited = add_new_partner(sheet, customer_name, customer_phone, amount)
+            neues_guthaben = amount
+            action = "NEUER PARTNER"
+            partner_name = customer_name
+
+    # Der Batch-Write ist atomar: nicht gebucht heißt gar nicht geschrieben,
+    # die Job-Queue darf die Gutschrift also gefahrlos wiederholen
+    if not credited:
+        logger.error(f"❌ Gutschrift {amount}€ für {customer_name} fehlgeschlagen – wird wiederholt")
+        raise RuntimeError(f"Gutschrift {amount}€ für {customer_name} fehlgeschlagen")
+
+    # Jede gebuchte Gutschrift festhalten – Grundlage für reconcile_stripe()
+    if session_id:
+        stripe_credits.record(session_id, partner or {"row": None, "name": customer_name,
+                                                       "telefon": normalize_phone(customer_phone)},
+                              amount, customer_email)
 
     # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
     # 1️⃣ PARTNER BENACHRICHTIGEN (optional - wenn Tel vorhanden)
@@ -385,11 +2321,9 @@ def process_stripe_payment(customer_name, customer_phone, customer_email, amount
             f"📊 Neues Guthaben: {neues_guthaben}€\n\n"
             f"Du bist aktiv und erhältst Leads!"
         )
-        partner_result = send_whatsapp(normalize_phone(customer_phone), partner_msg)
-        if "error" not in partner_result:
-            logger.info(f"✅ Partner-Benachrichtigung gesendet an {customer_phone}")
-    
-    time.sleep(2)  # Rate-Limit-Schutz
+        partner_future = queue_whatsapp(normalize_phone(customer_phone), partner_msg)
+    else:
+        partner_future = None
     
     # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
     # 2️⃣ MATZE BENACHRICHTIGEN (ADMIN-INFO - WIE BEI LEADS!)
@@ -405,11 +2339,16 @@ def process_stripe_payment(customer_name, customer_phone, customer_email, amount
         f"👤 Partner: {partner_name}"
     )
     
-    logger.info("📤 Sende Stripe-Admin-Info an Matze...")
-    matze_result = send_whatsapp(MATZE_PHONE, matze_msg)
-    
-    if "error" in matze_result:
-        logger.error(f"❌ Matze-Benachrichtigung fehlgeschlagen: {matze_result}")
+    matze_future = admin_notifier.notify(
+        "stripe", matze_msg, f"💰 {customer_name}: {amount}€ – {action} (Guthaben {neues_guthaben}€)")
+
+    if partner_future and "error" not in partner_future.result():
+        logger.info(f"✅ Partner-Benachrichtigung gesendet an {customer_phone}")
+
+    if matze_future is None:
+        logger.info("📋 Stripe-Admin-Info für die Zusammenfassung vorgemerkt")
+    elif "error" in matze_future.result():
+        logger.error(f"❌ Matze-Benachrichtigung fehlgeschlagen: {matze_future.result()}")
     else:
         logger.info(f"✅ Matze-Benachrichtigung gesendet!")
     # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
@@ -417,114 +2356,1291 @@ def process_stripe_payment(customer_name, customer_phone, customer_email, amount
     logger.info(f"Stripe fertig: {action}")
 
 
+# ─── Stripe-Abgleich ─────────────────────────
+class StripeCreditStore:
+    """
+    Jede tatsächlich gebuchte Stripe-Gutschrift (Session, Partner, Betrag)
+    in der State-DB. Soll (Stripe) gegen Ist (Summe je Session) ergibt
+    fehlende und doppelte Gutschriften. Korrekturen sind eigene Zeilen mit
+    source='reconcile' – ein zweiter Abgleich findet danach nichts mehr.
+    """
+
+    def __init__(self):
+        self.ready_path = None
+
+    def _db(self):
+        conn = open_state_db()
+        if self.ready_path != STATE_DB:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS stripe_credits (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    session_id TEXT NOT NULL,
+                    partner_row INTEGER,
+                    partner_name TEXT NOT NULL DEFAULT '',
+                    telefon TEXT NOT NULL DEFAULT '',
+                    email TEXT NOT NULL DEFAULT '',
+                    amount REAL NOT NULL,
+                    source TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS stripe_credits_session ON stripe_credits (session_id);
+                CREATE TABLE IF NOT EXISTS state_meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+            """)
+            # Ältere Sessions wurden nie erfasst → der Abgleich beginnt standardmäßig hier
+            conn.execute("INSERT OR IGNORE INTO state_meta (key, value) VALUES ('stripe_credits_since', ?)",
+                         (str(time.time()),))
+            self.ready_path = STATE_DB
+        return conn
+
+    def tracking_since(self):
+        return float(self._db().execute(
+            "SELECT value FROM state_meta WHERE key = 'stripe_credits_since'").fetchone()[0])
+
+    def record(self, session_id, partner, amount, email="", source="webhook", conn=None):
+        (conn or self._db()).execute(
+            "INSERT INTO stripe_credits (session_id, partner_row, partner_name, telefon, email, amount, "
+            "source, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (session_id, partner.get("row"), partner.get("name") or "", partner.get("telefon") or "",
+             (email or "").strip().lower(), amount, source, time.time()))
+
+    def credits(self, session_id):
+        """(Zeile, Name, Telefon, Betrag) aller Buchungen zu einer Session – meist 0 oder 1."""
+        return self._db().execute(
+            "SELECT partner_row, partner_name, telefon, amount FROM stripe_credits WHERE session_id = ? "
+            "ORDER BY id", (session_id,)).fetchall()
+
+    def email_index(self):
+        """E-Mail → (Telefon, Zeile, Name) des Partners, der zuletzt darüber aufgeladen hat."""
+        return {email: (telefon, row, name) for email, telefon, row, name in self._db().execute(
+            "SELECT email, telefon, partner_row, partner_name FROM stripe_credits "
+            "WHERE email != '' ORDER BY id")}
+
+
+stripe_credits = StripeCreditStore()
+reconcile_lock = threading.Lock()
+# Läufe aus der API: run_id → Zustand, die letzten RECONCILE_RUNS_KEPT
+reconcile_runs = OrderedDict()
+RECONCILE_RUNS_KEPT = 20
+
+
+def iter_checkout_sessions(created_gte=None, created_lt=None, page_size=100, stats=None):
+    """
+    Abgeschlossene Checkout-Sessions, Seite für Seite per starting_after.
+    Im Speicher liegt nie mehr als eine Seite, egal wie viele es sind.
+    """
+    params = {"limit": page_size, "status": "complete"}
+    created = {key: int(value) for key, value in (("gte", created_gte), ("lt", created_lt))
+               if value is not None}
+    if created:
+        params["created"] = created
+    while True:
+        page = stripe.checkout.Session.list(**params)
+        if stats is not None:
+            stats["pages"] += 1
+        yield from page.data
+        if not page.has_more or not page.data:
+            return
+        params["starting_after"] = page.data[-1]["id"]
+
+
+def _reconcile_partner_records():
+    ledger = get_partner_ledger()
+    if ledger:
+        ledger.ensure_loaded(get_partner_sheet())
+        return ledger.records()
+    sheet = get_partner_sheet()
+    with allocation_lock:
+        partner_index.ensure(sheet)
+        return partner_index.snapshot()
+
+
+def apply_credit_fixes(fixes):
+    """
+    Korrekturen eines Blocks (session_id, Partner, ±Betrag, E-Mail) mit
+    EINEM Sheet-batchUpdate bzw. einer Ledger-Transaktion buchen und als
+    stripe_credits festhalten. Gibt die Zahl der gebuchten Korrekturen zurück.
+    """
+    deltas = {}
+    for _, partner, delta, _ in fixes:
+        deltas[partner["row"]] = round(deltas.get(partner["row"], 0) + delta, 2)
+
+    ledger = get_partner_ledger()
+    if ledger:
+        with state_transaction() as conn:
+            updated = [ledger.adjust(conn, row, delta) for row, delta in deltas.items()]
+            for session_id, partner, delta, email in fixes:
+                stripe_credits.record(session_id, partner, delta, email, source="reconcile", conn=conn)
+        for record in updated:
+            partner_snapshot.update(record)
+        return len(fixes)
+
+    sheet = get_partner_sheet()
+    with allocation_lock:
+        partner_index.ensure(sheet)
+        partner_index.confirm(sheet, deltas)
+        batch = CellBatch(sheet)
+        updated = []
+        for row, delta in deltas.items():
+            current = partner_index.get(row)
+            expected = next(p for _, p, _, _ in fixes if p["row"] == row)
+            if not current or (current["telefon"], current["name"]) != (expected["telefon"], expected["name"]):
+                logger.warning(f"⚠️ Abgleich: Zeile {row} gehört nicht mehr {expected['name']} – übersprungen")
+                continue
+            guthaben = round(current["guthaben"] + delta, 2)
+            if delta > 0:
+                status = "Aktiv"
+            else:
+                status = "Pausiert" if guthaben < LEAD_PREIS else current["status"]
+            batch.set(row, COL_GUTHABEN, guthaben).set(row, COL_STATUS, status)
+            updated.append({**current, "guthaben": guthaben, "status": status})
+        batch.flush()
+        for record in updated:
+            partner_index.update(record)
+            partner_snapshot.update(record)
+
+    applied = {record["row"] for record in updated}
+    booked = [fix for fix in fixes if fix[1]["row"] in applied]
+    with state_transaction() as conn:
+        for session_id, partner, delta, email in booked:
+            stripe_credits.record(session_id, partner, delta, email, source="reconcile", conn=conn)
+    return len(booked)
+
+
+def reconcile_stripe(since=None, until=None, apply=False, page_size=100):
+    """
+    Gleicht abgeschlossene Stripe-Checkout-Sessions mit den gebuchten
+    Gutschriften ab: fehlend (Sheet-Fehler, Neustart, Namenssuche daneben),
+    doppelt oder keinem Partner zuzuordnen. Partner werden einmal über
+    Telefon bzw. bekannte E-Mail indiziert; mit apply=True werden fehlende
+    Gutschriften nachgebucht und doppelte storniert, jeweils in Blöcken
+    von RECONCILE_BATCH. Speicherbedarf unabhängig von der Session-Zahl.
+    """
+    since = stripe_credits.tracking_since() if since is None else since
+    until = time.time() - RECONCILE_GRACE_SECONDS if until is None else until
+
+    by_row, by_phone = {}, {}
+    for record in _reconcile_partner_records():
+        by_row[record["row"]] = record
+        if record["telefon"]:
+            by_phone.setdefault(record["telefon"], record)
+    by_email = stripe_credits.email_index()
+
+    def resolve(telefon, row=None, name=None):
+        if telefon and telefon in by_phone:
+            return by_phone[telefon]
+        if row in by_row and by_row[row]["name"] == name:
+            return by_row[row]
+        return None
+
+    report = {
+        "since": datetime.fromtimestamp(since, timezone.utc).isoformat(),
+        "until": datetime.fromtimestamp(until, timezone.utc).isoformat(),
+        "apply": apply, "pages": 0, "sessions": 0, "ok": 0,
+        "missing": 0, "double": 0, "unmatched": 0, "fixed": 0, "details": [],
+    }
+    fixes = []
+    for session in iter_checkout_sessions(since, until, page_size, report):
+        report["sessions"] += 1
+        expected = (session.get("amount_total") or 0) / 100
+        credits = stripe_credits.credits(session["id"])
+        delta = round(expected - sum(credit[3] for credit in credits), 2)
+        if delta == 0:
+            report["ok"] += 1
+            continue
+
+        details = session.get("customer_details") or {}
+        email = (details.get("email") or "").strip().lower()
+        if credits:
+            # Korrektur beim Partner, der die Gutschrift(en) tatsächlich bekam
+            row, name, telefon, _ = credits[0]
+            partner = resolve(telefon, row, name)
+        else:
+            telefon = normalize_phone(details.get("phone") or "")
+            partner = resolve(telefon)
+            if partner is None and email in by_email:
+                partner = resolve(*by_email[email])
+
+        kind = "unmatched" if partner is None else "missing" if delta > 0 else "double"
+        report[kind] += 1
+        if len(report["details"]) < RECONCILE_REPORT_LIMIT:
+            report["details"].append({
+                "kind": kind,
+                "session_id": session["id"],
+                "created": datetime.fromtimestamp(session.get("created") or 0, timezone.utc).isoformat(),
+                "amount": expected,
+                "delta": delta,
+                "name": details.get("name") or "",
+                "email": email,
+                "partner": partner["name"] if partner else None,
+            })
+        if apply and partner is not None:
+            fixes.append((session["id"], partner, delta, email))
+            if len(fixes) >= RECONCILE_BATCH:
+                report["fixed"] += apply_credit_fixes(fixes)
+                fixes = []
+
+    if fixes:
+        report["fixed"] += apply_credit_fixes(fixes)
+    logger.info(f"🧾 Stripe-Abgleich: {report['sessions']} Sessions, {report['missing']} fehlend, "
+                f"{report['double']} doppelt, {report['unmatched']} ohne Partner, {report['fixed']} korrigiert")
+    if report["fixed"]:
+        admin_notifier.notify(
+            "stripe",
+            f"🧾 *Stripe-Abgleich*\n\n{report['missing']} fehlende Gutschriften nachgebucht, "
+            f"{report['double']} doppelte storniert\n{report['unmatched']} Zahlungen ohne Partner",
+            f"🧾 Abgleich: {report['fixed']} Korrekturen")
+    return report
+
+
+# ─── Leads_Log-Export ────────────────────────
+class LeadsLogMirror:
+    """
+    Leads_Log als Tagesdateien auf der Platte (LEADS_EXPORT_DIR/JJJJ-MM-TT.jsonl)
+    plus Zeilenmarke. Leads_Log wird nur angehängt: ein Export liest nur die
+    Zeilen nach der Marke, in Blöcken zu LEADS_EXPORT_CHUNK. Abgeschlossene
+    Tage kommen damit komplett von der Platte. Die letzte gespiegelte Zeile
+    wird jedes Mal mitgelesen – passt sie nicht mehr (Zeilen im Sheet
+    gelöscht/verschoben), wird der Cache neu aufgebaut.
+    """
+
+    UNKNOWN_DAY = "unbekannt"
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats = {"syncs": 0, "rebuilds": 0, "rows_read": 0, "sheet_requests": 0}
+
+    def _path(self, name):
+        return os.path.join(LEADS_EXPORT_DIR, name)
+
+    def _load_manifest(self):
+        try:
+            with open(self._path("manifest.json"), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"next_row": 2, "last_row": None, "days": {}}
+
+    def _save_manifest(self, manifest):
+        target = self._path("manifest.json")
+        with open(target + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        os.replace(target + ".tmp", target)
+
+    def _clear(self):
+        for name in os.listdir(LEADS_EXPORT_DIR):
+            os.remove(self._path(name))
+
+    def _truncate(self, path, lines):
+        with open(path, encoding="utf-8") as src, open(path + ".tmp", "w", encoding="utf-8") as dst:
+            dst.writelines(itertools.islice(src, lines))
+        os.replace(path + ".tmp", path)
+
+    def _append(self, manifest, rows, checked):
+        by_day = {}
+        for row in rows:
+            if any(row):
+                day = row[0][:10] if len(row[0]) >= 10 and row[0][4] == "-" else self.UNKNOWN_DAY
+                by_day.setdefault(day, []).append(row)
+        for day, day_rows in by_day.items():
+            path = self._path(f"{day}.jsonl")
+            expected = manifest["days"].get(day, 0)
+            # Absturz zwischen Anhängen und Manifest → überzählige Zeilen abschneiden
+            if day not in checked and os.path.exists(path):
+                checked.add(day)
+                with open(path, encoding="utf-8") as f:
+                    if sum(1 for _ in f) != expected:
+                        self._truncate(path, expected)
+            with open(path, "a", encoding="utf-8") as f:
+                for row in day_rows:
+                    f.write(json.dumps(row, ensure_ascii=False) + "\n")
+            manifest["days"][day] = expected + len(day_rows)
+
+    def _sync(self, sheet, rebuild):
+        """Gibt die Zahl neuer Zeilen zurück – oder None, wenn die Marke nicht mehr passt."""
+        width = len(LEADS_LOG_HEADER)
+        last_col = gspread.utils.rowcol_to_a1(1, width).rstrip("1")
+        manifest = self._load_manifest()
+        if rebuild:
+            self._clear()
+            manifest = {"next_row": 2, "last_row": None, "days": {}}
+            self.stats["rebuilds"] += 1
+        overlap = manifest["last_row"] is not None
+        start = manifest["next_row"] - 1 if overlap else manifest["next_row"]
+        checked = set()
+        read = 0
+        while True:
+            end = start + LEADS_EXPORT_CHUNK - 1
+            values = sheet.get(f"A{start}:{last_col}{end}")
+            self.stats["sheet_requests"] += 1
+            rows = [[str(v) for v in row] + [""] * (width - len(row)) for row in values]
+            fetched = len(rows)
+            if overlap:
+                if not rows or rows[0] != manifest["last_row"]:
+                    return None
+                rows = rows[1:]
+                overlap = False
+            if rows:
+                self._append(manifest, rows, checked)
+                manifest["next_row"] += len(rows)
+                manifest["last_row"] = rows[-1]
+                self._save_manifest(manifest)
+                read += len(rows)
+            if fetched < LEADS_EXPORT_CHUNK:
+                return read
+            start = end + 1
+
+    def sync(self, sheet, rebuild=False):
+        """Neue Zeilen aus Leads_Log übernehmen; gibt die Zahl gelesener Zeilen zurück."""
+        with self.lock:
+            os.makedirs(LEADS_EXPORT_DIR, exist_ok=True)
+            read = self._sync(sheet, rebuild)
+            if read is None:
+                logger.warning("🔄 Leads_Log wurde verändert – Export-Cache wird neu aufgebaut")
+                read = self._sync(sheet, rebuild=True)
+            self.stats["syncs"] += 1
+            self.stats["rows_read"] += read
+            return read
+
+    def iter_rows(self, date_from=None, date_to=None):
+        """Gespiegelte Zeilen tageweise in Zeilenreihenfolge – eine Zeile nach der anderen."""
+        # Stand des Manifests festhalten: später angehängte Zeilen nicht mitlesen
+        with self.lock:
+            days = sorted(self._load_manifest()["days"].items())
+        for day, count in days:
+            if day == self.UNKNOWN_DAY:
+                if date_from or date_to:
+                    continue
+            elif (date_from and day < date_from) or (date_to and day > date_to):
+                continue
+            try:
+                with open(self._path(f"{day}.jsonl"), encoding="utf-8") as f:
+                    for line in itertools.islice(f, count):
+                        yield json.loads(line)
+            except FileNotFoundError:
+                continue
+
+
+leads_log_mirror = LeadsLogMirror()
+
+
+def export_leads_log(fmt="csv", date_from=None, date_to=None, partner=None, status=None):
+    """
+    Export als CSV bzw. NDJSON, in Blöcken von ein paar hundert Zeilen
+    ausgegeben. Filter: Tage (inklusive), Partner (Telefon oder Name), Status.
+    """
+    partner_phone = normalize_phone(partner) if looks_like_phone(partner) else ""
+    partner_name = (partner or "").strip().lower()
+    status = (status or "").strip().upper()
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if fmt == "csv":
+        writer.writerow(LEADS_LOG_HEADER)
+
+    for row in leads_log_mirror.iter_rows(date_from, date_to):
+        if status and row[8].strip().upper() != status:
+            continue
+        if partner:
+            if partner_phone:
+                if normalize_phone(row[5]) != partner_phone:
+                    continue
+            elif row[4].strip().lower() != partner_name:
+                continue
+        if fmt == "csv":
+            writer.writerow(row)
+        else:
+            buffer.write(json.dumps(dict(zip(LEADS_LOG_HEADER, row)), ensure_ascii=False) + "\n")
+        if buffer.tell() >= 64 * 1024:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+# ─── Leases / Claims ─────────────────────────
+# Jede Instanz beansprucht eine CREATED-Zeile per Compare-and-Set, bevor sie
+# sie auf PROCESSING setzt. Claims laufen nach CLAIM_TTL ab, damit Zeilen
+# eines abgestürzten Workers wieder frei werden.
+INSTANCE_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class LocalLeaseBackend:
+    """Nur innerhalb dieses Prozesses (eine Instanz, ein Worker)."""
+
+    shared = False
+
+    def __init__(self):
+        self.leases = {}
+        self.lock = threading.Lock()
+
+    def claim_many(self, names, ttl, owner=INSTANCE_ID):
+        now = time.time()
+        won = set()
+        with self.lock:
+            for name in names:
+                current = self.leases.get(name)
+                if current is None or current[1] < now or current[0] == owner:
+                    self.leases[name] = (owner, now + ttl)
+                    won.add(name)
+        return won
+
+    def release_many(self, names, owner=INSTANCE_ID):
+        with self.lock:
+            for name in names:
+                if self.leases.get(name, (None,))[0] == owner:
+                    del self.leases[name]
+
+    def is_held(self, name):
+        with self.lock:
+            current = self.leases.get(name)
+            return current is not None and current[1] >= time.time()
+
+
+class FileLeaseBackend:
+    """Claims in einer JSON-Datei, geschützt per flock – für mehrere Worker auf einem Host."""
+
+    shared = True
+
+    def __init__(self, path):
+        self.path = path
+        self.lock_path = path + ".lock"
+
+    def _locked(self, update):
+        import fcntl
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                try:
+                    with open(self.path) as f:
+                        leases = json.load(f)
+                except (OSError, ValueError):
+                    leases = {}
+                result, changed = update(leases)
+                if changed:
+                    tmp = self.path + ".tmp"
+                    with open(tmp, "w") as f:
+                        json.dump(leases, f)
+                    os.replace(tmp, self.path)
+                return result
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def claim_many(self, names, ttl, owner=INSTANCE_ID):
+        def update(leases):
+            now = time.time()
+            for name, (_, expires) in list(leases.items()):
+                if expires < now:
+                    del leases[name]
+            won = set()
+            for name in names:
+                if name not in leases or leases[name][0] == owner:
+                    leases[name] = [owner, now + ttl]
+                    won.add(name)
+            return won, True
+        return self._locked(update)
+
+    def release_many(self, names, owner=INSTANCE_ID):
+        def update(leases):
+            released = [n for n in names if leases.get(n, [None])[0] == owner]
+            for name in released:
+                del leases[name]
+            return None, bool(released)
+        self._locked(update)
+
+    def is_held(self, name):
+        return self._locked(lambda leases: (name in leases and leases[name][1] >= time.time(), False))
+
+
+class SQLiteLeaseBackend:
+    """Claims in SQLite (WAL) – Compare-and-Set per UPSERT mit Ablaufzeit."""
+
+    shared = True
+
+    def __init__(self):
+        open_state_db().execute("CREATE TABLE IF NOT EXISTS leases ("
+                                "name TEXT PRIMARY KEY, owner TEXT NOT NULL, expires REAL NOT NULL)")
+
+    def claim_many(self, names, ttl, owner=INSTANCE_ID):
+        now = time.time()
+        won = set()
+        with state_transaction() as conn:
+            for name in names:
+                cur = conn.execute(
+                    "INSERT INTO leases (name, owner, expires) VALUES (?, ?, ?) "
+                    "ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires = excluded.expires "
+                    "WHERE leases.expires < ? OR leases.owner = excluded.owner",
+                    (name, owner, now + ttl, now))
+                if cur.rowcount:
+                    won.add(name)
+        return won
+
+    def release_many(self, names, owner=INSTANCE_ID):
+        open_state_db().executemany("DELETE FROM leases WHERE name = ? AND owner = ?",
+                                    [(name, owner) for name in names])
+
+    def is_held(self, name):
+        row = open_state_db().execute("SELECT 1 FROM leases WHERE name = ? AND expires >= ?",
+                                      (name, time.time())).fetchone()
+        return row is not None
+
+
+def make_lease_backend(kind):
+    if kind == "sqlite":
+        return SQLiteLeaseBackend()
+    if kind == "file":
+        return FileLeaseBackend(os.path.join(STATE_DIR, "leases.json"))
+    return LocalLeaseBackend()
+
+
+lead_claims = make_lease_backend(LEASE_BACKEND)
+
+
+def claim_key(row):
+    return f"lead-row:{row}"
+
+
+def confirm_still_created(sheet, leads):
+    """Compare-Schritt: Status in Spalte P direkt vor dem Claim noch einmal lesen."""
+    if not leads:
+        return []
+    ranges = [gspread.utils.rowcol_to_a1(lead["row"], LEADS_COL_STATUS) for lead in leads]
+    values = sheet.batch_get(ranges)
+    confirmed = []
+    for lead, value in zip(leads, values):
+        status = value[0][0] if value and value[0] else ""
+        if status == "CREATED":
+            confirmed.append(lead)
+    return confirmed
+
+
 # ─── Sheet Polling ───────────────────────────
-def poll_new_leads():
+# Spalte P in Tabellenblatt1 (CREATED → PROCESSING → VERTEILT/FEHLER)
+LEADS_COL_STATUS = 16
+
+
+# Neue Leads werden nur unten angehängt. Wir merken uns die letzte Zeile, bis
+# zu der alles fertig ist (high_water), und lesen ab dort nur noch den Rest.
+_poll_state = {"high_water": None, "since_full_scan": 0}
+
+# Noch nicht geschriebene Status: Zeile → (Status, Job-ID). Ein abgelehnter
+# Batch (z. B. 429) bleibt hier und wird beim nächsten Flush wiederholt.
+_status_backlog = {}
+
+
+def load_poll_state():
+    try:
+        with open(POLL_STATE_FILE) as f:
+            return int(json.load(f).get("high_water", 1))
+    except (OSError, ValueError, TypeError):
+        return 1
+
+
+def save_poll_state(high_water):
+    try:
+        os.makedirs(os.path.dirname(POLL_STATE_FILE) or ".", exist_ok=True)
+        tmp = POLL_STATE_FILE + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"high_water": high_water, "updated": time.time()}, f)
+        os.replace(tmp, POLL_STATE_FILE)
+    except OSError as e:
+        logger.error(f"Poll-State nicht gespeichert: {e}")
+
+
+def read_lead_rows(sheet, start_row):
+    """Liest Tabellenblatt1 ab start_row (A:P). Nur der Tail, nicht alles."""
+    try:
+        return list(sheet.get(f"A{start_row}:P"))
+    except gspread.exceptions.APIError as e:
+        # Start hinter dem Grid-Ende → es gibt schlicht keine neuen Zeilen
+        if "exceeds grid limits" in str(e):
+            return []
+        raise
+
+
+def poll_new_leads(full_scan=False):
     acquired = poll_lock.acquire(blocking=False)
     if not acquired:
         return {"processed": 0, "message": "Bereits aktiv"}
 
     try:
-        return _do_poll()
+        return _do_poll(full_scan)
     finally:
         poll_lock.release()
 
 
-def _do_poll():
+def parse_lead_row(row_idx, row):
+    col_m = row[12] if len(row) > 12 else ""
+    col_n = row[13] if len(row) > 13 else ""
+    col_o = row[14] if len(row) > 14 else ""
+    
+    raw_values = [col_m, col_n, col_o]
+    name = "Unbekannt"
+    email = ""
+    phone_raw = ""
+    
+    for val in raw_values:
+        val_stripped = val.strip()
+        if not val_stripped:
+            continue
+        if (val_stripped.startswith("p:") or 
+            val_stripped.startswith("+49") or
+            val_stripped.startswith("49") or
+            (val_stripped.startswith("0") and len(val_stripped) > 8)):
+            phone_raw = val_stripped
+        elif "@" in val_stripped:
+            email = val_stripped
+        else:
+            name = val_stripped
+    
+    lead_id = row[0].strip() if row else ""
+    return {
+        "row": row_idx,
+        "name": name,
+        "email": email,
+        "phone": normalize_phone(phone_raw),
+        "leadgen_id": lead_id[2:] if lead_id.startswith("l:") else lead_id,
+        "source": "poll",
+        "received_at": time.time(),
+    }
+
+
+def write_lead_statuses(sheet, statuses):
+    """
+    Schreibt {Zeile: Status} in Spalte P mit einem Batch-Request. Der Batch
+    gilt ganz oder gar nicht: bei einem Fehler wird nichts geschrieben und
+    auch nicht Zelle für Zelle nachgeschoben – das wären bei einem 429 nur
+    N weitere Requests gegen die erschöpfte Quota. Gibt die geschriebenen
+    Zeilen zurück.
+    """
+    if not statuses:
+        return set()
+
+    batch = CellBatch(sheet)
+    for row, status in statuses.items():
+        batch.set(row, LEADS_COL_STATUS, status)
+    try:
+        batch.flush()
+        return set(statuses)
+    except Exception as e:
+        check_google_error(e)
+        logger.error(f"Batch-Status-Update fehlgeschlagen ({len(statuses)} Zeilen bleiben offen): {e}")
+        return set()
+
+
+def flush_status_backlog(sheet):
+    """
+    Offene Status aus _status_backlog mit einem Batch schreiben; für die
+    geschriebenen Zeilen Claim freigeben und Job abschließen. Bei einem
+    Fehler bleibt alles im Backlog (Zeilen stehen weiter auf PROCESSING,
+    die Jobs bleiben offen) und wird beim nächsten Flush wiederholt.
+    Gibt {Zeile: Status} der geschriebenen Zeilen zurück.
+    """
+    statuses = {row: status for row, (status, _) in _status_backlog.items()}
+    written = write_lead_statuses(sheet, statuses)
+    lead_claims.release_many([claim_key(row) for row in written])
+    job_queue.complete(*[_status_backlog.pop(row)[1] for row in written])
+    return {row: statuses[row] for row in written}
+
+
+def _do_poll(full_scan=False):
     logger.info("=== Polling gestartet ===")
+    calls_before = google_api_stats["calls"]
     
     try:
         leads_sheet = get_leads_sheet()
         partner_sheet = get_partner_sheet()
     except Exception as e:
+        check_google_error(e)
         logger.error(f"Sheet-Fehler: {e}")
-        return {"error": str(e)}
-
-    all_values = leads_sheet.get_all_values()
-    if len(all_values) <= 1:
-        return {"processed": 0}
+        return {"error": str(e), "rate_limited": is_rate_limited(e)}
+
+    # Im letzten Zyklus abgelehnte Status zuerst nachholen
+    if _status_backlog:
+        flush_status_backlog(leads_sheet)
+
+    if _poll_state["high_water"] is None:
+        _poll_state["high_water"] = load_poll_state()
+    high_water = _poll_state["high_water"]
+    if high_water <= 1 or _poll_state["since_full_scan"] >= POLL_FULL_SCAN_EVERY:
+        full_scan = True
+    start_row = 2 if full_scan else high_water + 1
+
+    rows = read_lead_rows(leads_sheet, start_row)
+    if full_scan:
+        _poll_state["since_full_scan"] = 0
+    else:
+        _poll_state["since_full_scan"] += 1
 
-    new_leads = []
-    for row_idx, row in enumerate(all_values[1:], start=2):
+    created = []
+    unfinished = set()
+    for row_idx, row in enumerate(rows, start=start_row):
         lead_status = row[15] if len(row) > 15 else ""
-        
         if lead_status == "CREATED":
-            try:
-                leads_sheet.update_cell(row_idx, 16, "PROCESSING")
-            except Exception as e:
-                logger.error(f"Fehler beim Status-Update: {e}")
-                continue
-
-            col_m = row[12] if len(row) > 12 else ""
-            col_n = row[13] if len(row) > 13 else ""
-            col_o = row[14] if len(row) > 14 else ""
-            
-            raw_values = [col_m, col_n, col_o]
-            name = "Unbekannt"
-            email = ""
-            phone_raw = ""
-            
-            for val in raw_values:
-                val_stripped = val.strip()
-                if not val_stripped:
-                    continue
-                if (val_stripped.startswith("p:") or 
-                    val_stripped.startswith("+49") or
-                    val_stripped.startswith("49") or
-                    (val_stripped.startswith("0") and len(val_stripped) > 8)):
-                    phone_raw = val_stripped
-                elif "@" in val_stripped:
-                    email = val_stripped
-                else:
-                    name = val_stripped
-            
-            new_leads.append({
-                "row": row_idx,
-                "name": name,
-                "email": email,
-                "phone": normalize_phone(phone_raw),
-            })
-
+            created.append(parse_lead_row(row_idx, row))
+            unfinished.add(row_idx)
+        elif lead_status == "PROCESSING":
+            unfinished.add(row_idx)
+
+    def advance_high_water():
+        new_mark = min(unfinished) - 1 if unfinished else start_row + len(rows) - 1
+        if new_mark != _poll_state["high_water"]:
+            _poll_state["high_water"] = new_mark
+            save_poll_state(new_mark)
+
+    if not created:
+        advance_high_water()
+        return {"processed": 0, "scan": "full" if full_scan else "tail", "from_row": start_row}
+
+    # Zeilen beanspruchen (CAS im Lease-Backend); andere Instanzen bekommen sie nicht
+    won = lead_claims.claim_many([claim_key(lead["row"]) for lead in created], CLAIM_TTL)
+    ours = [lead for lead in created if claim_key(lead["row"]) in won]
+    if lead_claims.shared and ours:
+        confirmed = confirm_still_created(leads_sheet, ours)
+        lead_claims.release_many([claim_key(lead["row"]) for lead in ours if lead not in confirmed])
+        ours = confirmed
+
+    # Erst dauerhaft als Jobs vormerken, dann PROCESSING setzen – stirbt der
+    # Prozess mittendrin, setzt die Job-Queue nach dem Neustart dort fort
+    job_ids = dict(zip((lead["row"] for lead in ours),
+                       job_queue.put_claimed("sheet_lead", ours, CLAIM_TTL)))
+
+    # Alle beanspruchten Zeilen mit einem Request auf PROCESSING setzen
+    claimed = write_lead_statuses(leads_sheet, {lead["row"]: "PROCESSING" for lead in ours})
+    new_leads = [lead for lead in ours if lead["row"] in claimed]
+    lead_claims.release_many([claim_key(lead["row"]) for lead in ours if lead["row"] not in claimed])
+    job_queue.complete(*[job_ids[lead["row"]] for lead in ours if lead["row"] not in claimed])
     if not new_leads:
+        advance_high_water()
         return {"processed": 0}
 
     logger.info(f"🔥 {len(new_leads)} neue Leads")
 
     processed = 0
+    since_flush = 0
+
+    def set_status(lead, status):
+        nonlocal since_flush
+        _status_backlog[lead["row"]] = (status, job_ids[lead["row"]])
+        job_queue.set_result(job_ids[lead["row"]], status)
+        since_flush += 1
+
+    def flush_statuses():
+        nonlocal unfinished, since_flush
+        written = flush_status_backlog(leads_sheet)
+        # Zurück auf CREATED heißt: im nächsten Zyklus wieder ansehen
+        unfinished -= {row for row, status in written.items() if status != "CREATED"}
+        since_flush = 0
+
+    fresh = []
+    released = []
     for lead in new_leads:
+        state = sheet_leadgen_state(lead["leadgen_id"]) if lead["leadgen_id"] else "new"
+        if state == "delivered":
+            # Per Webhook zugestellt – nur die Zeile markieren
+            set_status(lead, "VERTEILT")
+        elif state == "failed":
+            # Per Webhook abgeschlossen, aber ohne Partner – Alarm und Log gab es
+            # dort schon. Claim freigeben: eine zurückgesetzte Zeile zählt wieder.
+            set_status(lead, "FEHLER")
+            released += [f"leadgen:{lead['leadgen_id']}", f"leadgen-failed:{lead['leadgen_id']}"]
+        elif state == "pending":
+            # Der Webhook-Weg arbeitet noch daran → Zeile bleibt für den nächsten Zyklus
+            set_status(lead, "CREATED")
+        else:
+            fresh.append(lead)
+
+    # Ein Partner-Snapshot und ein Schreibvorgang für alle Leads des Zyklus
+    for lead, result in process_leads(fresh):
+        if "error" not in result:
+            set_status(lead, "VERTEILT")
+            processed += 1
+        else:
+            # Zurückgestellt (MAX_LEADS_PER_CYCLE) oder vorübergehender Sheets-
+            # Fehler ohne Abbuchung → Zeile bleibt für den nächsten Zyklus
+            set_status(lead, "CREATED" if result.get("deferred") or result.get("retry") else "FEHLER")
+            if lead["leadgen_id"]:
+                released.append(f"leadgen:{lead['leadgen_id']}")
+
+        if since_flush >= STATUS_FLUSH_EVERY:
+            flush_statuses()
+
+    # Nicht zugestellt → leadgen-Claim freigeben, damit eine auf CREATED
+    # zurückgesetzte Zeile bzw. eine neue Webhook-Zustellung wieder zählt
+    if released:
+        processed_events.release(*released)
+    flush_statuses()
+    advance_high_water()
+
+    google_calls = google_api_stats["calls"] - calls_before
+    calls_per_lead = round(google_calls / len(new_leads), 1)
+    logger.info(f"📊 Google-API-Calls: {google_calls} ({calls_per_lead} pro Lead)")
+
+    return {"processed": processed, "total": len(new_leads),
+            "scan": "full" if full_scan else "tail",
+            "google_calls": google_calls, "google_calls_per_lead": calls_per_lead}
+
+
+class PollScheduler:
+    """
+    Adaptives Poll-Intervall: nach einem Poll mit Leads sofort auf
+    POLL_MIN_INTERVAL, ohne Leads exponentiell bis POLL_MAX_INTERVAL,
+    bei 429 deutlich stärker zurück. trigger() weckt den Poller sofort
+    (z. B. bei einem Webhook); Trigger während eines Polls ergeben genau
+    einen Folge-Poll.
+    """
+
+    def __init__(self, initial, minimum, maximum):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.interval = min(max(initial, minimum), maximum)
+        self.wakeup = threading.Event()
+        self.last_poll_at = None
+        self.last_latency = None
+        self.last_result = None
+        self.triggers = 0
+
+    def record(self, result, latency, rate_limited=False):
+        self.last_poll_at = time.time()
+        self.last_latency = latency
+        self.last_result = result
+        if rate_limited:
+            self.interval = min(self.maximum, max(self.interval, self.minimum) * 4)
+        elif result.get("message") == "Bereits aktiv":
+            pass
+        elif result.get("processed") or result.get("total"):
+            self.interval = self.minimum
+        else:
+            self.interval = min(self.maximum, self.interval * 2)
+
+    def trigger(self):
+        self.triggers += 1
+        self.wakeup.set()
+
+    def wait(self):
+        triggered = self.wakeup.wait(self.interval)
+        self.wakeup.clear()
+        return triggered
+
+    def status(self):
+        next_in = None
+        if self.last_poll_at is not None:
+            next_in = round(max(0.0, self.last_poll_at + self.interval - time.time()), 1)
+        return {
+            "interval_s": self.interval,
+            "min_s": self.minimum,
+            "max_s": self.maximum,
+            "last_poll_at": self.last_poll_at,
+            "last_latency_ms": round(self.last_latency * 1000, 1) if self.last_latency is not None else None,
+            "next_poll_in_s": next_in,
+            "triggers": self.triggers,
+        }
+
+
+poll_scheduler = PollScheduler(POLL_INTERVAL, POLL_MIN_INTERVAL, POLL_MAX_INTERVAL)
+
+
+def is_rate_limited(e):
+    return (isinstance(e, gspread.exceptions.APIError)
+            and getattr(e.response, "status_code", None) == 429)
+
+
+def recover_stuck_rows():
+    """
+    Startup-Sweep: Zeilen, die ohne offenen Job und ohne gültigen Claim in
+    PROCESSING hängen (z. B. von einem Absturz vor der Job-Queue), wieder auf
+    CREATED setzen, damit der nächste Poll sie verteilt.
+    """
+    with poll_lock:
         try:
-            result = process_lead(lead)
-            if "error" not in result:
-                leads_sheet.update_cell(lead["row"], 16, "VERTEILT")
-                processed += 1
-            else:
-                leads_sheet.update_cell(lead["row"], 16, "FEHLER")
+            sheet = get_leads_sheet()
+            statuses = sheet.col_values(LEADS_COL_STATUS)
         except Exception as e:
-            logger.error(f"Fehler bei Lead {lead['name']}: {e}")
-            try:
-                leads_sheet.update_cell(lead["row"], 16, "FEHLER")
-            except:
-                pass
-        
-        time.sleep(2)
-
-    return {"processed": processed, "total": len(new_leads)}
+            check_google_error(e)
+            logger.error(f"Startup-Sweep fehlgeschlagen: {e}")
+            return 0
+
+        active = job_queue.active_rows()
+        stuck = {row: "CREATED" for row, status in enumerate(statuses, 1)
+                 if status == "PROCESSING" and row not in active
+                 and not lead_claims.is_held(claim_key(row))}
+        written = write_lead_statuses(sheet, stuck)
+        if written:
+            high_water = _poll_state["high_water"]
+            if high_water is None:
+                high_water = load_poll_state()
+            _poll_state["high_water"] = min(high_water, min(written) - 1)
+            save_poll_state(_poll_state["high_water"])
+            logger.warning(f"♻️ {len(written)} hängende PROCESSING-Zeilen zurück auf CREATED")
+        return len(written)
 
 
 def polling_loop():
-    logger.info(f"📡 Polling gestartet ({POLL_INTERVAL}s)")
+    logger.info(f"📡 Polling gestartet ({poll_scheduler.interval}s, "
+                f"{POLL_MIN_INTERVAL}–{POLL_MAX_INTERVAL}s adaptiv)")
+    recover_stuck_rows()
     while True:
+        start = time.perf_counter()
+        rate_limited = False
         try:
-            poll_new_leads()
+            result = poll_new_leads()
+            rate_limited = result.get("rate_limited", False)
         except Exception as e:
+            check_google_error(e)
+            rate_limited = is_rate_limited(e)
             logger.error(f"Polling-Fehler: {e}")
-        time.sleep(POLL_INTERVAL)
+            result = {"error": str(e)}
+        poll_scheduler.record(result, time.perf_counter() - start, rate_limited)
+        poll_scheduler.wait()
+
+
+# ─── Facebook Lead Ads ───────────────────────
+def extract_leadgen_ids(payload):
+    ids = []
+    for entry in payload.get("entry") or []:
+        for change in entry.get("changes") or []:
+            if change.get("field", "leadgen") != "leadgen":
+                continue
+            leadgen_id = (change.get("value") or {}).get("leadgen_id")
+            if leadgen_id:
+                ids.append(str(leadgen_id))
+    return ids
+
+
+def map_leadgen(leadgen_id, data):
+    """Graph-Lead (field_data) → dasselbe Lead-Dict wie aus dem Sheet."""
+    fields = {}
+    for field in data.get("field_data") or []:
+        values = field.get("values") or []
+        if values:
+            fields[str(field.get("name", "")).lower()] = str(values[0]).strip()
+
+    name = fields.get("full_name") or " ".join(
+        v for v in (fields.get("first_name"), fields.get("last_name")) if v)
+    return {
+        "name": name or "Unbekannt",
+        "email": fields.get("email", ""),
+        "phone": normalize_phone(fields.get("phone_number") or fields.get("phone", "")),
+        "leadgen_id": leadgen_id,
+        "source": "webhook",
+    }
+
+
+def fetch_leadgen_leads(leadgen_ids):
+    """Holt bis zu FB_BATCH_MAX Leads mit EINEM Graph-Request (?ids=a,b,c)."""
+    try:
+        res = get_meta_session().get(
+            f"{META_API_BASE}/",
+            params={"ids": ",".join(leadgen_ids), "fields": "field_data,created_time"},
+            headers={"Authorization": f"Bearer {FB_ACCESS_TOKEN}"},
+            timeout=(META_CONNECT_TIMEOUT, META_READ_TIMEOUT),
+        )
+    except requests.RequestException as e:
+        api_errors_total.inc(api="meta", endpoint="leads", reason=type(e).__name__)
+        raise
+    if res.status_code >= 400:
+        raise RuntimeError(f"Graph API {res.status_code}: {res.text}")
+    data = res.json()
+    return [map_leadgen(leadgen_id, data[leadgen_id]) for leadgen_id in leadgen_ids if leadgen_id in data]
+
+
+class LeadgenBatcher:
+    """
+    Sammelt leadgen_ids aus einer Zustellung bzw. einem kurzen Zeitfenster
+    (FB_BATCH_WINDOW) und holt sie gebündelt. Läuft im Event-Loop.
+    """
+
+    def __init__(self):
+        self.pending = []
+        self.received_at = {}
+        self.handle = None
+
+    def add(self, leadgen_ids):
+        now = time.time()
+        for leadgen_id in leadgen_ids:
+            self.received_at[leadgen_id] = now
+        self.pending.extend(leadgen_ids)
+        if len(self.pending) >= FB_BATCH_MAX:
+            self.flush()
+        elif self.handle is None:
+            self.handle = asyncio.get_running_loop().call_later(FB_BATCH_WINDOW, self.flush)
+
+    def flush(self):
+        if self.handle is not None:
+            self.handle.cancel()
+            self.handle = None
+        ids, self.pending = self.pending, []
+        for i in range(0, len(ids), FB_BATCH_MAX):
+            asyncio.get_running_loop().create_task(self._fetch(ids[i:i + FB_BATCH_MAX]))
+
+    async def _fetch(self, leadgen_ids):
+        now = time.time()
+        received_at = {i: self.received_at.pop(i, now) for i in leadgen_ids}
+        try:
+            leads = await asyncio.to_thread(fetch_leadgen_leads, leadgen_ids)
+        except Exception as e:
+            # Wieder freigeben – der Poller findet die Leads dann im Sheet
+            await asyncio.to_thread(settle_leadgen, leadgen_ids)
+            logger.error(f"Leadgen-Abruf fehlgeschlagen ({len(leadgen_ids)} IDs): {e}")
+            return
+        logger.info(f"📥 {len(leads)} Leads per Webhook abgerufen")
+        missing = set(leadgen_ids) - {lead["leadgen_id"] for lead in leads}
+        if missing:
+            logger.warning(f"⚠️ {len(missing)} leadgen_ids fehlen in der Graph-Antwort – Poller übernimmt")
+            await asyncio.to_thread(settle_leadgen, sorted(missing))
+        for lead in leads:
+            lead["received_at"] = received_at[lead["leadgen_id"]]
+            if not await enqueue_job("lead", lead):
+                await asyncio.to_thread(settle_leadgen, [lead["leadgen_id"]])
+
+
+leadgen_batcher = LeadgenBatcher()
+
+
+def claim_leadgen_ids(leadgen_ids):
+    return [i for i in leadgen_ids if processed_events.claim(f"leadgen:{i}")]
+
+
+def settle_leadgen(leadgen_ids, status=None):
+    """
+    Ausgang des Webhook-Wegs festhalten. Erst ein Abschluss lässt den Poller
+    die Sheet-Zeile markieren: VERTEILT ("leadgen-delivered:…") oder FEHLER
+    ("leadgen-failed:…", z. B. kein Partner – ohne zweiten Alarm). Ohne
+    Status wird der Claim freigegeben und der Poller verteilt den Lead selbst
+    aus dem Sheet. Danach den Poller wecken.
+    """
+    if status == "VERTEILT":
+        processed_events.mark(*[f"leadgen-delivered:{i}" for i in leadgen_ids])
+    elif status == "FEHLER":
+        processed_events.mark(*[f"leadgen-failed:{i}" for i in leadgen_ids])
+    else:
+        processed_events.release(*[f"leadgen:{i}" for i in leadgen_ids])
+    poll_scheduler.trigger()
+
+
+def webhook_outcome(leadgen_id):
+    """VERTEILT/FEHLER, wenn der Webhook-Weg den Lead abgeschlossen hat, sonst None."""
+    if processed_events.claimed_at(f"leadgen-delivered:{leadgen_id}") is not None:
+        return "VERTEILT"
+    if processed_events.claimed_at(f"leadgen-failed:{leadgen_id}") is not None:
+        return "FEHLER"
+    return None
+
+
+def sheet_leadgen_state(leadgen_id):
+    """
+    Wie der Poller eine CREATED-Zeile mit leadgen_id behandelt:
+      new       – jetzt vom Poller beansprucht, er verteilt selbst
+      delivered – per Webhook zugestellt, nur die Zeile markieren
+      failed    – per Webhook abgeschlossen ohne Zustellung (kein Partner)
+      pending   – der Webhook-Weg arbeitet noch (Claim jünger als CLAIM_TTL)
+      stale     – Claim ohne Zustellung, älter als CLAIM_TTL (Absturz o. Ä.)
+                  → der Poller übernimmt
+    """
+    if processed_events.claim(f"leadgen:{leadgen_id}"):
+        return "new"
+    outcome = webhook_outcome(leadgen_id)
+    if outcome:
+        return "delivered" if outcome == "VERTEILT" else "failed"
+    claimed_at = processed_events.claimed_at(f"leadgen:{leadgen_id}")
+    if claimed_at is not None and time.time() - claimed_at < CLAIM_TTL:
+        return "pending"
+    return "stale"
+
+
+async def handle_leadgen_payload(payload):
+    """Neue leadgen_ids aus einer Webhook-Zustellung zum Abruf vormerken."""
+    if not FB_ACCESS_TOKEN:
+        if extract_leadgen_ids(payload):
+            logger.error("FB_ACCESS_TOKEN nicht gesetzt – Leads kommen über das Sheet")
+        return []
+    new_ids = await asyncio.to_thread(claim_leadgen_ids, extract_leadgen_ids(payload))
+    if new_ids:
+        leadgen_batcher.add(new_ids)
+    return new_ids
+
+
+# ─── Async Pipeline (Webhooks) ───────────────
+# Webhooks legen nur einen Job in der Job-Queue ab und antworten sofort.
+# N Consumer-Tasks holen sich fällige Jobs aus der State-DB; sind schon
+# LEAD_QUEUE_SIZE Webhook-Jobs offen, antwortet der Webhook mit 503 und
+# Facebook/Stripe stellen später erneut zu.
+job_wakeup = None
+pipeline_tasks = []
+pipeline_stats = {"enqueued": 0, "done": 0, "failed": 0, "dead": 0, "rejected": 0, "reclaimed": 0}
+
+
+async def enqueue_job(kind, payload):
+    job_id = await asyncio.to_thread(job_queue.put, kind, payload, LEAD_QUEUE_SIZE)
+    if job_id is None:
+        pipeline_stats["rejected"] += 1
+        logger.warning(f"⚠️ Queue voll ({LEAD_QUEUE_SIZE}) – {kind} abgelehnt")
+        return False
+    pipeline_stats["enqueued"] += 1
+    if job_wakeup is not None:
+        job_wakeup.set()
+    return True
+
+
+def resume_sheet_lead(job):
+    """Lead aus einem abgebrochenen Poll-Durchlauf zu Ende bringen."""
+    lead = job["payload"]
+    status = job["result"]
+    leadgen_id = lead.get("leadgen_id")
+    if not status and leadgen_id:
+        status = webhook_outcome(leadgen_id)  # inzwischen per Webhook abgeschlossen
+        if status:
+            job_queue.set_result(job["id"], status)
+        if status == "FEHLER":
+            processed_events.release(f"leadgen:{leadgen_id}", f"leadgen-failed:{leadgen_id}")
+    if not status:
+        try:
+            result = process_lead(lead)
+            status = "FEHLER" if "error" in result else "VERTEILT"
+        except Exception as e:
+            logger.error(f"Fehler bei Lead {lead['name']}: {e}")
+            status = "FEHLER"
+        if status == "FEHLER" and leadgen_id:
+            processed_events.release(f"leadgen:{leadgen_id}")
+        job_queue.set_result(job["id"], status)
+
+    if lead["row"] not in write_lead_statuses(get_leads_sheet(), {lead["row"]: status}):
+        raise RuntimeError(f"Status für Zeile {lead['row']} nicht geschrieben")
+    logger.info(f"♻️ Zeile {lead['row']} nachträglich abgeschlossen: {status}")
+
+
+async def run_job(job):
+    kind, payload = job["kind"], job["payload"]
+    if kind == "lead":
+        result = await process_lead_async(payload)
+        if result.get("retry"):
+            # Vorübergehend (z. B. Sheet nicht erreichbar) → Backoff über job_queue.fail()
+            raise RuntimeError(result["error"])
+        if payload.get("leadgen_id"):
+            # Fertig ist fertig – auch "Kein Partner" (Alarm und Log sind raus)
+            await asyncio.to_thread(settle_leadgen, [payload["leadgen_id"]],
+                                    "FEHLER" if "error" in result else "VERTEILT")
+    elif kind == "stripe":
+        await asyncio.to_thread(process_stripe_payment, **payload)
+    elif kind == "sheet_lead":
+        await asyncio.to_thread(resume_sheet_lead, job)
+    else:
+        raise ValueError(f"Unbekannter Job-Typ: {kind}")
+
+
+async def pipeline_worker(worker_id):
+    while True:
+        job_wakeup.clear()
+        job = await asyncio.to_thread(job_queue.claim, CLAIM_TTL)
+        if job is None:
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(job_wakeup.wait(), JOB_IDLE_WAIT)
+            continue
+
+        try:
+            await run_job(job)
+        except Exception as e:
+            pipeline_stats["failed"] += 1
+            if await asyncio.to_thread(job_queue.fail, job, str(e)):
+                logger.error(f"Pipeline-Worker {worker_id}: {job['kind']} #{job['id']} "
+                             f"fehlgeschlagen (Versuch {job['attempts']}): {e}")
+            else:
+                pipeline_stats["dead"] += 1
+                logger.error(f"☠️ {job['kind']} #{job['id']} nach {job['attempts']} Versuchen "
+                             f"in dead_jobs: {e}")
+                if job["kind"] == "lead" and job["payload"].get("leadgen_id"):
+                    await asyncio.to_thread(settle_leadgen, [job["payload"]["leadgen_id"]])
+            continue
+        await asyncio.to_thread(job_queue.complete, job["id"])
+        pipeline_stats["done"] += 1
+
+
+async def job_sweeper():
+    """Jobs abgestürzter Instanzen bzw. mit abgelaufenem Claim wieder freigeben."""
+    reclaim_foreign = not lead_claims.shared
+    while True:
+        reclaimed = await asyncio.to_thread(job_queue.sweep, reclaim_foreign)
+        if reclaimed:
+            pipeline_stats["reclaimed"] += reclaimed
+            logger.warning(f"♻️ {reclaimed} unterbrochene Jobs wieder eingeplant")
+            job_wakeup.set()
+        reclaim_foreign = False
+        await asyncio.sleep(JOB_SWEEP_SECONDS)
+
+
+def queue_full_response():
+    return JSONResponse({"status": "busy", "queue_depth": job_queue.depth(WEBHOOK_JOB_KINDS)},
+                        status_code=503, headers={"Retry-After": "30"})
+
+
+# ─── Health / Readiness ──────────────────────
+# /health = Prozess lebt (Render-Healthcheck), /ready = Abhängigkeiten laut
+# zuletzt gesehenen Ergebnissen ok. Beide fragen nie selbst Google/Meta an.
+READY_SHEETS_MAX_AGE = int(os.getenv("READY_SHEETS_MAX_AGE", "900"))
+READY_POLL_GRACE = 60
+STARTED_AT = time.time()
+poller_thread = None
+
+
+def _age(timestamp, now):
+    return round(now - timestamp, 1) if timestamp else None
+
+
+def readiness():
+    now = time.time()
+    google = dependency_health["google"]
+    meta = dependency_health["meta"]
+    sheets_age = _age(google["last_ok_at"], now)
+    heartbeat_age = _age(poll_scheduler.last_poll_at, now)
+
+    checks = {
+        "sheets": sheets_age is not None and sheets_age <= READY_SHEETS_MAX_AGE,
+        "poller": (poller_thread is not None and poller_thread.is_alive()
+                   and heartbeat_age is not None
+                   and heartbeat_age <= poll_scheduler.interval + READY_POLL_GRACE),
+        "pipeline": bool(pipeline_tasks) and not any(task.done() for task in pipeline_tasks),
+    }
+    return all(checks.values()), {
+        "checks": checks,
+        "sheets": {
+            "last_ok_age_s": sheets_age,
+            "last_error_age_s": _age(google["last_error_at"], now),
+            "last_error": google["last_error"],
+        },
+        "poller": {"heartbeat_age_s": heartbeat_age, "interval_s": poll_scheduler.interval},
+        "meta": {
+            "last_ok_age_s": _age(meta["last_ok_at"], now),
+            "last_error_age_s": _age(meta["last_error_at"], now),
+            "last_error": meta["last_error"],
+        },
+        "sdks": {"gspread": gspread.loaded, "stripe": stripe.loaded},
+        "uptime_s": round(now - STARTED_AT, 1),
+    }
 
 
 # ─── API Endpoints ───────────────────────────
 @app.on_event("startup")
-def startup():
+async def startup():
+    global job_wakeup, poller_thread
     logger.info("🚀 Lead-Verteilung v4.3 FINAL + STRIPE-FIX gestartet")
-    threading.Thread(target=polling_loop, daemon=True).start()
+    job_wakeup = asyncio.Event()
+    pipeline_tasks.append(asyncio.create_task(job_sweeper()))
+    for i in range(LEAD_WORKERS):
+        pipeline_tasks.append(asyncio.create_task(pipeline_worker(i)))
+    poller_thread = threading.Thread(target=polling_loop, daemon=True)
+    poller_thread.start()
+    # gspread lädt der Poller; Stripe im Hintergrund, damit der erste
+    # Webhook nicht auf den Import wartet
+    threading.Thread(target=stripe.load, daemon=True).start()
+
+
+@app.on_event("shutdown")
+def shutdown():
+    flushed = lead_log.flush()
+    digest = admin_notifier.flush()
+    if digest is not None:
+        with contextlib.suppress(Exception):
+            digest.result(timeout=10)
+    logger.info(f"👋 Shutdown – {flushed} Log-Zeilen geschrieben")
 
 
 @app.get("/")
@@ -532,6 +3648,19 @@ def root():
     return {"status": "ok", "version": "4.3-FINAL-STRIPE-FIX", "admin": MATZE_PHONE}
 
 
+# async, damit Health-Checks nicht hinter belegten Threadpool-Slots warten
+@app.get("/health")
+async def health():
+    return {"status": "ok", "uptime_s": round(time.time() - STARTED_AT, 1)}
+
+
+@app.get("/ready")
+async def ready():
+    ok, detail = readiness()
+    return JSONResponse({"status": "ready" if ok else "not_ready", **detail},
+                        status_code=200 if ok else 503)
+
+
 @app.get("/webhook/facebook")
 def fb_verify(request: Request):
     params = dict(request.query_params)
@@ -541,21 +3670,22 @@ def fb_verify(request: Request):
 
 
 @app.post("/webhook/facebook")
-async def fb_webhook(request: Request, background_tasks: BackgroundTasks):
+async def fb_webhook(request: Request):
     try:
         payload = await request.json()
     except:
         return {"error": "Invalid JSON"}
     
-    # Lead-Daten extrahieren (vereinfacht - du musst deine Logik hier einfügen)
-    lead_data = {"name": "Test", "phone": "491234567890", "email": "test@test.de"}
-    
-    background_tasks.add_task(process_lead, lead_data)
-    return {"status": "received"}
+    new_ids = await handle_leadgen_payload(payload)
+    if not FB_ACCESS_TOKEN:
+        # Ohne Graph-Abruf kommt der Lead nur über das Sheet → Poller sofort wecken.
+        # Mit Abruf weckt ihn settle_leadgen(), sobald der Webhook-Weg fertig ist.
+        poll_scheduler.trigger()
+    return {"status": "received", "leads": len(new_ids)}
 
 
 @app.post("/stripe-webhook")
-async def stripe_webhook(request: Request, background_tasks: BackgroundTasks):
+async def stripe_webhook(request: Request):
     payload = await request.body()
     sig = request.headers.get("stripe-signature", "")
 
@@ -570,6 +3700,17 @@ async def stripe_webhook(request: Request, background_tasks: BackgroundTasks):
 
     if event.get("type") == "checkout.session.completed":
         data = event["data"]["object"]
+        # Stripe stellt bei langsamer Antwort erneut zu → nur einmal gutschreiben
+        # Ohne ID kein Schlüssel – sonst teilten sich alle solchen Events "stripe-event:None"
+        event_keys = []
+        if event.get("id"):
+            event_keys.append(f"stripe-event:{event['id']}")
+        if data.get("id"):
+            event_keys.append(f"stripe-session:{data['id']}")
+        if event_keys and not await asyncio.to_thread(processed_events.claim, *event_keys):
+            logger.info(f"Stripe-Event {event.get('id') or data.get('id')} bereits verarbeitet – verworfen")
+            return {"status": "duplicate"}
+
         amount = data.get("amount_total", 0) / 100
         cd = data.get("customer_details", {})
         
@@ -580,19 +3721,285 @@ async def stripe_webhook(request: Request, background_tasks: BackgroundTasks):
         if not customer_name:
             customer_name = customer_email.split("@")[0] if customer_email else "Unbekannt"
 
-        background_tasks.add_task(process_stripe_payment, 
-                                  customer_name, customer_phone, customer_email, amount)
+        if not await enqueue_job("stripe", {"customer_name": customer_name,
+                                      "customer_phone": customer_phone,
+                                      "customer_email": customer_email,
+                                      "amount": amount,
+                                      "session_id": data.get("id")}):
+            await asyncio.to_thread(processed_events.release, *event_keys)
+            return queue_full_response()
         return {"status": "received"}
 
     return {"status": "ignored"}
 
 
 @app.get("/poll")
-def manual_poll():
-    result = poll_new_leads()
+def manual_poll(full: bool = False):
+    result = poll_new_leads(full_scan=full)
     return {"status": "ok", "result": result}
 
 
+@app.get("/stats")
+def stats():
+    return {
+        "google_api": google_api_stats,
+        "meta_api": {
+            "requests": meta_api_stats["requests"],
+            "errors": meta_api_stats["errors"],
+            "latency_ms": latency_summary(meta_api_stats["latency_ms"]),
+        },
+        "leads_log_pending": lead_log.pending(),
+        "poller": poll_scheduler.status(),
+        "processed_events": processed_events.stats,
+        "partner_snapshot": partner_snapshot.status(),
+        "leads_export": leads_log_mirror.stats,
+        "admin_digest": {**admin_notifier.stats, "pending": admin_notifier.pending(),
+                         "window_s": ADMIN_DIGEST_SECONDS},
+        "pipeline": {
+            **job_queue.counts(),
+            "queue_max": LEAD_QUEUE_SIZE,
+            "workers": LEAD_WORKERS,
+            **pipeline_stats,
+        },
+    }
+
+
+Gauge("job_queue_jobs", "Jobs in der Job-Queue je Zustand",
+      lambda: {(state,): n for state, n in job_queue.counts().items()}, ("state",))
+Gauge("whatsapp_queue_pending", "WhatsApp-Nachrichten in der Versand-Queue",
+      lambda: wa_dispatcher.pending())
+Gauge("leads_log_pending", "Gepufferte Leads_Log-Zeilen", lambda: lead_log.pending())
+Gauge("admin_digest_pending", "Admin-Meldungen im nächsten Digest", lambda: admin_notifier.pending())
+Gauge("poll_lag_seconds", "Sekunden seit dem letzten Poll",
+      lambda: round(time.time() - poll_scheduler.last_poll_at, 3) if poll_scheduler.last_poll_at else None)
+Gauge("poll_interval_seconds", "Aktuelles Poll-Intervall", lambda: poll_scheduler.interval)
+
+
+@app.get("/metrics")
+def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+# Partner-Lese-API: nur aus partner_snapshot, kein Google-Request pro Aufruf
+def _check_bearer(request, token, name):
+    # Ohne Token ist der Endpunkt gesperrt, nicht offen
+    if not token:
+        raise HTTPException(403, f"{name} nicht gesetzt")
+    if not secrets.compare_digest(request.headers.get("authorization", ""), f"Bearer {token}"):
+        raise HTTPException(401)
+
+
+def check_admin_token(request):
+    # Partnerliste, Guthaben-Korrekturen und Lead-Daten: nur mit dem Admin-Token
+    _check_bearer(request, ADMIN_API_TOKEN, "ADMIN_API_TOKEN")
+
+
+def partner_api_token(phone):
+    """Token für genau einen Partner: HMAC(PARTNER_TOKEN_SECRET, Telefonnummer)."""
+    return hmac.new(PARTNER_TOKEN_SECRET.encode(), normalize_phone(phone).encode(), hashlib.sha256).hexdigest()
+
+
+def check_partner_token(request, phone):
+    # Der Admin darf jeden Partner abfragen, ein Partner nur sich selbst
+    auth = request.headers.get("authorization", "")
+    if ADMIN_API_TOKEN and secrets.compare_digest(auth, f"Bearer {ADMIN_API_TOKEN}"):
+        return
+    if not PARTNER_TOKEN_SECRET:
+        raise HTTPException(403, "PARTNER_TOKEN_SECRET nicht gesetzt")
+    if not secrets.compare_digest(auth, f"Bearer {partner_api_token(phone)}"):
+        raise HTTPException(401)
+
+
+async def current_partner_snapshot():
+    if partner_snapshot.loaded_at is None:
+        # Allererster Zugriff: einmal blockierend laden
+        try:
+            await asyncio.to_thread(partner_snapshot.refresh)
+        except Exception as e:
+            raise HTTPException(503, f"Partnerdaten nicht verfügbar: {e}")
+    else:
+        partner_snapshot.revalidate()
+    return partner_snapshot
+
+
+def etag_matches(request, etag):
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return "*" in tags or etag.removeprefix("W/") in tags
+
+
+def cached_json(request, etag, build):
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(build(), headers=headers)
+
+
+@app.get("/partner/{phone}/balance")
+async def partner_balance(phone: str, request: Request):
+    check_partner_token(request, phone)
+    snapshot = await current_partner_snapshot()
+    partner, etag = snapshot.by_phone_number(normalize_phone(phone))
+    if partner is None:
+        raise HTTPException(404, "Partner nicht gefunden")
+    return cached_json(request, etag, lambda: {
+        "name": partner["name"],
+        "guthaben": partner["guthaben"],
+        "status": partner["status"],
+        "leads_geliefert": partner["leads_geliefert"],
+        "letzter_lead": partner["letzter_lead"],
+        "leads_verfuegbar": int(partner["guthaben"] // LEAD_PREIS) if partner["status"] == "Aktiv" else 0,
+    })
+
+
+@app.get("/partners")
+async def list_partners(request: Request, offset: int = Query(0, ge=0), limit: int = Query(100, ge=1, le=500),
+                        status: Optional[str] = None):
+    check_admin_token(request)  # alle Partner mit Telefon und Guthaben
+    snapshot = await current_partner_snapshot()
+
+    def build():
+        total, partners = snapshot.page(offset, limit, status)
+        return {
+            "total": total,
+            "offset": offset,
+            "limit": limit,
+            "next_offset": offset + limit if offset + limit < total else None,
+            "partners": partners,
+        }
+    return cached_json(request, snapshot.list_etag(status or "", offset, limit), build)
+
+
+@app.get("/leads/export")
+async def leads_export(request: Request, fmt: str = Query("csv", alias="format", pattern="^(csv|ndjson)$"),
+                       date_from: Optional[str] = Query(None, alias="from"),
+                       date_to: Optional[str] = Query(None, alias="to"),
+                       partner: Optional[str] = None, status: Optional[str] = None, refresh: bool = False):
+    check_admin_token(request)  # Namen und Telefonnummern aller Leads
+    try:
+        days = [datetime.strptime(d, "%Y-%m-%d").strftime("%Y-%m-%d") if d else None
+                for d in (date_from, date_to)]
+    except ValueError:
+        raise HTTPException(400, "from/to: Datum im Format JJJJ-MM-TT")
+
+    # Gepufferte Log-Zeilen zuerst ins Sheet, dann nur neue Zeilen nachlesen
+    await asyncio.to_thread(lead_log.flush)
+    try:
+        await asyncio.to_thread(lambda: leads_log_mirror.sync(get_leads_log_sheet(), refresh))
+    except Exception as e:
+        check_google_error(e)
+        logger.error(f"Leads_Log-Export: {e}")
+        raise HTTPException(503, f"Leads_Log nicht lesbar: {e}")
+
+    filename = f"leads_{days[0] or 'anfang'}_{days[1] or 'heute'}.{fmt}"
+    return StreamingResponse(
+        export_leads_log(fmt, days[0], days[1], partner, status),
+        media_type="text/csv; charset=utf-8" if fmt == "csv" else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+
+def parse_timestamp(value):
+    """Unix-Zeit oder ISO-Datum (2026-01-31, ohne Zone = UTC) → Unix-Zeit."""
+    if value is None or value == "":
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def start_reconcile(since_ts, until_ts, apply):
+    """
+    Abgleich in einem eigenen Thread – die Stripe-Paginierung dauert bei
+    vielen Sessions Minuten. None, wenn schon ein Abgleich läuft.
+    """
+    if not reconcile_lock.acquire(blocking=False):
+        return None
+    run = {"id": uuid.uuid4().hex[:12], "status": "running", "apply": apply,
+           "started_at": time.time(), "finished_at": None, "report": None, "error": None}
+    reconcile_runs[run["id"]] = run
+    while len(reconcile_runs) > RECONCILE_RUNS_KEPT:
+        reconcile_runs.popitem(last=False)
+
+    def work():
+        try:
+            run["report"] = reconcile_stripe(since_ts, until_ts, apply)
+            run["status"] = "done"
+        except Exception as e:
+            logger.error(f"Stripe-Abgleich abgebrochen: {e}")
+            run["status"], run["error"] = "failed", str(e)
+        finally:
+            run["finished_at"] = time.time()
+            reconcile_lock.release()
+
+    threading.Thread(target=work, name="reconcile", daemon=True).start()
+    return run
+
+
+def run_reconcile(request, since, until, apply):
+    check_admin_token(request)
+    try:
+        since_ts, until_ts = parse_timestamp(since), parse_timestamp(until)
+    except ValueError:
+        raise HTTPException(400, "since/until: Unix-Zeit oder ISO-Datum")
+    run = start_reconcile(since_ts, until_ts, apply)
+    if run is None:
+        raise HTTPException(409, "Abgleich läuft bereits")
+    return JSONResponse({**run, "status_url": f"/reconcile/stripe/{run['id']}"}, status_code=202)
+
+
+@app.get("/reconcile/stripe")
+def reconcile_report(request: Request, since: Optional[str] = None, until: Optional[str] = None):
+    return run_reconcile(request, since, until, apply=False)
+
+
+@app.post("/reconcile/stripe")
+def reconcile_apply(request: Request, since: Optional[str] = None, until: Optional[str] = None):
+    return run_reconcile(request, since, until, apply=True)
+
+
+@app.get("/reconcile/stripe/{run_id}")
+def reconcile_status(run_id: str, request: Request):
+    check_admin_token(request)
+    run = reconcile_runs.get(run_id)
+    if run is None:
+        raise HTTPException(404, "Abgleich nicht gefunden")
+    return run
+
+
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=int(os.getenv("PORT", 8000)))
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Lead-Verteilungs-Service")
+    sub = parser.add_subparsers(dest="command")
+    p = sub.add_parser("reconcile", help="Stripe-Zahlungen gegen gebuchte Gutschriften abgleichen")
+    p.add_argument("--apply", action="store_true", help="fehlende/doppelte Gutschriften korrigieren")
+    p.add_argument("--since", help="Unix-Zeit oder ISO-Datum (Standard: Beginn der Erfassung)")
+    p.add_argument("--until", help=f"Standard: jetzt minus {RECONCILE_GRACE_SECONDS}s")
+    p = sub.add_parser("partner-token", help="Token eines Partners für /partner/…/balance ausgeben")
+    p.add_argument("phone")
+    args = parser.parse_args()
+
+    if args.command == "reconcile":
+        report = reconcile_stripe(parse_timestamp(args.since), parse_timestamp(args.until), args.apply)
+        ledger = get_partner_ledger()
+        if ledger:
+            LedgerSyncer(ledger).sync()
+        digest = admin_notifier.flush()
+        if digest is not None:
+            with contextlib.suppress(Exception):
+                digest.result(timeout=10)
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+    elif args.command == "partner-token":
+        if not PARTNER_TOKEN_SECRET:
+            parser.error("PARTNER_TOKEN_SECRET ist nicht gesetzt")
+        print(partner_api_token(args.phone))
+    else:
+        import uvicorn
+        uvicorn.run(app, host="0.0.0.0", port=int(os.getenv("PORT", 8000)))
@@ -0,0 +1,1556 @@
+"""
+Offline-Benchmarks für den Lead-Verteilungs-Service
+====================================================
+Läuft komplett ohne Google/Meta – alle Sheets sind In-Memory-Fakes, die
+Graph-API ist ein lokaler HTTP-Server.
+
+  python bench.py partners --n 10000
+  python bench.py partner-writes
+  python bench.py poll --rows 100000
+  python bench.py whatsapp --messages 200
+  python bench.py ledger --leads 300
+  python bench.py leadgen --leads 200
+  python bench.py jobs --jobs 5000
+  python bench.py leases --processes 4 --rows 2000
+  python bench.py allocation --leads 500
+  python bench.py startup --runs 5
+  python bench.py export --rows 100000
+  python bench.py reconcile --sessions 20000
+  python bench.py partner-api --requests 5000
+
+Last-Szenarien mit FakeSpreadsheet/FakeGraphAPI (Latenz, Quota, 429-Injektion):
+
+  python bench.py burst --leads 1000 --partners 10000 --error-rate 0.02
+  python bench.py poll-burst --leads 1000
+  python bench.py webhooks --leads 1000
+  python bench.py suite --save bench_baseline.json
+  python bench.py suite --compare bench_baseline.json --tolerance 0.2
+"""
+
+import argparse
+import itertools
+import json
+import logging
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import requests
+
+import app
+
+
+# ─── Fakes ───────────────────────────────────
+def api_error(code, message):
+    """gspread.APIError wie bei einem echten Sheets-Fehler (z. B. 429)."""
+    response = requests.Response()
+    response.status_code = code
+    response._content = json.dumps({"error": {"code": code, "message": message,
+                                              "status": "RESOURCE_EXHAUSTED"}}).encode()
+    return app.gspread.exceptions.APIError(response)
+
+
+class RequestGate:
+    """Latenz, Quota (Requests pro Fenster) und zufällige 429 für einen Fake-Backend."""
+
+    def __init__(self, latency=0.0, quota=None, window=60.0, error_rate=0.0, seed=1):
+        self.latency = latency
+        self.quota = quota
+        self.window = window
+        self.error_rate = error_rate
+        self.rnd = random.Random(seed)
+        self.recent = deque()
+        self.requests = 0
+        self.rate_limited = 0
+        self.by_method = Counter()
+        self.lock = threading.Lock()
+
+    def enter(self, method):
+        """Zählt den Request, wartet die Latenz ab; True = mit 429 antworten."""
+        with self.lock:
+            self.requests += 1
+            self.by_method[method] += 1
+            now = time.monotonic()
+            limited = False
+            if self.quota:
+                while self.recent and now - self.recent[0] > self.window:
+                    self.recent.popleft()
+                if len(self.recent) >= self.quota:
+                    limited = True
+                else:
+                    self.recent.append(now)
+            if not limited and self.error_rate and self.rnd.random() < self.error_rate:
+                limited = True
+            if limited:
+                self.rate_limited += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return limited
+
+
+class FakeSpreadsheet:
+    """gspread.Spreadsheet-Ersatz; alle Worksheets teilen sich ein RequestGate."""
+
+    def __init__(self, latency=0.0, quota_per_min=None, error_rate=0.0):
+        self.gate = RequestGate(latency, quota_per_min, 60.0, error_rate)
+        self.sheets = {}
+
+    def request(self, method):
+        app.google_api_stats["calls"] += 1
+        limited = self.gate.enter(method)
+        app.api_requests_total.inc(api="google", endpoint=method, code=429 if limited else 200)
+        app.record_dependency("google", not limited, f"HTTP 429 ({method})")
+        if limited:
+            app.api_errors_total.inc(api="google", endpoint=method, reason="rate_limited")
+            raise api_error(429, "Quota exceeded for quota metric 'Read requests'")
+
+    def add(self, title, worksheet):
+        worksheet.spreadsheet = self
+        self.sheets[title] = worksheet
+        return worksheet
+
+    def worksheet(self, title):
+        self.request("spreadsheets.get")
+        if title not in self.sheets:
+            raise app.gspread.exceptions.WorksheetNotFound(title)
+        return self.sheets[title]
+
+    def add_worksheet(self, title, rows, cols):
+        self.request("spreadsheets:batchUpdate")
+        return self.add(title, FakeWorksheet([]))
+
+    def install(self):
+        """Ersetzt den Google-Client von app.py durch diesen Fake."""
+        fake = self
+
+        class FakeClient:
+            def open_by_key(self, key):
+                fake.request("spreadsheets.get")
+                return fake
+
+        app.get_google_client = FakeClient
+        with app._sheets_lock:
+            app._sheets_cache.update(client=None, spreadsheet=None, worksheets={}, created=0.0)
+        app.partner_index = app.PartnerIndex(ttl=app.PARTNER_INDEX_TTL)
+
+
+class FakeWorksheet:
+    """Minimaler gspread.Worksheet-Ersatz, zählt alle API-Requests."""
+
+    def __init__(self, header, rows=None, latency=0.0):
+        self.header = list(header)
+        self.rows = [list(r) for r in (rows or [])]
+        self.latency = latency
+        self.spreadsheet = None
+        self.requests = 0
+        self.methods = Counter()
+        self.cells_read = 0
+        self.lock = threading.Lock()
+
+    def _request(self, method):
+        self.requests += 1
+        self.methods[method] += 1
+        if self.spreadsheet is not None:
+            self.spreadsheet.request(method)
+        elif self.latency:
+            time.sleep(self.latency)
+
+    def get_all_records(self):
+        self._request("values.get")
+        self.cells_read += len(self.header) * len(self.rows)
+        return [dict(zip(self.header, r)) for r in self.rows]
+
+    def get_all_values(self):
+        self._request("values.get")
+        self.cells_read += len(self.header) * (len(self.rows) + 1)
+        return [list(self.header)] + [list(r) for r in self.rows]
+
+    def get(self, range_name):
+        # Formen "A{n}:P" (Polling) und "A{n}:I{m}" (Export)
+        self._request("values.get")
+        start, end = range_name.split(":")
+        first_row, _ = app.gspread.utils.a1_to_rowcol(start)
+        if end[-1].isdigit():
+            last_row, last_col = app.gspread.utils.a1_to_rowcol(end)
+        else:
+            last_row, last_col = len(self.rows) + 1, app.gspread.utils.a1_to_rowcol(end + "1")[1]
+        values = [list(r[:last_col]) for r in self.rows[first_row - 2:last_row - 1]]
+        self.cells_read += sum(len(r) for r in values)
+        return values
+
+    def batch_get(self, ranges):
+        # Einzelne Zellen ("P5") oder Zeilenstücke ("A5:F5")
+        self._request("values:batchGet")
+        values = []
+        for range_name in ranges:
+            start, _, end = range_name.partition(":")
+            row, first = app.gspread.utils.a1_to_rowcol(start)
+            last = app.gspread.utils.a1_to_rowcol(end)[1] if end else first
+            r = self.rows[row - 2] if 0 <= row - 2 < len(self.rows) else []
+            cells = list(r[first - 1:last])
+            values.append([cells] if cells else [])
+            self.cells_read += len(cells)
+        return values
+
+    def col_values(self, col):
+        self._request("values.get")
+        self.cells_read += len(self.rows) + 1
+        return [self.header[col - 1]] + [r[col - 1] if len(r) >= col else "" for r in self.rows]
+
+    def update_cell(self, row, col, value):
+        self._request("values.put")
+        self._set(row, col, value)
+
+    def append_row(self, values, **kwargs):
+        self._request("values:append")
+        with self.lock:
+            self.rows.append(list(values))
+            row = len(self.rows) + 1
+        return {"updates": {"updatedRange": f"Sheet!A{row}:F{row}"}}
+
+    def append_rows(self, values, **kwargs):
+        self._request("values:append")
+        with self.lock:
+            self.rows.extend(list(v) for v in values)
+
+    def batch_update(self, data, **kwargs):
+        self._request("values:batchUpdate")
+        for item in data:
+            row, col = app.gspread.utils.a1_to_rowcol(item["range"])
+            self._set(row, col, item["values"][0][0])
+
+    def _set(self, row, col, value):
+        with self.lock:
+            while len(self.rows) < row - 1:
+                self.rows.append([])
+            r = self.rows[row - 2]
+            while len(r) < col:
+                r.append("")
+            r[col - 1] = value
+
+
+class FakeGraphAPI:
+    """
+    Lokaler Ersatz für graph.facebook.com: /{phone_id}/messages und der
+    Lead-Abruf per ?ids=. Latenz, Quota pro Sekunde und 429-Injektion
+    (mit Retry-After: 0) wie beim FakeSpreadsheet.
+    """
+
+    def __init__(self, latency=0.05, quota_per_sec=None, error_rate=0.0):
+        self.gate = RequestGate(latency, quota_per_sec, 1.0, error_rate)
+        self.sent = []
+        self.lead_requests = 0
+        self.lock = threading.Lock()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                if fake.gate.enter("messages"):
+                    return self._reply({"error": {"code": 130429, "message": "Rate limit hit"}}, 429)
+                with fake.lock:
+                    fake.sent.append((time.monotonic(), body.get("to")))
+                self._reply({"messages": [{"id": f"wamid.{len(fake.sent)}"}]})
+
+            def do_GET(self):
+                ids = parse_qs(urlparse(self.path).query).get("ids", [""])[0].split(",")
+                if fake.gate.enter("leads"):
+                    return self._reply({"error": {"code": 4, "message": "Rate limit hit"}}, 429)
+                with fake.lock:
+                    fake.lead_requests += 1
+                self._reply({i: {"id": i, "created_time": "2026-10-01T12:00:00+0000", "field_data": [
+                    {"name": "full_name", "values": [f"Lead {i}"]},
+                    {"name": "email", "values": [f"lead{i}@example.com"]},
+                    {"name": "phone_number", "values": [f"+49151{int(i) % 10 ** 8:08d}"]},
+                ]} for i in ids if i})
+
+            def _reply(self, payload, status=200):
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                if status == 429:
+                    self.send_header("Retry-After", "0")
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}/v22.0"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def install(self):
+        """Lässt Versand und Lead-Abruf von app.py gegen diesen Server laufen."""
+        app.META_TOKEN = app.META_TOKEN or "bench"
+        app.META_PHONE_ID = app.META_PHONE_ID or "1000"
+        app.META_API_BASE = self.base_url
+        app.META_URL = f"{self.base_url}/{app.META_PHONE_ID}/messages"
+        app.FB_ACCESS_TOKEN = "bench"
+
+    def close(self):
+        self.server.shutdown()
+
+
+class FakeStripeAPI:
+    """
+    Lokaler Ersatz für api.stripe.com: GET /v1/checkout/sessions mit limit,
+    starting_after und created[gte]/[lt], neueste zuerst wie bei Stripe.
+    """
+
+    def __init__(self, sessions):
+        self.sessions = sorted(sessions, key=lambda s: (-s["created"], s["id"]))
+        self.position = {s["id"]: i for i, s in enumerate(self.sessions)}
+        self.requests = 0
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                query = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+                limit = int(query.get("limit", 10))
+                start = fake.position[query["starting_after"]] + 1 if "starting_after" in query else 0
+                gte = int(query.get("created[gte]", 0))
+                lt = int(query.get("created[lt]", 2 ** 62))
+                page = []
+                for session in itertools.islice(fake.sessions, start, None):
+                    if len(page) > limit or session["created"] < gte:
+                        break
+                    if gte <= session["created"] < lt:
+                        page.append(session)
+                fake.requests += 1
+                data = json.dumps({"object": "list", "url": "/v1/checkout/sessions",
+                                   "data": page[:limit], "has_more": len(page) > limit}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def install(self):
+        module = app.stripe.load()
+        module.api_key = "sk_test_bench"
+        module.api_base = f"http://127.0.0.1:{self.server.server_port}"
+
+    def close(self):
+        self.server.shutdown()
+
+
+PARTNER_HEADER = ["Name", "Telefon", "Guthaben_Euro", "Leads_Geliefert",
+                  "Letzter_Lead_Am", "Status"]
+
+
+def make_partner_sheet(n, seed=1):
+    rnd = random.Random(seed)
+    rows = []
+    for i in range(n):
+        tag = rnd.randint(1, 28)
+        rows.append([
+            f"Partner {i:05d} {rnd.choice(['Müller', 'Schmidt', 'Meier', 'Wolf'])}",
+            f"49151{i:08d}",
+            rnd.choice([0, 5, 10, 25, 50]),
+            rnd.randint(0, 40),
+            f"2026-09-{tag:02d} 12:00:00" if rnd.random() > 0.1 else "",
+            rnd.choice(["Aktiv", "Aktiv", "Aktiv", "Pausiert"]),
+        ])
+    return FakeWorksheet(PARTNER_HEADER, rows)
+
+
+def _timed(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+# ─── Szenarien ───────────────────────────────
+def bench_partners(n):
+    sheet = make_partner_sheet(n)
+    records = app.get_all_partner_records(sheet)
+
+    def naive_best():
+        # Vorheriger Weg: alles laden, filtern, sortieren
+        aktive = [r for r in app.get_all_partner_records(sheet) if app.is_partner_eligible(r)]
+        aktive.sort(key=app.partner_sort_key)
+        return aktive[0]
+
+    index = app.PartnerIndex(ttl=3600)
+    load_ms = _timed(lambda: index.load(records), 3)
+    assert index.best()["row"] == naive_best()["row"]
+
+    phone = records[n // 2]["telefon"]
+    name = records[n // 3]["name"].upper()
+
+    print(f"Partner: {n}")
+    print(f"  Index laden:          {load_ms:8.2f} ms (einmalig)")
+    print(f"  best() naiv:          {_timed(naive_best, 5):8.3f} ms (+1 Sheet-Read)")
+    print(f"  best() Index:         {_timed(index.best, 1000):8.4f} ms")
+    print(f"  Telefon-Suche Index:  {_timed(lambda: index.by_phone_number(phone), 1000):8.4f} ms")
+    print(f"  Namens-Suche Index:   {_timed(lambda: index.by_name(name), 100):8.4f} ms")
+
+    # 1000 Leads verteilen: auswählen + abbuchen, ohne erneutes Lesen
+    app.partner_index = index
+    app.send_whatsapp = lambda phone, message: {"success": True}
+    sheet.requests = 0
+    start = time.perf_counter()
+    for _ in range(1000):
+        partner = app.find_best_partner(sheet)
+        if not partner:
+            break
+        app.update_partner(sheet, partner)
+    elapsed = time.perf_counter() - start
+    print(f"  1000 Leads verteilt:  {elapsed * 1000:8.2f} ms, {sheet.requests} Sheet-Requests")
+
+
+def bench_partner_writes():
+    """
+    update_partner() und update_partner_guthaben() gegen einen zählenden
+    FakeWorksheet: genau ein values:batchUpdate pro Aufruf mit den richtigen
+    Zellen – und lehnt Google den Batch ab (429), kein einziger Write.
+    """
+    class RejectingWorksheet(FakeWorksheet):
+        def batch_update(self, data, **kwargs):
+            self._request("values:batchUpdate")
+            raise api_error(429, "Quota exceeded for quota metric 'Write requests'")
+
+    isolate_state()
+    app.LEDGER_ENABLED = False
+    app.admin_notifier.notify = lambda *args, **kwargs: None
+    one_batch = Counter({"values:batchUpdate": 1})
+
+    def partner_row(guthaben, status, cls=FakeWorksheet):
+        sheet = cls(PARTNER_HEADER, [["Partner A", "4915100000001", guthaben, 3, "", status]])
+        app.partner_index = app.PartnerIndex(ttl=3600)
+        app.partner_index.ensure(sheet)
+        sheet.methods.clear()
+        return sheet, app.partner_index.get(2)
+
+    print("Partner-Writes gegen FakeWorksheet (Requests je Aufruf)")
+
+    sheet, partner = partner_row(20, "Aktiv")
+    assert app.update_partner(sheet, partner) == 15
+    assert sheet.methods == one_batch, sheet.methods
+    assert sheet.rows[0][2:4] == [15, 4] and sheet.rows[0][4] and sheet.rows[0][5] == "Aktiv", sheet.rows[0]
+    print(f"  update_partner:                  {dict(sheet.methods)} ✓")
+
+    sheet, partner = partner_row(7, "Aktiv")
+    assert app.update_partner(sheet, partner) == 2
+    assert sheet.methods == one_batch, sheet.methods
+    assert sheet.rows[0][2] == 2 and sheet.rows[0][5] == "Pausiert", sheet.rows[0]
+    print(f"  update_partner (pausiert):       {dict(sheet.methods)} ✓")
+
+    sheet, partner = partner_row(2, "Pausiert")
+    assert app.update_partner_guthaben(sheet, partner, 50) == 52
+    assert sheet.methods == one_batch, sheet.methods
+    assert sheet.rows[0][2] == 52 and sheet.rows[0][5] == "Aktiv", sheet.rows[0]
+    print(f"  update_partner_guthaben:         {dict(sheet.methods)} ✓")
+
+    for name, call, expected in (
+            ("update_partner", lambda s, p: app.update_partner(s, p), 20),
+            ("update_partner_guthaben", lambda s, p: app.update_partner_guthaben(s, p, 50), None)):
+        sheet, partner = partner_row(20, "Aktiv", RejectingWorksheet)
+        before = [list(r) for r in sheet.rows]
+        assert call(sheet, partner) == expected
+        assert sheet.methods == one_batch, sheet.methods
+        assert sheet.rows == before and app.partner_index.get(2) == partner
+        print(f"  {name + ' (429):':32} {dict(sheet.methods)}, Zeile unverändert ✓")
+
+    # Poll-Zyklus: scheitert die eine Abbuchung, wird auch nichts zugestellt
+    sheet, _ = partner_row(20, "Aktiv", RejectingWorksheet)
+    before = [list(r) for r in sheet.rows]
+    app.get_partner_sheet = lambda: sheet
+    results = app.assign_leads([{"name": f"Lead {i}", "phone": "", "email": ""} for i in range(3)])
+    assert all(r.get("retry") and "partner" not in r for r in results), results
+    assert sheet.methods == one_batch + Counter({"values:batchGet": 1}), sheet.methods
+    assert sheet.rows == before
+    print(f"  {'assign_leads (429):':32} {dict(sheet.methods)}, 3 Leads zurückgestellt ✓")
+
+    # Zeilennummern aus dem Index: von Hand gelöscht/aufgeladen → neu laden statt fremde Zeile
+    sheet = FakeWorksheet(PARTNER_HEADER, [["Partner A", "4915100000001", 100, 0, "", "Aktiv"],
+                                           ["Partner B", "4915100000002", 100, 5, "", "Aktiv"]])
+    app.partner_index = app.PartnerIndex(ttl=3600)
+    app.partner_index.ensure(sheet)
+    app.get_partner_sheet = lambda: sheet
+    del sheet.rows[0]
+    assert app.assign_lead({"name": "Lead", "phone": "", "email": ""})["partner"]["name"] == "Partner B"
+    assert sheet.rows[0][:4] == ["Partner B", "4915100000002", 95, 6] and len(sheet.rows) == 1, sheet.rows
+    sheet.rows[0][2] = 500
+    sheet.methods.clear()
+    app.assign_leads([{"name": "Lead", "phone": "", "email": ""}])
+    assert sheet.rows[0][2:4] == [495, 7], sheet.rows
+    print(f"  {'Zeile gelöscht / aufgeladen:':32} {dict(sheet.methods)}, richtige Zeile ✓")
+
+
+LEADS_HEADER = ["id", "created_time", "ad_id", "ad_name", "adset_id", "adset_name",
+                "campaign_id", "campaign_name", "form_id", "form_name", "is_organic",
+                "platform", "full_name", "phone_number", "email", "lead_status"]
+
+
+def make_lead_row(i, status):
+    return [f"l:{i}", "2026-10-01T10:00:00", "", "", "", "", "", "", "", "", "false",
+            "fb", f"Lead {i}", f"p:+49151{i:08d}", f"lead{i}@example.com", status]
+
+
+def bench_poll(max_rows, steps=5, new_per_poll=5):
+    """Kosten pro Poll, während das Blatt bis max_rows Zeilen wächst."""
+    sheet = FakeWorksheet(LEADS_HEADER)
+    app.get_leads_sheet = lambda: sheet
+    app.get_partner_sheet = lambda: None
+    app.process_leads = lambda leads: ((lead, {"success": True}) for lead in leads)
+    app.POLL_STATE_FILE = os.path.join(tempfile.mkdtemp(), "poll_state.json")
+    app.STATE_DB = os.path.join(tempfile.mkdtemp(), "state.db")
+    app.POLL_FULL_SCAN_EVERY = 10 ** 9
+
+    print(f"{'Zeilen':>8} | {'Modus':>5} | {'ms/Poll':>8} | {'Zellen gelesen':>14}")
+    for step in range(1, steps + 1):
+        target = max_rows * step // steps
+        while len(sheet.rows) < target:
+            sheet.rows.append(make_lead_row(len(sheet.rows), "VERTEILT"))
+        for full in (True, False):
+            for i in range(new_per_poll):
+                sheet.rows.append(make_lead_row(len(sheet.rows), "CREATED"))
+            sheet.cells_read = 0
+            start = time.perf_counter()
+            result = app._do_poll(full_scan=full)
+            elapsed = (time.perf_counter() - start) * 1000
+            assert result["processed"] == new_per_poll, result
+            print(f"{len(sheet.rows):>8} | {result['scan']:>5} | {elapsed:8.2f} | {sheet.cells_read:>14}")
+
+
+def meta_requests_counted():
+    return sum(v for key, v in app.api_requests_total.values.items() if key[0] == "meta")
+
+
+def bench_whatsapp(messages, partners=50, latency=0.05, error_rate=0.0):
+    """
+    Partner- und Admin-Nachrichten über den Dispatcher an die Fake-Graph-API.
+    Prüft, dass api_requests_total auch die von urllib3 wiederholten 429 zählt.
+    """
+    graph = FakeGraphAPI(latency=latency, error_rate=error_rate)
+    app.META_URL = f"{graph.base_url}/{app.META_PHONE_ID}/messages"
+    dispatcher = app.WhatsAppDispatcher()
+    counted_before = meta_requests_counted()
+
+    start = time.perf_counter()
+    futures = []
+    for i in range(messages):
+        futures.append(dispatcher.submit(f"49151{i % partners:08d}", f"Lead {i}"))
+    results = [f.result() for f in futures]
+    elapsed = time.perf_counter() - start
+    graph.close()
+    counted = meta_requests_counted() - counted_before
+    assert counted == graph.gate.requests, (counted, graph.gate.requests)
+
+    per_recipient = defaultdict(list)
+    for ts, to in graph.sent:
+        per_recipient[to].append(ts)
+    worst = 0
+    for stamps in per_recipient.values():
+        stamps.sort()
+        for i, ts in enumerate(stamps):
+            worst = max(worst, sum(1 for t in stamps[i:] if t - ts < 1.0))
+
+    ok = sum(1 for r in results if "error" not in r)
+    print(f"Nachrichten: {messages} an {partners} Empfänger, {ok} OK")
+    print(f"  Dauer:                 {elapsed:8.2f} s ({messages / elapsed:.1f} msg/s)")
+    print(f"  vorher (sleep 2s):     {messages * (2 + latency):8.2f} s")
+    print(f"  max. pro Empfänger/s:  {worst} (Limit {app.WA_RECIPIENT_BURST} + {app.WA_RECIPIENT_RATE}/s)")
+    print(f"  Latenz (ms):           {app.latency_summary(app.meta_api_stats['latency_ms'])}")
+    print(f"  Requests gezählt:      {counted} (davon 429: {graph.gate.rate_limited})")
+
+
+def bench_ledger(leads, partners=500, latency=0.1, threads=4):
+    """Leads/s mit SQLite-Ledger gegen direkte Sheet-Writes (Sheet mit Latenz)."""
+    app.queue_whatsapp = lambda phone, message: None
+    results = {}
+    for use_ledger in (False, True):
+        sheet = make_partner_sheet(partners)
+        sheet.latency = latency
+        for r in sheet.rows:
+            r[2], r[5] = 1000, "Aktiv"
+        app.get_partner_sheet = lambda: sheet
+        app.partner_index = app.PartnerIndex(ttl=3600)
+        app.LEDGER_ENABLED = use_ledger
+        app.STATE_DB = os.path.join(tempfile.mkdtemp(), "state.db")
+        app._ledger = None
+        app.LEDGER_SYNC_SECONDS = 0.5
+        app.find_best_partner(sheet)  # Laden zählt nicht mit
+
+        def worker(n):
+            for _ in range(n):
+                app.assign_lead({"name": "Bench", "phone": "4915100000000", "email": ""})
+
+        start = time.perf_counter()
+        pool = [threading.Thread(target=worker, args=(leads // threads,)) for _ in range(threads)]
+        for t in pool:
+            t.start()
+        for t in pool:
+            t.join()
+        elapsed = time.perf_counter() - start
+        label = "mit Ledger" if use_ledger else "ohne Ledger"
+        results[label] = (leads // threads * threads) / elapsed
+        if use_ledger:
+            time.sleep(app.LEDGER_SYNC_SECONDS * 3)
+            ledger = app.get_partner_ledger()
+            total = sum(r["guthaben"] for r in app._read_partner_records(sheet))
+            print(f"  Ledger-Spiegel: {len(ledger.dirty_rows())} Zeilen offen, "
+                  f"Sheet-Summe {total:.2f}€")
+    print(f"Leads: {leads}, Partner: {partners}, Sheet-Latenz {latency * 1000:.0f} ms, {threads} Threads")
+    for label, rate in results.items():
+        print(f"  {label:12} {rate:8.1f} Leads/s")
+
+
+def bench_leadgen(leads, per_delivery=5, latency=0.05):
+    """Webhook-Leads: gebündelter Graph-Abruf gegen einen Request pro leadgen_id."""
+    import asyncio
+
+    graph = FakeGraphAPI(latency=latency)
+    app.META_API_BASE = graph.base_url
+    app.FB_ACCESS_TOKEN = "bench"
+    app.FB_BATCH_WINDOW = 0.2
+    app.STATE_DB = os.path.join(tempfile.mkdtemp(), "state.db")
+    app.processed_events = app.ProcessedEventStore()
+    received = []
+
+    async def enqueue_job(kind, payload):
+        received.append(payload)
+        return True
+    app.enqueue_job = enqueue_job
+    app.poll_scheduler.trigger = lambda: None
+
+    async def deliver():
+        app.leadgen_batcher = app.LeadgenBatcher()
+        start = time.perf_counter()
+        for first in range(0, leads, per_delivery):
+            ids = range(first, min(first + per_delivery, leads))
+            payload = {"entry": [{"changes": [{"field": "leadgen", "value": {"leadgen_id": str(i)}}]}
+                                 for i in ids]}
+            # Facebook stellt manche Events doppelt zu
+            for _ in range(2):
+                await app.handle_leadgen_payload(payload)
+        while len(received) < leads:
+            await asyncio.sleep(0.01)
+        return time.perf_counter() - start
+
+    elapsed = asyncio.run(deliver())
+    graph.close()
+    assert len({lead["leadgen_id"] for lead in received}) == len(received) == leads
+    print(f"Leads: {leads} in Zustellungen à {per_delivery} (jede doppelt), Graph-Latenz {latency * 1000:.0f} ms")
+    print(f"  Graph-Requests:  {graph.lead_requests:6} (vorher {leads})")
+    print(f"  Dauer:           {elapsed:8.2f} s")
+    print(f"  Duplikate:       {app.processed_events.stats['duplicates_dropped']:6}")
+
+
+def bench_allocation(leads, partners=200, cap=3):
+    """
+    Batch-Zuteilung gegen den bisherigen Weg Lead für Lead. Prüft
+    deterministisch (fester Seed, eingefrorene Uhr), dass beide dieselben
+    Partner in derselben Reihenfolge wählen und dasselbe Sheet hinterlassen.
+    Danach MAX_LEADS_PER_CYCLE: sind alle Partner ausgeschöpft, bleibt der
+    Rest zurückgestellt (CREATED) statt "ohne Partner".
+    """
+    class FrozenDatetime(app.datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return app.datetime(2026, 10, 1, 12, 0, 0, tzinfo=tz)
+
+    app.datetime = FrozenDatetime
+    app.admin_notifier.notify = lambda *args, **kwargs: None
+    app.LEDGER_ENABLED = False
+    now = FrozenDatetime.now(app.timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+    batch = [{"name": f"Lead {i}", "phone": "", "email": ""} for i in range(leads)]
+
+    # Vorher: find_best_partner() + update_partner() pro Lead
+    sequential_sheet = make_partner_sheet(partners, seed=7)
+    app.partner_index = app.PartnerIndex(ttl=3600)
+    sequential = []
+    start = time.perf_counter()
+    for lead in batch:
+        partner = app.find_best_partner(sequential_sheet)
+        if not partner:
+            sequential.append(None)
+            continue
+        app.update_partner(sequential_sheet, partner, lead)
+        sequential.append(partner["row"])
+    sequential_ms = (time.perf_counter() - start) * 1000
+    sequential_requests = sequential_sheet.requests
+
+    # Neu: ein Snapshot, eine Zuteilung, ein Schreibvorgang
+    batch_sheet = make_partner_sheet(partners, seed=7)
+    app.partner_index = app.PartnerIndex(ttl=3600)
+    get_partner_sheet, app.get_partner_sheet = app.get_partner_sheet, lambda: batch_sheet
+    start = time.perf_counter()
+    assignments = app.assign_leads(batch)
+    batch_ms = (time.perf_counter() - start) * 1000
+    allocated = [a["partner"]["row"] if "partner" in a else None for a in assignments]
+
+    assert allocated == sequential, "Batch-Zuteilung weicht vom Einzelweg ab"
+    assert batch_sheet.rows == sequential_sheet.rows, "Sheet-Stand weicht ab"
+
+    # Cap: genug Guthaben für alle, also schöpft jeder Partner genau `cap` aus
+    rich = make_partner_sheet(partners, seed=7)
+    for r in rich.rows:
+        r[2], r[5] = 1000, "Aktiv"
+    overflow = [{"name": f"Lead {i}", "phone": "", "email": ""} for i in range(partners * cap + leads)]
+    capped, _ = app.allocate_leads(overflow, app._read_partner_records(rich), now, max_per_partner=cap)
+    per_partner = Counter(a["partner"]["row"] for a in capped if "partner" in a)
+    assert set(per_partner.values()) == {cap} and len(per_partner) == partners, per_partner
+    assert capped[partners * cap:] == [app.DEFERRED_BY_CAP] * leads, "Cap-Rest nicht zurückgestellt"
+
+    # Und im Poll-Zyklus: zurückgestellte Zeilen bleiben CREATED, ohne Alarm
+    isolate_state()
+    app.get_partner_sheet = get_partner_sheet
+    poll_partners, poll_cap, poll_leads = 3, 2, 10
+    spreadsheet = make_backend(poll_partners, [make_lead_row(i, "CREATED") for i in range(poll_leads)])
+    graph = FakeGraphAPI(latency=0.0)
+    graph.install()
+    unthrottle_whatsapp()
+    alerts = []
+    app.admin_notifier.notify = lambda kind, *args, **kwargs: alerts.append(kind)
+    app.MAX_LEADS_PER_CYCLE = poll_cap
+    result = app._do_poll()
+    graph.close()
+    statuses = Counter(r[15] for r in spreadsheet.sheets["Tabellenblatt1"].rows)
+    assert result["processed"] == poll_partners * poll_cap, result
+    assert statuses == {"VERTEILT": poll_partners * poll_cap,
+                        "CREATED": poll_leads - poll_partners * poll_cap}, statuses
+    assert "kein_partner" not in alerts, alerts
+
+    print(f"Leads: {leads}, Partner: {partners} – identische Zuteilung ✓")
+    print(f"  Lead für Lead:  {sequential_ms:8.2f} ms, {sequential_requests:5} Sheet-Requests")
+    print(f"  Batch:          {batch_ms:8.2f} ms, {batch_sheet.requests:5} Sheet-Requests")
+    print(f"  Mit Cap {cap}:      {partners} Partner × {cap} Leads, {leads} zurückgestellt ✓")
+    print(f"  Poll mit Cap {poll_cap}: {dict(statuses)}, kein 'Lead ohne Partner' ✓")
+
+
+def bench_jobs(jobs, workers=4, crashed=20):
+    """Durchsatz der persistenten Job-Queue und Wiederaufnahme nach einem Absturz."""
+    import asyncio
+
+    app.STATE_DB = os.path.join(tempfile.mkdtemp(), "state.db")
+    app.job_queue = app.JobQueue()
+    app.LEAD_QUEUE_SIZE = jobs + crashed
+
+    # Ein "abgestürzter" Poll: Zeilen in PROCESSING, Jobs von einer alten Instanz
+    sheet = FakeWorksheet(LEADS_HEADER, [make_lead_row(i, "PROCESSING") for i in range(crashed)])
+    app.get_leads_sheet = lambda: sheet
+    leads = [app.parse_lead_row(i + 2, row) for i, row in enumerate(sheet.rows)]
+    instance_id, app.INSTANCE_ID = app.INSTANCE_ID, "alte-instanz"
+    job_ids = app.job_queue.put_claimed("sheet_lead", leads, app.CLAIM_TTL)
+    app.INSTANCE_ID = instance_id
+    for job_id in job_ids[:crashed // 2]:
+        app.job_queue.set_result(job_id, "VERTEILT")  # schon zugestellt, nur Status fehlt
+
+    delivered = []
+
+    async def process_lead_async(lead):
+        delivered.append(lead)
+        return {"success": True}
+    app.process_lead_async = process_lead_async
+    app.process_lead = lambda lead: delivered.append(lead) or {"success": True}
+
+    async def run():
+        app.job_wakeup = asyncio.Event()
+        start = time.perf_counter()
+        for i in range(jobs):
+            assert await app.enqueue_job("lead", {"name": f"Lead {i}", "phone": "", "email": ""})
+        enqueued = time.perf_counter() - start
+        tasks = [asyncio.create_task(app.job_sweeper())]
+        tasks += [asyncio.create_task(app.pipeline_worker(i)) for i in range(workers)]
+        while app.job_queue.depth():
+            await asyncio.sleep(0.05)
+        elapsed = time.perf_counter() - start
+        for t in tasks:
+            t.cancel()
+        return enqueued, elapsed
+
+    enqueued, elapsed = asyncio.run(run())
+    statuses = [r[15] for r in sheet.rows]
+    print(f"Jobs: {jobs}, {workers} Worker")
+    print(f"  Enqueue:        {jobs / enqueued * 60:10.0f} Jobs/min")
+    print(f"  Ende-zu-Ende:   {jobs / elapsed * 60:10.0f} Jobs/min")
+    print(f"  Absturz-Zeilen: {crashed} → {statuses.count('VERTEILT')} VERTEILT, "
+          f"{len(delivered) - jobs} erneut zugestellt (ohne gespeichertes Ergebnis)")
+
+
+def _lease_worker(kind, state_dir, owner, names, ttl, barrier, results):
+    """Ein Prozess im Szenario "leases": beansprucht names blockweise in eigener Reihenfolge."""
+    app.STATE_DIR = state_dir
+    app.STATE_DB = os.path.join(state_dir, "state.db")
+    backend = app.make_lease_backend(kind)
+    chunks = [names[i:i + 10] for i in range(0, len(names), 10)]
+    random.Random(owner).shuffle(chunks)
+    barrier.wait()
+    won = set()
+    for chunk in chunks:
+        won |= backend.claim_many(chunk, ttl, owner=owner)
+        time.sleep(0.001)  # Claims über die Zeit verteilen, damit sich die Prozesse überlappen
+    results.put((owner, sorted(won)))
+
+
+def bench_leases(processes=4, rows=2000):
+    """
+    FileLeaseBackend und SQLiteLeaseBackend über Prozessgrenzen: mehrere
+    Prozesse beanspruchen gleichzeitig dieselben Zeilen per claim_many() –
+    jede Zeile muss genau einmal gewonnen werden. Danach übernimmt ein
+    anderer Besitzer die Claims eines "abgestürzten" Prozesses, sobald
+    deren TTL abgelaufen ist.
+    """
+    import multiprocessing
+
+    ctx = multiprocessing.get_context("spawn")
+    names = [app.claim_key(row) for row in range(2, rows + 2)]
+
+    def run(kind, state_dir, owners, names, ttl):
+        barrier = ctx.Barrier(len(owners))
+        results = ctx.Queue()
+        procs = [ctx.Process(target=_lease_worker,
+                             args=(kind, state_dir, owner, names, ttl, barrier, results))
+                 for owner in owners]
+        for p in procs:
+            p.start()
+        won = {}
+        for _ in procs:
+            owner, names_won = results.get(timeout=120)
+            won[owner] = set(names_won)
+        for p in procs:
+            p.join(10)
+            assert p.exitcode == 0, (owner, p.exitcode)
+        return won
+
+    print(f"Leases: {processes} Prozesse, {rows} Zeilen, claim_many() in Blöcken à 10")
+    for kind in ("file", "sqlite"):
+        state_dir = isolate_state()
+        backend = app.make_lease_backend(kind)  # Datei/Tabelle vor dem Start anlegen
+
+        won = run(kind, state_dir, [f"worker-{i}" for i in range(processes)], names, 60)
+        counts = Counter(name for names_won in won.values() for name in names_won)
+        assert set(counts) == set(names), f"{kind}: {len(names) - len(counts)} Zeilen von niemandem gewonnen"
+        assert max(counts.values()) == 1, f"{kind}: {sum(1 for n in counts.values() if n > 1)} doppelt gewonnen"
+        assert all(backend.is_held(name) for name in names)
+        split = " / ".join(str(len(won[owner])) for owner in sorted(won))
+        print(f"  {kind:6} jede Zeile genau einmal gewonnen ✓  Verteilung {split}")
+
+        # Abgestürzter Prozess: Claims mit kurzer TTL, nie freigegeben
+        for owner, names_won in won.items():
+            backend.release_many(sorted(names_won), owner=owner)
+        assert not any(backend.is_held(name) for name in names)
+        crashed = names[:50]
+        assert run(kind, state_dir, ["abgestuerzt"], crashed, 1.0)["abgestuerzt"] == set(crashed)
+        assert backend.claim_many(crashed, 60, owner="neu") == set(), "gültige Claims übernommen"
+        time.sleep(1.1)
+        assert not any(backend.is_held(name) for name in crashed)
+        assert backend.claim_many(crashed, 60, owner="neu") == set(crashed), "abgelaufene Claims nicht übernommen"
+        backend.release_many(crashed, owner="abgestuerzt")  # fremder Release wirkt nicht
+        assert all(backend.is_held(name) for name in crashed)
+        backend.release_many(crashed, owner="neu")
+        assert not any(backend.is_held(name) for name in crashed)
+        print(f"  {kind:6} abgelaufene Claims übernommen, fremder Release ohne Wirkung ✓")
+
+
+def bench_reconcile(sessions=20000, partners=1000):
+    """
+    Stripe-Abgleich gegen FakeStripeAPI: gezielt eingestreute fehlende,
+    doppelte und nicht zuordenbare Gutschriften müssen exakt gefunden und
+    korrigiert werden; danach findet ein zweiter Lauf nichts mehr.
+    """
+    import tracemalloc
+
+    isolate_state()
+    spreadsheet = make_backend(partners, (), sheets_latency=0.0)
+    app.admin_notifier.notify = lambda *args, **kwargs: None
+    records = {r["row"]: r for r in app._read_partner_records(app.get_partner_sheet())}
+    rows = sorted(records)
+
+    # Sessions der letzten 30 Tage; je Partner ist die E-Mail aus früheren Zahlungen bekannt
+    rnd = random.Random(5)
+    base = time.time() - 30 * 86400
+    items, kinds, expected_delta = [], Counter(), defaultdict(float)
+    app.stripe_credits._db()
+    with app.state_transaction() as conn:
+        for i in range(sessions):
+            partner = records[rows[i % len(rows)]]
+            email = f"p{partner['row']}@example.com"
+            amount = rnd.choice([50, 100])
+            kind = rnd.choices(["ok", "missing", "email_only", "double", "unmatched"],
+                               [0.96, 0.01, 0.01, 0.01, 0.01])[0]
+            phone = "" if kind == "email_only" else partner["telefon"]
+            if kind == "unmatched":
+                phone, email = f"4917{i:09d}", f"fremd{i}@example.com"
+            items.append({"id": f"cs_bench_{i:06d}", "object": "checkout.session", "status": "complete",
+                          "created": int(base + i * 60), "amount_total": amount * 100,
+                          "customer_details": {"name": partner["name"], "email": email, "phone": phone}})
+            if kind in ("ok", "double"):
+                for _ in range(2 if kind == "double" else 1):
+                    app.stripe_credits.record(items[-1]["id"], partner, amount, email, conn=conn)
+            if kind in ("missing", "email_only"):
+                expected_delta[partner["row"]] += amount
+            elif kind == "double":
+                expected_delta[partner["row"]] -= amount
+            kinds[kind] += 1
+    stripe_api = FakeStripeAPI(items)
+    stripe_api.install()
+    del items
+
+    def run(**kwargs):
+        tracemalloc.start()
+        start = time.perf_counter()
+        report = app.reconcile_stripe(**kwargs)
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return report, elapsed, peak
+
+    small, _, small_peak = run(since=base + (sessions - sessions // 10) * 60)
+    report, elapsed, peak = run(since=0)
+    assert report["missing"] == kinds["missing"] + kinds["email_only"], report["missing"]
+    assert report["double"] == kinds["double"] and report["unmatched"] == kinds["unmatched"]
+
+    calls_before = spreadsheet.gate.requests
+    fixed, fix_elapsed, _ = run(since=0, apply=True)
+    sheet_calls = spreadsheet.gate.requests - calls_before
+    for row, delta in expected_delta.items():
+        assert app.partner_index.get(row)["guthaben"] == round(records[row]["guthaben"] + delta, 2), row
+    after, _, _ = run(since=0)
+    assert after["missing"] == after["double"] == 0
+
+    print(f"Stripe-Abgleich: {sessions} Sessions, {partners} Partner")
+    print(f"  Bericht:        {elapsed:6.2f} s, {sessions / elapsed:8.0f} Sessions/s, "
+          f"{report['pages']} Stripe-Seiten")
+    print(f"  Gefunden:       {report['missing']} fehlend (davon {kinds['email_only']} nur per E-Mail), "
+          f"{report['double']} doppelt, {report['unmatched']} ohne Partner ✓")
+    print(f"  Speicher-Peak:  {small_peak / 1024:6.0f} KiB bei {small['sessions']} Sessions, "
+          f"{peak / 1024:6.0f} KiB bei {report['sessions']}")
+    print(f"  Korrektur:      {fixed['fixed']} Buchungen in {fix_elapsed:.2f} s, {sheet_calls} Sheet-Requests")
+    print(f"  Zweiter Lauf:   {after['missing']} fehlend, {after['double']} doppelt ✓")
+    stripe_api.close()
+
+
+def bench_export(rows=100000, days=60):
+    """
+    /leads/export gegen ein großes Leads_Log: erster Export (Spiegel
+    aufbauen), Wiederholung aus dem Tages-Cache, neue Zeilen am Ende,
+    Filter gegen eine direkte Auswertung und Neuaufbau nach Löschung.
+    """
+    import tracemalloc
+
+    isolate_state()
+    spreadsheet = make_backend(100, (), sheets_latency=0.05)
+    rnd = random.Random(9)
+    start_day = app.datetime(2026, 8, 1, tzinfo=app.timezone.utc).timestamp()
+    log_rows = []
+    for i in range(rows):
+        ts = app.datetime.fromtimestamp(start_day + i * days * 86400 / rows, app.timezone.utc)
+        p = rnd.randrange(100)
+        status = "VERTEILT" if rnd.random() < 0.9 else "KEIN_PARTNER"
+        log_rows.append([ts.strftime("%Y-%m-%d %H:%M:%S"), f"Lead {i}", f"49160{i:08d}", f"lead{i}@example.com",
+                         f"Partner {p:05d}", f"49151{p:08d}", "45", "OK", status])
+    log_sheet = FakeWorksheet(app.LEADS_LOG_HEADER, log_rows)
+    spreadsheet.add("Leads_Log", log_sheet)
+    app.ADMIN_API_TOKEN = "bench"
+    server, thread, base = serve_app()
+    auth = {"Authorization": "Bearer bench"}
+    wait_until(lambda: app.stripe.loaded, 30)  # Hintergrund-Import nicht mitmessen
+
+    def export(query):
+        calls = log_sheet.requests
+        start = time.perf_counter()
+        with requests.get(f"{base}/leads/export?{query}", headers=auth, stream=True) as res:
+            res.raise_for_status()
+            lines = sum(1 for line in res.iter_lines() if line)
+        return lines, time.perf_counter() - start, log_sheet.requests - calls
+
+    def expected(date_from, date_to, phone=None, status=None, name=None):
+        return sum(1 for r in log_sheet.rows
+                   if date_from <= r[0][:10] <= date_to and (not phone or r[5] == phone)
+                   and (not status or r[8] == status) and (not name or r[4] == name))
+
+    query = "from=2026-08-10&to=2026-08-20"
+    print(f"Leads_Log: {rows} Zeilen über {days} Tage, Chunk {app.LEADS_EXPORT_CHUNK}, Sheets 50 ms")
+    for label in ("Kalt (Spiegel aufbauen)", "Wiederholung (Cache)"):
+        lines, elapsed, calls = export(query)
+        assert lines - 1 == expected("2026-08-10", "2026-08-20")
+        print(f"  {label:26} {lines - 1:7} Zeilen {elapsed * 1000:8.0f} ms {calls:4} Sheet-Requests")
+
+    log_sheet.rows.extend([[f"2026-09-30 23:59:{i % 60:02d}", f"Neu {i}", "", "", "Partner 00001",
+                            "4915100000001", "40", "OK", "VERTEILT"] for i in range(500)])
+    lines, elapsed, calls = export("format=ndjson&partner=4915100000001&status=verteilt"
+                                      "&from=2026-08-01&to=2026-09-30")
+    assert lines == expected("2026-08-01", "2026-09-30", "4915100000001", "VERTEILT"), lines
+    print(f"  {'+500 Zeilen, NDJSON-Filter':26} {lines:7} Zeilen {elapsed * 1000:8.0f} ms {calls:4} Sheet-Requests")
+
+    # Name mit Ziffern ist kein Telefon-Filter
+    lines, elapsed, calls = export("format=ndjson&partner=Partner%2000042&from=2026-08-01&to=2026-09-30")
+    assert lines == expected("2026-08-01", "2026-09-30", name="Partner 00042") > 0, lines
+    print(f"  {'Filter nach Name':26} {lines:7} Zeilen {elapsed * 1000:8.0f} ms {calls:4} Sheet-Requests")
+
+    del log_sheet.rows[10]
+    lines, elapsed, calls = export(query)
+    assert lines - 1 == expected("2026-08-10", "2026-08-20")
+    print(f"  {'Zeile gelöscht → Neuaufbau':26} {lines - 1:7} Zeilen {elapsed * 1000:8.0f} ms {calls:4} Sheet-Requests")
+
+    # Speicher: kompletter Neuaufbau + Export aller Zeilen
+    tracemalloc.start()
+    lines, _, _ = export("refresh=true")
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"  Speicher-Peak bei Neuaufbau + Export aller {lines - 1} Zeilen: {peak / 1024 / 1024:.1f} MiB "
+          f"(get_all_values(): {rows * len(app.LEADS_LOG_HEADER)} Zellen auf einmal)")
+
+    server.should_exit = True
+    thread.join(10)
+
+
+def bench_startup(runs=5):
+    """
+    Kaltstart in frischen Prozessen: Import von app.py (lazy gegen die
+    früheren Eager-Imports) und Zeit bis zur ersten Antwort von /health.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, STATE_DIR=tempfile.mkdtemp(prefix="bench-"),
+               GOOGLE_CREDENTIALS_JSON="", GOOGLE_CREDENTIALS_FILE="/nonexistent.json")
+
+    def import_seconds(prelude):
+        code = (f"import time; t = time.perf_counter(); {prelude}import app; "
+                f"print(time.perf_counter() - t)")
+        out = subprocess.run([sys.executable, "-c", code], cwd=here, env=env,
+                             capture_output=True, text=True, check=True)
+        return float(out.stdout.strip().splitlines()[-1])
+
+    def first_request_seconds():
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]
+        start = time.perf_counter()
+        proc = subprocess.Popen([sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1",
+                                 "--port", str(port), "--log-level", "warning"],
+                                cwd=here, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            while True:
+                try:
+                    if requests.get(f"http://127.0.0.1:{port}/health", timeout=1).status_code == 200:
+                        break
+                except requests.ConnectionError:
+                    time.sleep(0.005)
+            elapsed = time.perf_counter() - start
+            health = []
+            for _ in range(50):
+                t = time.perf_counter()
+                requests.get(f"http://127.0.0.1:{port}/health", timeout=1)
+                health.append((time.perf_counter() - t) * 1000)
+            ready = requests.get(f"http://127.0.0.1:{port}/ready", timeout=1)
+            return elapsed, sorted(health)[len(health) // 2], ready
+        finally:
+            proc.terminate()
+            proc.wait(10)
+
+    def median(values):
+        return sorted(values)[len(values) // 2]
+
+    lazy = median([import_seconds("") for _ in range(runs)])
+    eager = median([import_seconds("import gspread, google.auth.exceptions, stripe; ")
+                    for _ in range(runs)])
+    starts = [first_request_seconds() for _ in range(runs)]
+    first = median([elapsed for elapsed, _, _ in starts])
+    health_ms = median([ms for _, ms, _ in starts])
+    ready = starts[-1][2]
+
+    print(f"Kaltstart, Median aus {runs} Läufen")
+    print(f"  import app (lazy):          {lazy * 1000:8.0f} ms")
+    print(f"  import app + SDKs (eager):  {eager * 1000:8.0f} ms")
+    print(f"  Start → erste /health-200:  {first * 1000:8.0f} ms")
+    print(f"  /health danach:             {health_ms:8.2f} ms")
+    print(f"  /ready ohne Google:         {ready.status_code} {ready.json()['checks']}")
+
+
+# ─── Last-Szenarien (Suite) ──────────────────
+# Laufen gegen FakeSpreadsheet + FakeGraphAPI durch den echten Code-Pfad
+# (Client-Cache, PartnerIndex, Dispatcher, Job-Queue) und liefern flache
+# Kennzahlen für die Baseline. Höher ist besser nur bei *_per_s.
+def isolate_state():
+    """Eigene State-DB, Poll-State und Log-Spool pro Lauf."""
+    tmp = tempfile.mkdtemp(prefix="bench-")
+    app.STATE_DIR = tmp
+    app.STATE_DB = os.path.join(tmp, "state.db")
+    app.POLL_STATE_FILE = os.path.join(tmp, "poll_state.json")
+    app.lead_log = app.LeadLogBuffer(os.path.join(tmp, "leads_log_spool.jsonl"))
+    app.LEADS_EXPORT_DIR = os.path.join(tmp, "leads_log_cache")
+    app.leads_log_mirror = app.LeadsLogMirror()
+    app.job_queue = app.JobQueue()
+    app.processed_events = app.ProcessedEventStore()
+    return tmp
+
+
+def unthrottle_whatsapp():
+    # Die Meta-Limits misst das Szenario "whatsapp"; hier sollen sie den
+    # Durchsatz nicht auf 20 msg/s deckeln
+    app.WA_SENDER_RATE = app.WA_SENDER_BURST = 10 ** 6
+    app.WA_RECIPIENT_RATE = app.WA_RECIPIENT_BURST = 10 ** 6
+    app.WA_WORKERS = 16
+    app._meta_session = None  # Pool-Größe folgt WA_WORKERS
+    app.wa_dispatcher = app.WhatsAppDispatcher(workers=app.WA_WORKERS)
+
+
+def make_backend(partners, lead_rows=(), sheets_latency=0.01, quota_per_min=None,
+                 error_rate=0.0):
+    spreadsheet = FakeSpreadsheet(sheets_latency, quota_per_min, error_rate)
+    partner_sheet = make_partner_sheet(partners)
+    for r in partner_sheet.rows:
+        r[2], r[5] = 1000, "Aktiv"
+    spreadsheet.add("Partner_Konto", partner_sheet)
+    spreadsheet.add("Tabellenblatt1", FakeWorksheet(LEADS_HEADER, lead_rows))
+    spreadsheet.add("Leads_Log", FakeWorksheet(["Zeitstempel"]))
+    spreadsheet.install()
+    return spreadsheet
+
+
+def wait_until(predicate, timeout):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.02)
+    return True
+
+
+def lead_for(i):
+    return {"name": f"Lead {i}", "phone": f"49160{i:08d}", "email": f"lead{i}@example.com",
+            "source": "poll", "received_at": time.time()}
+
+
+def report(title, result):
+    print(title)
+    for key, value in result.items():
+        print(f"  {key:28} {value:12.2f}" if isinstance(value, float) else f"  {key:28} {value:>12}")
+    return result
+
+
+def bench_burst(leads=1000, partners=10000, workers=app.LEAD_WORKERS, sheets_latency=0.01,
+                graph_latency=0.02, error_rate=0.0, quota_per_min=None):
+    """process_lead() für einen Burst von Leads aus LEAD_WORKERS Threads."""
+    isolate_state()
+    spreadsheet = make_backend(partners, (), sheets_latency, quota_per_min, error_rate)
+    graph = FakeGraphAPI(graph_latency)
+    graph.install()
+    unthrottle_whatsapp()
+    app.find_best_partner(app.get_partner_sheet())  # Index laden zählt nicht mit
+    calls_before = spreadsheet.gate.requests
+
+    latencies = []
+    errors = []
+    next_lead = itertools.count()
+
+    def worker():
+        while (i := next(next_lead)) < leads:
+            start = time.perf_counter()
+            result = app.process_lead(lead_for(i))
+            latencies.append((time.perf_counter() - start) * 1000)
+            if "error" in result:
+                errors.append(result["error"])
+
+    start = time.perf_counter()
+    pool = [threading.Thread(target=worker) for _ in range(workers)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - start
+    app.lead_log.flush()
+    wait_until(lambda: len(graph.sent) >= leads - len(errors), 30)
+    graph.close()
+
+    summary = app.latency_summary(latencies)
+    return report(f"Burst: {leads} Leads, {partners} Partner, {workers} Worker, "
+                  f"Sheets {sheets_latency * 1000:.0f} ms, Graph {graph_latency * 1000:.0f} ms", {
+        "leads_per_s": leads / elapsed,
+        "p50_ms": summary["p50"],
+        "p99_ms": summary["p99"],
+        "google_calls_per_lead": (spreadsheet.gate.requests - calls_before) / leads,
+        "meta_calls_per_lead": graph.gate.requests / leads,
+        "errors": len(errors),
+        "google_429": spreadsheet.gate.rate_limited,
+    })
+
+
+def bench_poll_burst(leads=1000, rows=100000, partners=10000, sheets_latency=0.01,
+                     graph_latency=0.02, error_rate=0.0, quota_per_min=None):
+    """Ein _do_poll(), der einen Burst neuer Zeilen am Ende eines großen Blatts findet."""
+    isolate_state()
+    lead_rows = [make_lead_row(i, "VERTEILT") for i in range(rows)]
+    lead_rows += [make_lead_row(rows + i, "CREATED") for i in range(leads)]
+    spreadsheet = make_backend(partners, lead_rows, sheets_latency, quota_per_min, error_rate)
+    graph = FakeGraphAPI(graph_latency)
+    graph.install()
+    unthrottle_whatsapp()
+    app.POLL_FULL_SCAN_EVERY = 10 ** 9
+    app._poll_state.update(high_water=rows + 1, since_full_scan=0)
+    app.find_best_partner(app.get_partner_sheet())
+
+    finish_lead = app.finish_lead
+    latencies = []
+    start = time.perf_counter()
+
+    def timed_finish_lead(*args):
+        result = finish_lead(*args)
+        latencies.append((time.perf_counter() - start) * 1000)
+        return result
+    app.finish_lead = timed_finish_lead
+
+    result = app._do_poll()
+    elapsed = time.perf_counter() - start
+    app.lead_log.flush()
+    graph.close()
+
+    statuses = Counter(r[15] for r in spreadsheet.sheets["Tabellenblatt1"].rows[rows:])
+    summary = app.latency_summary(latencies)
+    return report(f"Poll-Burst: {leads} neue Zeilen hinter {rows} alten, {partners} Partner", {
+        "leads_per_s": result.get("processed", 0) / elapsed,
+        "p50_ms": summary["p50"],
+        "p99_ms": summary["p99"],
+        "google_calls_per_lead": result.get("google_calls_per_lead", 0.0),
+        "meta_calls_per_lead": graph.gate.requests / leads,
+        "errors": leads - statuses["VERTEILT"],
+        "google_429": spreadsheet.gate.rate_limited,
+    })
+
+
+def serve_app():
+    """Die echte FastAPI-App per uvicorn in einem Thread (mit Startup-Hooks)."""
+    import uvicorn
+
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(app.app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    wait_until(lambda: server.started, 10)
+    return server, thread, f"http://127.0.0.1:{port}"
+
+
+def bench_webhooks(leads=1000, payments=100, partners=10000, concurrency=32,
+                   sheets_latency=0.01, graph_latency=0.02, error_rate=0.0, quota_per_min=None):
+    """Facebook- und Stripe-Webhooks per HTTP gegen die laufende App bis zur Zustellung."""
+    isolate_state()
+    spreadsheet = make_backend(partners, (), sheets_latency, quota_per_min, error_rate)
+    graph = FakeGraphAPI(graph_latency)
+    graph.install()
+    unthrottle_whatsapp()
+    app.STRIPE_WEBHOOK_SECRET = ""
+    app.LEAD_QUEUE_SIZE = leads + payments
+
+    server, thread, base = serve_app()
+    app.find_best_partner(app.get_partner_sheet())
+    calls_before = spreadsheet.gate.requests
+
+    def leadgen(i):
+        return "/webhook/facebook", {"object": "page", "entry": [{"changes": [
+            {"field": "leadgen", "value": {"leadgen_id": str(10 ** 6 + i)}}]}]}
+
+    def payment(i):
+        return "/stripe-webhook", {"id": f"evt_bench_{i}", "type": "checkout.session.completed",
+                                   "data": {"object": {"id": f"cs_bench_{i}", "amount_total": 5000,
+                                                       "customer_details": {
+                                                           "name": f"Partner {i:05d}", "email": "",
+                                                           "phone": f"49151{i:08d}"}}}}
+
+    requests_to_send = [leadgen(i) for i in range(leads)] + [payment(i) for i in range(payments)]
+    random.Random(2).shuffle(requests_to_send)
+    local = threading.local()
+    acks = []
+
+    def post(item):
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        path, body = item
+        t = time.perf_counter()
+        res = session.post(base + path, json=body)
+        acks.append((time.perf_counter() - t) * 1000)
+        return res.status_code
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        codes = Counter(pool.map(post, requests_to_send))
+    acked = time.perf_counter() - start
+    jobs = leads + payments
+    wait_until(lambda: app.pipeline_stats["done"] + app.pipeline_stats["dead"] >= jobs, 300)
+    elapsed = time.perf_counter() - start
+    server.should_exit = True
+    thread.join(10)
+    app.lead_log.flush()
+    graph.close()
+
+    summary = app.latency_summary(acks)
+    return report(f"Webhooks: {leads} Leads + {payments} Zahlungen, {concurrency} parallel", {
+        "requests_per_s": len(requests_to_send) / acked,
+        "leads_per_s": leads / elapsed,
+        "ack_p50_ms": summary["p50"],
+        "ack_p99_ms": summary["p99"],
+        "google_calls_per_lead": (spreadsheet.gate.requests - calls_before) / jobs,
+        "meta_calls_per_lead": graph.gate.requests / jobs,
+        "errors": jobs - app.pipeline_stats["done"] + sum(n for c, n in codes.items() if c != 200),
+        "google_429": spreadsheet.gate.rate_limited,
+    })
+
+
+def bench_partner_api(requests_total=5000, partners=10000, concurrency=16, sheets_latency=0.3, ttl=1.0):
+    """
+    Lese-API aus dem Partner-Snapshot: Durchsatz, 304-Anteil und
+    Google-Requests pro Aufruf. TTL und Sheets-Latenz sind absichtlich so
+    gewählt, dass während des Laufs mehrere Hintergrund-Refreshes fallen.
+    """
+    isolate_state()
+    spreadsheet = make_backend(partners, (), sheets_latency)
+    app.PARTNER_TOKEN_SECRET, app.ADMIN_API_TOKEN = "bench", "bench-admin"
+    app.partner_snapshot = app.PartnerSnapshot(ttl)
+    server, thread, base = serve_app()
+    admin = {"Authorization": "Bearer bench-admin"}
+
+    def auth(path):
+        # Liste nur für den Admin, Guthaben mit dem Token des jeweiligen Partners
+        if path.startswith("/partners"):
+            return dict(admin)
+        return {"Authorization": f"Bearer {app.partner_api_token(path.split('/')[2])}"}
+    wait_until(lambda: app.poll_scheduler.last_poll_at, 30)
+
+    # Erster Zugriff lädt blockierend, danach nur noch Snapshot
+    start = time.perf_counter()
+    requests.get(f"{base}/partner/4915100000000/balance", headers=auth("/partner/4915100000000")).raise_for_status()
+    first_ms = (time.perf_counter() - start) * 1000
+    calls_before = spreadsheet.gate.requests
+
+    # Wenige aktive Partner fragen immer wieder nach (→ 304), dazu Listen-Seiten
+    rnd = random.Random(3)
+    hot = min(partners, 300)
+    paths = [f"/partners?offset={rnd.randrange(0, partners, 1000)}&limit=100" if rnd.random() < 0.2
+             else f"/partner/49151{rnd.randrange(hot):08d}/balance" for _ in range(requests_total)]
+    local = threading.local()
+    latencies = []
+
+    def get(path):
+        if not hasattr(local, "session"):
+            local.session, local.etags = requests.Session(), {}
+        headers = auth(path)
+        if path in local.etags:
+            headers["If-None-Match"] = local.etags[path]
+        t = time.perf_counter()
+        res = local.session.get(base + path, headers=headers)
+        latencies.append((time.perf_counter() - t) * 1000)
+        if "ETag" in res.headers:
+            local.etags[path] = res.headers["ETag"]
+        return res.status_code
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        codes = Counter(pool.map(get, paths))
+    elapsed = time.perf_counter() - start
+    google_calls = spreadsheet.gate.requests - calls_before
+
+    # Eigene Aufladung ist sofort sichtbar, ohne auf den TTL zu warten
+    sheet = app.get_partner_sheet()
+    partner = app.find_partner_by_phone(sheet, "4915100000042")
+    app.update_partner_guthaben(sheet, partner, 50)
+    balance = requests.get(f"{base}/partner/4915100000042/balance",
+                           headers=auth("/partner/4915100000042")).json()["guthaben"]
+    assert balance == partner["guthaben"] + 50, balance
+
+    # Ein Partner sieht nur sich selbst, die Liste gar nicht
+    own = auth("/partner/4915100000042")
+    assert requests.get(f"{base}/partner/4915100000043/balance", headers=own).status_code == 401
+    assert requests.get(f"{base}/partners", headers=own).status_code == 401
+    assert requests.get(f"{base}/partner/4915100000043/balance", headers=admin).status_code == 200
+
+    server.should_exit = True
+    thread.join(10)
+    summary = app.latency_summary(latencies)
+    return report(f"Partner-API: {requests_total} Requests, {partners} Partner, {concurrency} parallel, "
+                  f"TTL {ttl}s, Sheets {sheets_latency * 1000:.0f} ms", {
+        "first_request_ms": first_ms,
+        "requests_per_s": requests_total / elapsed,
+        "p50_ms": summary["p50"],
+        "p99_ms": summary["p99"],
+        "not_modified_share": codes[304] / requests_total,
+        "background_refreshes": app.partner_snapshot.stats["refreshes"] - 1,
+        "google_calls": google_calls,
+        "errors": requests_total - codes[200] - codes[304],
+    })
+
+
+SUITE = {
+    "burst": bench_burst,
+    "poll-burst": bench_poll_burst,
+    "webhooks": bench_webhooks,
+}
+
+
+def run_suite(names, quick=False, latency=None, error_rate=0.0):
+    """Jedes Szenario in einem eigenen Prozess – app.py-Globals bleiben unberührt."""
+    results = {}
+    for name in names:
+        with tempfile.NamedTemporaryFile(suffix=".json") as out:
+            cmd = [sys.executable, os.path.abspath(__file__), name, "--json-out", out.name,
+                   "--error-rate", str(error_rate)]
+            if quick:
+                cmd.append("--quick")
+            if latency is not None:
+                cmd += ["--latency", str(latency)]
+            subprocess.run(cmd, check=True)
+            results.update({f"{name}.{k}": v for k, v in json.load(open(out.name)).items()})
+    return results
+
+
+def compare_baseline(results, baseline, tolerance):
+    """Gibt die Kennzahlen zurück, die sich gegenüber der Baseline verschlechtert haben."""
+    regressions = []
+    print(f"\n{'Kennzahl':40} {'Baseline':>12} {'jetzt':>12}  Änderung")
+    for key, value in results.items():
+        old = baseline.get(key)
+        if not isinstance(old, (int, float)):
+            continue
+        if key.endswith(("errors", "_429")):
+            # Fehler sind absolute Zähler: jede Zunahme zählt
+            worse = value > old
+            change = f"{value - old:+8.0f}"
+        elif old:
+            rel = (value - old) / old
+            worse = (-rel if key.endswith("_per_s") else rel) > tolerance
+            change = f"{rel:+8.1%}"
+        else:
+            continue
+        if worse:
+            regressions.append(key)
+        print(f"{key:40} {old:12.2f} {value:12.2f}  {change}{'  ← REGRESSION' if worse else ''}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="scenario", required=True)
+    p = sub.add_parser("partners", help="PartnerIndex gegen Voll-Scan")
+    p.add_argument("--n", type=int, default=10000)
+    sub.add_parser("partner-writes", help="Ein batch_update pro Partner-Update, keiner bei Fehlern")
+    p = sub.add_parser("poll", help="Inkrementelles Polling gegen Voll-Scan")
+    p.add_argument("--rows", type=int, default=100000)
+    p = sub.add_parser("whatsapp", help="Versand-Queue gegen Fake-Graph-API")
+    p.add_argument("--messages", type=int, default=200)
+    p.add_argument("--partners", type=int, default=50)
+    p.add_argument("--error-rate", type=float, default=0.0, help="Anteil 429-Antworten")
+    p = sub.add_parser("ledger", help="SQLite-Ledger gegen direkte Sheet-Writes")
+    p.add_argument("--leads", type=int, default=300)
+    p = sub.add_parser("leadgen", help="Gebündelter Lead-Abruf für Facebook-Webhooks")
+    p.add_argument("--leads", type=int, default=200)
+    p = sub.add_parser("allocation", help="Batch-Zuteilung gegen Lead für Lead (Gleichheitsprüfung)")
+    p.add_argument("--leads", type=int, default=500)
+    p.add_argument("--partners", type=int, default=200)
+    p = sub.add_parser("jobs", help="Persistente Job-Queue: Durchsatz und Wiederaufnahme")
+    p.add_argument("--jobs", type=int, default=5000)
+    p = sub.add_parser("leases", help="File-/SQLite-Leases über mehrere Prozesse (CAS, Ablauf)")
+    p.add_argument("--processes", type=int, default=4)
+    p.add_argument("--rows", type=int, default=2000)
+    p = sub.add_parser("partner-api", help="Partner-Lese-API aus dem Snapshot (SWR, ETag/304)")
+    p.add_argument("--requests", type=int, default=5000)
+    p.add_argument("--partners", type=int, default=10000)
+    p = sub.add_parser("reconcile", help="Stripe-Abgleich gegen lokale Fake-Stripe-API")
+    p.add_argument("--sessions", type=int, default=20000)
+    p.add_argument("--partners", type=int, default=1000)
+    p = sub.add_parser("export", help="Leads_Log-Export: Streaming, Tages-Cache, Filter")
+    p.add_argument("--rows", type=int, default=100000)
+    p = sub.add_parser("startup", help="Kaltstart: Importzeit und erste /health-Antwort")
+    p.add_argument("--runs", type=int, default=5)
+
+    for name, fn in SUITE.items():
+        p = sub.add_parser(name, help=fn.__doc__)
+        p.add_argument("--leads", type=int, default=1000)
+        p.add_argument("--partners", type=int, default=10000)
+        p.add_argument("--latency", type=float, default=0.01, help="Sheets-Latenz in s")
+        p.add_argument("--graph-latency", type=float, default=0.02)
+        p.add_argument("--error-rate", type=float, default=0.0, help="Anteil 429-Antworten")
+        p.add_argument("--quota", type=int, default=None, help="Sheets-Requests pro Minute")
+        p.add_argument("--quick", action="store_true", help="100 Leads, 1000 Partner")
+        p.add_argument("--json-out")
+
+    p = sub.add_parser("suite", help="Alle Last-Szenarien, Baseline speichern/vergleichen")
+    p.add_argument("--only", nargs="+", choices=list(SUITE), default=list(SUITE))
+    p.add_argument("--quick", action="store_true")
+    p.add_argument("--latency", type=float, default=None)
+    p.add_argument("--error-rate", type=float, default=0.0)
+    p.add_argument("--save", metavar="JSON", help="Ergebnisse als Baseline schreiben")
+    p.add_argument("--compare", metavar="JSON", help="Gegen eine gespeicherte Baseline prüfen")
+    p.add_argument("--tolerance", type=float, default=0.2, help="erlaubte Verschlechterung (0.2 = 20%%)")
+    args = parser.parse_args()
+    app.logger.setLevel(logging.WARNING)
+
+    if args.scenario == "partners":
+        bench_partners(args.n)
+    elif args.scenario == "partner-writes":
+        bench_partner_writes()
+    elif args.scenario == "poll":
+        bench_poll(args.rows)
+    elif args.scenario == "whatsapp":
+        bench_whatsapp(args.messages, args.partners, error_rate=args.error_rate)
+    elif args.scenario == "ledger":
+        bench_ledger(args.leads)
+    elif args.scenario == "leadgen":
+        bench_leadgen(args.leads)
+    elif args.scenario == "allocation":
+        bench_allocation(args.leads, args.partners)
+    elif args.scenario == "jobs":
+        bench_jobs(args.jobs)
+    elif args.scenario == "leases":
+        bench_leases(args.processes, args.rows)
+    elif args.scenario == "partner-api":
+        bench_partner_api(args.requests, args.partners)
+    elif args.scenario == "reconcile":
+        bench_reconcile(args.sessions, args.partners)
+    elif args.scenario == "export":
+        bench_export(args.rows)
+    elif args.scenario == "startup":
+        bench_startup(args.runs)
+    elif args.scenario in SUITE:
+        if args.quick:
+            args.leads, args.partners = 100, 1000
+        result = SUITE[args.scenario](
+            leads=args.leads, partners=args.partners, sheets_latency=args.latency,
+            graph_latency=args.graph_latency, error_rate=args.error_rate,
+            quota_per_min=args.quota)
+        if args.json_out:
+            with open(args.json_out, "w") as f:
+                json.dump(result, f)
+    elif args.scenario == "suite":
+        results = run_suite(args.only, args.quick, args.latency, args.error_rate)
+        if args.save:
+            with open(args.save, "w") as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+            print(f"\nBaseline gespeichert: {args.save}")
+        if args.compare:
+            with open(args.compare) as f:
+                regressions = compare_baseline(results, json.load(f), args.tolerance)
+            if regressions:
+                print(f"\n{len(regressions)} Regression(en): {', '.join(regressions)}")
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()